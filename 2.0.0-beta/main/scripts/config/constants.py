@@ -4,6 +4,8 @@
 常數定義模組
 """
 
+import os
+
 # 應用程式資訊
 APP_NAME = "oldfish影片下載器"
 APP_VERSION = "2.1.0-Release"
@@ -23,14 +25,110 @@ AUDIO_QUALITIES = [
     {"label": "96kbps", "value": "96"},
 ]
 
-# 預設設定
+# 分段下載（http_chunk_size）：以固定大小的 Range 請求下載，避開單一長連線被限速
+# 依 extractor_key（小寫，如 TwitchVod → 'twitchvod'）調整，未列出者使用 'default'；值為 0 代表不分段
+HTTP_CHUNK_SIZE_BY_EXTRACTOR = {
+    'default': 10 * 1024 * 1024,
+    'youtube': 10 * 1024 * 1024,
+    'bilibili': 4 * 1024 * 1024,
+    'twitchvod': 0,  # HLS 分片下載，不需要 Range 分段
+}
+
+# 限速偵測：下載速度持續低於下限（KB/s）達指定秒數時，中止本次嘗試並重新解析串流網址
+# 重新解析後由 .part 檔續傳；下限為 0 代表停用偵測
+THROTTLE_SPEED_FLOOR_KB = 64
+THROTTLE_WINDOW_SECONDS = 20
+THROTTLE_MAX_REEXTRACT = 3
+
+# 下載停滯監控：任務超過指定秒數沒有任何位元組或處理階段進度，即視為卡住
+# 釋放其下載名額並依重試規則重新排入佇列
+STALL_TIMEOUT_SECONDS = 300
+WATCHDOG_INTERVAL_SECONDS = 5
+
+# 下載子行程（設定 useProcessWorkers）：下載中進度/心跳送回主行程的最短間隔（秒）
+PROCESS_WORKER_PROGRESS_INTERVAL_SECONDS = 0.1
+# 送出取消後子行程超過此秒數仍未結束任務（卡在網路 I/O 或 ffmpeg），即強制結束該子行程
+PROCESS_WORKER_CANCEL_GRACE_SECONDS = 10
+
+# 下載管線：解析 → 網路傳輸 → 後處理，各階段有獨立名額
+# 網路傳輸名額即同時下載上限（maxConcurrentDownloads）；下載進入 ffmpeg 後處理時釋放網路名額
+PIPELINE_EXTRACT_SLOTS = 2       # 同時進行的下載前解析數
+PIPELINE_EXTRACT_AHEAD = 2       # 下載進行中可預先解析、等待網路名額的後續任務數
+PIPELINE_POSTPROCESS_SLOTS = 2   # 同時進行的後處理（合併/轉檔）數
+# ffmpeg 後處理資源控管：同時執行的 ffmpeg 數、核心預算（0 = 核心數扣除保留給 UI 的核心）
+# 每個 ffmpeg 的 -threads = 核心預算 // 同時數；ffmpeg 子行程的 nice 值（Windows 使用 BELOW_NORMAL）
+FFMPEG_MAX_JOBS = PIPELINE_POSTPROCESS_SLOTS
+FFMPEG_CORE_BUDGET = 0
+FFMPEG_RESERVED_CORES = 1
+FFMPEG_NICE = 10
+# 預先解析的資訊在此秒數內直接用於下載（超過則重新解析，避免串流網址過期）
+PREPARED_INFO_MAX_AGE_SECONDS = 600
+# 同一影片的音訊輸出可從這些格式的已下載影片在本地產生（不再下載一次）
+DERIVE_SOURCE_FORMATS = ('mp4', 'mkv', 'webm')
+
+# 下載寫入：暫存目錄建在下載目錄內（與最終檔案同一磁碟區，完成時只需 rename）
+# 寫入緩衝（KB）累積小區塊後再寫入檔案，可由設定 writeBufferKB 調整；0 代表不另外緩衝
+STORAGE_TEMP_DIRNAME = '.downloading'
+STORAGE_WRITE_BUFFER_KB = 1024
+# 空間預留：開始下載前依預估大小向下載目錄所在磁碟區預留空間，並保留最少可用空間（MB，設定 minFreeSpaceMB）
+# 放不下的任務等待其他任務結束釋放預留，或每隔指定秒數重新檢查（例如使用者清出空間）
+STORAGE_MIN_FREE_MB = 512
+STORAGE_SPACE_RECHECK_SECONDS = 10
+
+# 預設設定（下載相關的預設值直接引用上方常數，避免兩處數值不一致）
 DEFAULT_SETTINGS = {
     'enableNotifications': True,
     'addResolutionToFilename': False,
     'customDownloadPath': '',
-    'maxConcurrentDownloads': 3
+    'maxConcurrentDownloads': 3,
+    'enableChunkedDownload': True,
+    'parallelStreamDownload': True,
+    'throttleSpeedFloorKB': THROTTLE_SPEED_FLOOR_KB,
+    'writeBufferKB': STORAGE_WRITE_BUFFER_KB,
+    'minFreeSpaceMB': STORAGE_MIN_FREE_MB,
+    'useProcessWorkers': False,
+    'useProcessExtraction': False
+}
+
+# 排程器啟動節流：兩個下載任務開始的最小間隔（秒），避免同時啟動大量 yt-dlp 實例
+DOWNLOAD_START_INTERVAL_SECONDS = 0.5
+
+# 下載進度送往前端的批次頻率（毫秒，100 = 10 Hz）
+PROGRESS_FLUSH_INTERVAL_MS = 100
+
+# 前端事件匯流排的批次事件（例如播放清單畫質）合併送出間隔（毫秒）
+UI_EVENT_BATCH_INTERVAL_MS = 100
+
+# 播放清單資訊分頁送往前端：每頁條目數與頁間間隔（毫秒，讓前端在頁與頁之間繪製）
+INFO_PAGE_SIZE = 100
+INFO_PAGE_INTERVAL_MS = 16
+
+# 影片資訊解析行程池（設定 useProcessExtraction）的行程數；0 代表依 CPU 核心數
+EXTRACTION_PROCESS_WORKERS = 0
+
+# 背景執行器：名稱 -> (工作執行緒數, 佇列上限)；佇列滿時新工作會被拒絕
+# extraction 至少與 CPU 核心數相同，啟用解析行程池時每個核心都有執行緒送工作
+EXECUTOR_LIMITS = {
+    'extraction': (max(4, os.cpu_count() or 4), 10000),  # yt-dlp 資訊解析（含播放清單逐支畫質）
+    'file_io': (4, 1000),        # 下載受理、刪檔等檔案操作
+    'ui_effects': (2, 100),      # 開啟資料夾、更新 yt-dlp
+    'download': (3, 1000),       # 舊版單次下載介面（排程器另有工作執行緒）
 }
 
+# 下載目錄索引：輪詢目錄變動的間隔（秒）
+CATALOG_POLL_INTERVAL_SECONDS = 2
+
+# 影片資訊快取（供推算輸出檔名等用途，避免重複 extract_info）
+INFO_CACHE_MAX_ENTRIES = 2000
+INFO_CACHE_TTL_SECONDS = 6 * 3600
+
+# 主線程卡頓監測（量測模式）：以心跳計時器量測 Qt 事件迴圈延遲，
+# 超過門檻時記錄主線程堆疊與正在執行的 slot；預設關閉，可在此開啟
+UI_STALL_WATCHDOG_ENABLED = False
+UI_HEARTBEAT_INTERVAL_MS = 50
+UI_STALL_THRESHOLD_MS = 250
+UI_STALL_SAMPLE_WINDOW = 6000  # 計算百分位數時保留的最近延遲樣本數
+
 # 視窗設定
 WINDOW_WIDTH = 1000
 WINDOW_HEIGHT = 640
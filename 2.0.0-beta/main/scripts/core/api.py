@@ -9,6 +9,7 @@ print("api.py is starting...")
 import os
 import sys
 import json
+import itertools
 import threading
 import subprocess
 import yt_dlp
@@ -26,8 +27,19 @@ from scripts.utils.logger import api_console, download_console, video_info_conso
 from scripts.utils.file_utils import safe_path_join, get_download_path, resolve_relative_path, get_deno_path
 from scripts.utils.version_utils import compare_versions
 from scripts.config.settings import SettingsManager
-from .video_info import extract_video_info, is_playlist_url, extract_playlist_info, get_video_qualities_and_formats
+from .video_info import extract_video_info, is_playlist_url, extract_playlist_info, get_video_qualities_and_formats, remember_video_info, get_cached_video_info, set_extraction_service
 from .downloader import Downloader, DownloadScheduler
+from .catalog import DownloadCatalog
+from .process_workers import DownloadProcessPool
+from .extraction_service import ExtractionService
+from .ffmpeg_governor import governor as ffmpeg_governor
+from .postprocess_planner import plan_stats
+from .storage import stats as storage_stats
+from .progress import ProgressAggregator
+from .ui_events import UiEventBus, to_json_compatible
+from . import executors
+from .executors import ExecutorBusy
+from scripts.config.constants import PROGRESS_FLUSH_INTERVAL_MS, DERIVE_SOURCE_FORMATS, STORAGE_MIN_FREE_MB
 
 
 def _open_in_explorer_win(path):
@@ -114,10 +126,25 @@ class Api(QObject):
         self.task_download_paths = {}  # 追蹤每個任務的下載路徑
         self.task_formats = {}  # 追蹤每個任務的格式（用於避免同名文件不同格式時抓錯狀態）
         self.task_urls = {}  # 追蹤每個任務的 URL（用於檢查同名影片）
-        self.downloading_urls = set()  # 正在下載的 URL 集合
+        self.downloading_urls = {}  # 正在下載的 URL -> {task_id: {'key', 'outtmpl', 'ext'}}（同一 URL 不同輸出可同時下載）
         self.pending_tasks_by_url = {}  # 按 URL 分組的等待任務列表
+        self.derived_tasks = set()  # 從已下載的影片在本地產生音訊的任務（不佔用 downloading_urls）
+        self.inflight_requests = {}  # 請求鍵（URL、格式、畫質、目錄、檔名設定）-> 正在下載的任務ID
+        self.task_followers = {}  # 任務ID -> 跟隨其下載的相同請求任務ID列表
+        self.follower_of = {}  # 跟隨中的任務ID -> 被跟隨的任務ID
         self.notification_handler = None
-        self._last_progress_percent = {}
+        # 後端 → 前端的事件匯流排（由主視窗以 'events' 名稱註冊到 QWebChannel）
+        self.events = UiEventBus(self)
+        # 下載進度彙整：只保留每個任務最新狀態，由計時器固定頻率整批送往前端
+        self.progress = ProgressAggregator(self._push_progress_batch)
+        self._progress_timer = QTimer(self)
+        self._progress_timer.setInterval(PROGRESS_FLUSH_INTERVAL_MS)
+        self._progress_timer.timeout.connect(self.progress.flush)
+        self._progress_timer.start()
+        # 非同步資訊查詢：交給 extraction 執行器，記錄進行中的請求（request_id -> Future）
+        self._api_requests = {}
+        self._api_request_seq = itertools.count(1)
+        self._deprecation_warned = set()
         
         # 初始化組件
         self.settings_manager = SettingsManager(root_dir)
@@ -127,18 +154,67 @@ class Api(QObject):
             complete_callback=self._notify_download_complete_safely
         )
 
+        # 最近一次讀到的下載目錄/檔名設定（供主線程上的快速查詢使用，不在主線程讀檔）
+        self._admission_snapshot = {
+            'downloads_dir': safe_path_join(root_dir, 'downloads'),
+            'add_resolution': False,
+        }
+
         # 全域下載排程器：同時下載上限/重試次數（先用設定或預設值）
         try:
             settings = self.settings_manager.load_settings()
+            self._admission_snapshot = {
+                'downloads_dir': get_download_path(self.root_dir, self.settings_manager),
+                'add_resolution': settings.get('addResolutionToFilename', False),
+            }
             max_c = int(settings.get('maxConcurrentDownloads', 3) or 3)
+            use_process_workers = bool(settings.get('useProcessWorkers', False))
+            use_process_extraction = bool(settings.get('useProcessExtraction', False))
+            min_free_mb = int(settings.get('minFreeSpaceMB', STORAGE_MIN_FREE_MB) or 0)
+            self.downloader.throttle_avoidance = bool(settings.get('enableChunkedDownload', True))
+            self.downloader.parallel_streams = bool(settings.get('parallelStreamDownload', True))
+            self.downloader.write_buffer_kb = int(settings.get('writeBufferKB', self.downloader.write_buffer_kb) or 0)
+            self.downloader.throttle_floor_kb = int(settings.get('throttleSpeedFloorKB', self.downloader.throttle_floor_kb) or 0)
         except Exception:
             max_c = 3
+            use_process_workers = False
+            use_process_extraction = False
+            min_free_mb = STORAGE_MIN_FREE_MB
+        # 下載改在預先啟動的子行程中執行（避免與 UI 搶 GIL）；啟動失敗時維持在本行程下載
+        if use_process_workers:
+            try:
+                self.downloader.process_pool = DownloadProcessPool(self.downloader, size=max_c)
+                self.downloader.process_pool.start()
+            except Exception as e:
+                download_console(f"啟動下載子行程失敗，改在本行程下載: {e}", level=LogLevel.WARNING)
+                self.downloader.process_pool = None
+        # 影片資訊解析改用行程池（可使用多個 CPU 核心）；函式介面不變
+        self.extraction_service = None
+        if use_process_extraction:
+            try:
+                self.extraction_service = ExtractionService()
+                self.extraction_service.start()
+                set_extraction_service(self.extraction_service)
+            except Exception as e:
+                api_console(f"啟動解析行程池失敗，改在本行程解析: {e}", level=LogLevel.WARNING)
+                self.extraction_service = None
         self.scheduler = DownloadScheduler(
             self.downloader,
             max_concurrent=max_c,
             retry_count=3,
             status_callback=self._scheduler_status_update,
+            min_free_mb=min_free_mb,
         )
+
+        # 下載目錄索引：啟動時於背景掃描，之後監看目錄變動
+        self.catalog = DownloadCatalog()
+        try:
+            self.catalog.start([
+                get_download_path(self.root_dir, self.settings_manager),
+                safe_path_join(self.root_dir, "downloads"),
+            ])
+        except Exception as e:
+            api_console(f"啟動下載目錄索引失敗: {e}", level=LogLevel.WARNING)
         
         # 連接信號
         self.eval_js_requested.connect(self._on_eval_js_requested)
@@ -192,32 +268,159 @@ class Api(QObject):
                         api_console(f"播放清單資訊結構: is_playlist={playlist_info.get('is_playlist')}, video_count={playlist_info.get('video_count')}")
                         api_console(f"準備發送 infoReady 信號...")
                         self.infoReady.emit(playlist_info)
+                        self.events.send_info(playlist_info)
                         api_console(f"infoReady 信號已發送")
                     else:
                         api_console(f"播放清單資訊為 None，發送錯誤信號")
                         self.infoError.emit("無法獲取播放清單資訊")
+                        self.events.post('infoError', "無法獲取播放清單資訊")
                 else:
                     api_console(f"不是播放清單URL，按單個影片處理")
                     info = extract_video_info(url, self.root_dir)
                     if info:
                         api_console(f"影片資訊提取完成，發送 infoReady 信號")
                         self.infoReady.emit(info)
+                        self.events.send_info(info)
                     else:
                         api_console(f"影片資訊為 None，發送錯誤信號")
                         self.infoError.emit("無法獲取影片資訊")
+                        self.events.post('infoError', "無法獲取影片資訊")
             except Exception as e:
                 api_console(f"start_get_video_info 發生異常: {e}", level=LogLevel.ERROR)
                 api_console(f"異常詳情: {type(e).__name__}: {str(e)}")
                 import traceback
                 api_console(f"完整堆疊:\n{traceback.format_exc()}")
                 self.infoError.emit(str(e))
+                self.events.post('infoError', str(e))
         
-        api_console(f"啟動背景執行緒處理 URL: {url}")
-        threading.Thread(target=task, daemon=True).start()
+        api_console(f"交給 extraction 執行器處理 URL: {url}")
+        try:
+            executors.submit('extraction', task)
+        except ExecutorBusy as e:
+            api_console(f"無法排入影片資訊解析: {e}", level=LogLevel.WARNING)
+            self.events.post('infoError', "目前解析工作過多，請稍後再試")
+            return 'busy'
         return 'started'
     
     @Slot(str, result='QVariant')
     def get_playlist_info(self, url):
+        """獲取播放清單資訊（已棄用：會在主線程同步解析，請改用 get_playlist_info_async）"""
+        self._warn_deprecated('get_playlist_info', 'get_playlist_info_async')
+        return self._fetch_playlist_info(url)
+    
+    @Slot(str, result='QVariant')
+    def get_video_qualities_formats(self, url):
+        """獲取單個影片的畫質和格式選項（已棄用：請改用 get_video_qualities_formats_async）"""
+        self._warn_deprecated('get_video_qualities_formats', 'get_video_qualities_formats_async')
+        return self._fetch_video_qualities_formats(url)
+
+    @Slot(str, str, result=str)
+    def get_video_info_async(self, request_id, url):
+        """非同步獲取影片資訊，立即回傳 request_id，完成後以 window.__resolveApiRequest 回推"""
+        return self._submit_api_request(request_id, self._fetch_video_info, url)
+
+    @Slot(str, str, result=str)
+    def get_playlist_info_async(self, request_id, url):
+        """非同步獲取播放清單資訊（見 get_video_info_async）"""
+        return self._submit_api_request(request_id, self._fetch_playlist_info, url)
+
+    @Slot(str, str, result=str)
+    def get_video_qualities_formats_async(self, request_id, url):
+        """非同步獲取單個影片的畫質和格式選項（見 get_video_info_async）"""
+        return self._submit_api_request(request_id, self._fetch_video_qualities_formats, url)
+
+    @Slot(str, result=str)
+    def cancel_api_request(self, request_id):
+        """取消非同步請求（例如使用者離開頁面）；尚未開始的直接取消，執行中的結果會被丟棄"""
+        with self._lock:
+            future = self._api_requests.pop(str(request_id), None)
+        if future is None:
+            return "NOT_FOUND"
+        future.cancel()
+        api_console(f"已取消非同步請求 {request_id}")
+        return "CANCELLED"
+
+    def _submit_api_request(self, request_id, func, *args):
+        """將請求交給 extraction 執行器；request_id 由前端產生（確保結果回推前已登記），空值時自動產生"""
+        request_id = str(request_id or '') or f"py-{next(self._api_request_seq)}"
+        try:
+            with self._lock:
+                self._api_requests[request_id] = executors.submit('extraction', self._run_api_request, request_id, func, args)
+        except Exception as e:
+            api_console(f"提交非同步請求失敗: {e}", level=LogLevel.ERROR)
+            self._resolve_api_request(request_id, False, str(e))
+        return request_id
+
+    def _run_api_request(self, request_id, func, args):
+        with self._lock:
+            if request_id not in self._api_requests:
+                return  # 已取消
+        try:
+            result = func(*args)
+            ok = True
+        except Exception as e:
+            api_console(f"非同步請求 {request_id} 失敗: {e}", level=LogLevel.ERROR)
+            result = str(e)
+            ok = False
+        with self._lock:
+            if self._api_requests.pop(request_id, None) is None:
+                return  # 執行期間被取消，丟棄結果
+        self._resolve_api_request(request_id, ok, result)
+
+    def _resolve_api_request(self, request_id, ok, payload):
+        """回推結果給前端的 Promise（經事件匯流排的 apiResponse 信號）"""
+        self.events.post('apiResponse', str(request_id), bool(ok), to_json_compatible(payload))
+
+    def shutdown(self):
+        """關閉視窗時停止 Api 自身的背景工作（執行器由主視窗在之後統一關閉）"""
+        try:
+            with self._lock:
+                pending, self._api_requests = self._api_requests, {}
+            for future in pending.values():
+                future.cancel()
+            self.catalog.stop()
+            # 先停止排程器（中止執行中的嘗試），再關閉下載子行程
+            self.scheduler.stop()
+            if self.downloader.process_pool is not None:
+                self.downloader.process_pool.stop()
+            if self.extraction_service is not None:
+                set_extraction_service(None)
+                self.extraction_service.shutdown()
+        except Exception as e:
+            api_console(f"停止背景工作失敗: {e}", level=LogLevel.WARNING)
+
+    @Slot(result='QVariant')
+    def get_executor_stats(self):
+        """各背景執行器的佇列深度、執行中數量與等待/執行時間（p50/p99）"""
+        return executors.executor_stats()
+
+    @Slot(result='QVariant')
+    def get_pipeline_stats(self):
+        """下載管線各階段（解析/下載/後處理）的名額使用與等待/執行時間（p50/p99），以及 ffmpeg 控管、後處理計畫、寫入吞吐量與空間預留統計"""
+        stats = self.scheduler.stage_stats()
+        stats['ffmpeg'] = ffmpeg_governor.stats()
+        stats['postprocess_plans'] = plan_stats()
+        stats['storage'] = storage_stats()
+        stats['storage']['buffer_kb'] = self.downloader.write_buffer_kb
+        stats['storage']['space'] = self.scheduler.space_stats()
+        return stats
+
+    @Slot(str, result=int)
+    def cancel_playlist_qualities_fetch(self, _reason=''):
+        """取消尚未開始的播放清單畫質提取（例如關閉播放清單視窗），回傳取消數量"""
+        cancelled = executors.get_executor('extraction').cancel_group('playlist-qualities')
+        if cancelled:
+            api_console(f"已取消 {cancelled} 個尚未開始的畫質提取")
+        return cancelled
+
+    def _warn_deprecated(self, name, replacement):
+        """每個已棄用的同步 Slot 只提示一次"""
+        if name in self._deprecation_warned:
+            return
+        self._deprecation_warned.add(name)
+        api_console(f"{name} 已棄用：會在主線程同步解析並凍結視窗，請改用 {replacement}", level=LogLevel.WARNING)
+
+    def _fetch_playlist_info(self, url):
         """獲取播放清單資訊"""
         try:
             api_console(f"獲取播放清單資訊: {url}", level=LogLevel.INFO)
@@ -226,9 +429,8 @@ class Api(QObject):
         except Exception as e:
             api_console(f"獲取播放清單資訊失敗: {e}", level=LogLevel.ERROR)
             return None
-    
-    @Slot(str, result='QVariant')
-    def get_video_qualities_formats(self, url):
+
+    def _fetch_video_qualities_formats(self, url):
         """獲取單個影片的畫質和格式選項（用於播放清單）"""
         try:
             return get_video_qualities_and_formats(url, self.root_dir)
@@ -257,37 +459,25 @@ class Api(QObject):
             if not isinstance(items, list):
                 return "FAILED: invalid payload"
 
-            # 受控併發，避免同時開太多 yt-dlp extract_info
-            max_concurrent = 4
-            sem = threading.Semaphore(max_concurrent)
-
+            # 併發由 extraction 執行器的工作執行緒數控制，避免同時開太多 yt-dlp extract_info
             def worker(idx, url):
                 if url is None:
                     return
                 u = str(url).strip()
                 if not u:
                     return
-                sem.acquire()
                 try:
                     result = get_video_qualities_and_formats(u, self.root_dir) or {}
                     qualities = result.get('qualities') or []
-                    # 用 JS 物件回推（_safe_eval_js 會把 list 轉成字串，不適合）
-                    payload = json.dumps(qualities, ensure_ascii=False)
-                    js = f"(function(){{ try{{ if (window.__onPlaylistVideoQualities){{ window.__onPlaylistVideoQualities({int(idx)}, {payload}); }} }}catch(e){{ console.error(e); }} }})();"
-                    self._eval_js(js)
+                    # 經事件匯流排合併成 qualitiesBatch 送出
+                    self.events.append('qualitiesBatch', {'index': int(idx), 'qualities': to_json_compatible(qualities)})
                 except Exception as e:
                     # 失敗時回推空陣列（前端可維持預設）
                     try:
-                        js = f"(function(){{ try{{ if (window.__onPlaylistVideoQualities){{ window.__onPlaylistVideoQualities({int(idx)}, []); }} }}catch(e){{}} }})();"
-                        self._eval_js(js)
+                        self.events.append('qualitiesBatch', {'index': int(idx), 'qualities': []})
                     except Exception:
                         pass
                     video_info_console(f"提取畫質失敗 idx={idx}: {e}", level=LogLevel.ERROR)
-                finally:
-                    try:
-                        sem.release()
-                    except Exception:
-                        pass
 
             started = 0
             for it in items:
@@ -297,8 +487,13 @@ class Api(QObject):
                 url = it.get('url')
                 if idx is None or url is None:
                     continue
-                t = threading.Thread(target=worker, args=(idx, url), daemon=True)
-                t.start()
+                try:
+                    executors.submit('extraction', worker, idx, url, group='playlist-qualities')
+                except ExecutorBusy as e:
+                    # 佇列已滿：回推空陣列，前端維持預設畫質
+                    video_info_console(f"提取畫質未排入 idx={idx}: {e}", level=LogLevel.WARNING)
+                    self.events.append('qualitiesBatch', {'index': int(idx), 'qualities': []})
+                    continue
                 started += 1
 
             return f"OK:{started}"
@@ -308,6 +503,11 @@ class Api(QObject):
     
     @Slot(str, result='QVariant')
     def get_video_info(self, url):
+        """獲取影片資訊（已棄用：會在主線程同步解析，請改用 get_video_info_async）"""
+        self._warn_deprecated('get_video_info', 'get_video_info_async')
+        return self._fetch_video_info(url)
+
+    def _fetch_video_info(self, url):
         """獲取影片資訊"""
         api_console(f"取得影片資訊: {url}", level=LogLevel.INFO)
         try:
@@ -350,6 +550,7 @@ class Api(QObject):
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info_dict = ydl.extract_info(url, download=False)
             api_console("yt-dlp.extract_info 完成")
+            remember_video_info(url, info_dict)
             
             # 詳細調試信息
             api_console(f"info_dict 類型: {type(info_dict)}")
@@ -602,39 +803,39 @@ class Api(QObject):
                     if eta_str:
                         status = f"{status} - 剩餘 {eta_str}"
                 
-                download_console(f"[進度] 任務{task_id}: {percent:.1f}% - {status}", level=LogLevel.INFO)
-                try:
-                    with self._lock:
-                        self._last_progress_percent[str(task_id)] = float(percent)
-                except Exception:
-                    pass
+                # 曾因限速重新解析串流，附註次數
+                reextract_count = d.get('reextract_count') or 0
+                if reextract_count:
+                    status = f"{status}（已重新解析 {reextract_count} 次）"
+                
                 # 傳遞當前檔案路徑（若可得）以保持與舊版一致
                 file_arg = d.get('filename') or ''
                 safe_file_arg = (file_arg or '').replace('\\', '/')
                 # 獲取任務格式（用於避免同名文件不同格式時抓錯狀態）
-                task_format = ''
-                task_url = ''
                 with self._lock:
                     task_format = self.task_formats.get(str(task_id), '')
-                    task_url = self.task_urls.get(str(task_id), '')
-                download_console(f"[進度更新] 任務{task_id}: {percent:.1f}% - {status}, 格式: {task_format}, URL: {task_url}", level=LogLevel.DEBUG)
-                # 傳遞 status（已包含 ETA）和格式給前端
-                self._safe_eval_js("window.updateDownloadProgress", task_id, percent, status, '', safe_file_arg, task_format)
+                download_console(f"[進度] 任務{task_id}: {percent:.1f}% - {status}", level=LogLevel.DEBUG)
+                # 交給彙整器，由計時器整批送出（status 已包含 ETA）；跟隨的相同請求顯示相同進度
+                for tid in self._task_and_followers(task_id):
+                    self.progress.update(tid, percent, status, '', safe_file_arg, task_format)
             elif status_key == 'finished':
                 try:
                     download_console(f"任務 {task_id} 已完成", level=LogLevel.INFO)
                     file_arg = d.get('filename') or ''
                     safe_file_arg = (file_arg or '').replace('\\', '/')
                     # 獲取任務格式
-                    task_format = ''
-                    task_url = ''
                     with self._lock:
                         task_format = self.task_formats.get(str(task_id), '')
-                        task_url = self.task_urls.get(str(task_id), '')
-                    download_console(f"[完成通知] 任務{task_id}: 已完成, 格式: {task_format}, URL: {task_url}", level=LogLevel.DEBUG)
-                    self._safe_eval_js("window.updateDownloadProgress", task_id, 100, "已完成", '', safe_file_arg, task_format)
+                    # 單一串流下載完成（之後可能還有其他串流或後處理），非任務終止狀態
+                    for tid in self._task_and_followers(task_id):
+                        self.progress.update(tid, 100, "已完成", '', safe_file_arg, task_format)
                 except Exception as e:
                     download_console(f"完成進度回報失敗: {e}", level=LogLevel.ERROR)
+            elif status_key == 'reextracting':
+                # 偵測到限速，下載器正在重新解析串流網址（保留目前進度）
+                reextract_count = d.get('reextract_count') or 0
+                download_console(f"【任務{task_id}】偵測到限速，重新解析串流網址（第 {reextract_count} 次）", level=LogLevel.INFO)
+                self._scheduler_status_update(task_id, f"偵測到限速，重新解析中（第 {reextract_count} 次）")
             else:
                 # 處理其他未知狀態
                 download_console(f"【任務{task_id}】未知狀態: {status_key}")
@@ -643,15 +844,24 @@ class Api(QObject):
         except Exception as e:
             download_console(f"【任務{task_id}】進度回調處理失敗: {e}", level=LogLevel.ERROR)
 
+    def _push_progress_batch(self, updates):
+        """整批送出進度更新（一則 progressBatch 事件）"""
+        self.events.post('progressBatch', updates)
+
     def _scheduler_status_update(self, task_id, status_text):
         """排程器狀態更新（例如重試中），只更新狀態文字，不重置進度條。"""
         try:
             with self._lock:
-                p = self._last_progress_percent.get(str(task_id), 0.0)
                 task_format = self.task_formats.get(str(task_id), '')
-            self._safe_eval_js("window.updateDownloadProgress", int(task_id), float(p), str(status_text), '', '', task_format)
+            for tid in self._task_and_followers(task_id):
+                self.progress.update(int(tid), None, str(status_text), '', '', task_format)
         except Exception:
             pass
+
+    def _task_and_followers(self, task_id):
+        """任務本身與跟隨它的相同請求任務"""
+        with self._lock:
+            return [task_id] + list(self.task_followers.get(str(task_id), ()))
     
     def _notify_download_complete_safely(self, task_id, url, error=None, file_path=None):
         """安全地通知下載完成"""
@@ -665,20 +875,30 @@ class Api(QObject):
                 self.completed_tasks.add(task_id)
             download_console("[DBG] _notify_download_complete_safely 已釋放 _lock(completed_tasks)", level=LogLevel.DEBUG)
 
+            with self._lock:
+                # 本地產生的任務與跟隨中的任務沒有標記正在下載，也不接手等待中的任務
+                unmarked = str(task_id) in self.derived_tasks or self.follower_of.pop(str(task_id), None) is not None
+                self.derived_tasks.discard(str(task_id))
+                # 與取出跟隨者在同一個鎖區塊移除正在下載標記，之後的相同請求不會再跟隨到已結束的任務
+                followers = self.task_followers.pop(str(task_id), [])
+                released = False if unmarked else self._unmark_downloading_locked(task_id, url)
+
             if error:
+                # 終止狀態：丟棄尚未送出的進度更新
+                self.progress.finish(task_id, percent=None)
                 self._safe_eval_js("window.onDownloadError", task_id, error)
                 # 即使出錯，也要移除正在下載標記，並處理等待中的任務
-                with self._lock:
-                    if url in self.downloading_urls:
-                        self.downloading_urls.discard(url)
-                download_console("[DBG] _notify_download_complete_safely 即將 _process_pending_tasks_for_url (error 分支)", level=LogLevel.DEBUG)
-                self._process_pending_tasks_for_url(url)
+                if not unmarked:
+                    download_console("[DBG] _notify_download_complete_safely 即將 _process_pending_tasks_for_url (error 分支)", level=LogLevel.DEBUG)
+                    self._process_pending_tasks_for_url(url)
             else:
                 # 記錄最終檔案路徑到任務追蹤中
                 if file_path:
                     with self._lock:
                         self.task_download_paths[str(task_id)] = file_path
                     download_console(f"任務 {task_id} 最終檔案路徑已記錄: {file_path}")
+                    cached = get_cached_video_info(url) or {}
+                    self.catalog.add_file(file_path, video_id=cached.get('id'))
                 
                 # 與舊版一致，將最終檔案路徑傳給前端以啟用「開啟資料夾」按鈕
                 safe_file = (file_path or '').replace('\\', '/')
@@ -686,24 +906,28 @@ class Api(QObject):
                 task_format = ''
                 with self._lock:
                     task_format = self.task_formats.get(str(task_id), '')
-                self._safe_eval_js("window.updateDownloadProgress", task_id, 100, "已完成", '', safe_file, task_format)
+                self.progress.finish(task_id, 100, "已完成", '', safe_file, task_format)
                 
                 # 移除正在下載標記（鎖內僅做狀態更新，鎖外再處理等待任務，避免死鎖）
-                with self._lock:
-                    if url in self.downloading_urls:
-                        self.downloading_urls.discard(url)
+                if not unmarked:
+                    if released:
                         download_console(f"任務 {task_id} 下載完成，移除 URL {url} 的正在下載標記")
-                download_console("[DBG] _notify_download_complete_safely 即將 _process_pending_tasks_for_url (完成分支)", level=LogLevel.DEBUG)
-                self._process_pending_tasks_for_url(url)
+                    download_console("[DBG] _notify_download_complete_safely 即將 _process_pending_tasks_for_url (完成分支)", level=LogLevel.DEBUG)
+                    # 等待中的音訊任務可直接從剛下載的檔案產生
+                    self._process_pending_tasks_for_url(url, source_path=file_path)
 
             download_console("[DBG] _notify_download_complete_safely 即將 _safe_eval_js onDownloadComplete", level=LogLevel.DEBUG)
             self._safe_eval_js("window.onDownloadComplete", task_id)
+
+            # 跟隨的相同請求以同一個結果（相同檔案路徑或錯誤）完成
+            for follower_id in followers:
+                self._notify_download_complete_safely(follower_id, url, error=error, file_path=file_path)
             
             # 發送通知
             settings = self.settings_manager.load_settings()
             if settings.get('enableNotifications', True):
                 try:
-                    self._safe_eval_js("window.__ofShowToast", "下載完成", f"任務 {task_id} 已完成")
+                    self.events.post('toast', "下載完成", f"任務 {task_id} 已完成")
                 except Exception as toast_err:
                     download_console(f"顯示 Toast 失敗: {toast_err}")
                 self._send_notification("下載完成", f"任務 {task_id} 已完成")
@@ -746,10 +970,15 @@ class Api(QObject):
         download_console(f"收到下載請求: {url}", level=LogLevel.INFO)
         return "下載功能尚未實作"
     
-    def _process_pending_tasks_for_url(self, url):
-        """處理等待中的同名任務（當一個任務完成時）"""
+    def _process_pending_tasks_for_url(self, url, source_path=None):
+        """處理等待中的同名任務（當一個任務完成時）
+
+        source_path 為剛完成的影片檔時，等待中的音訊任務全部改為從該檔案在本地產生（不再下載），
+        其餘任務照舊取出一個開始下載。
+        """
         try:
             download_console(f"[DBG] _process_pending_tasks_for_url 進入 url={url[:50]}...", level=LogLevel.DEBUG)
+            derivable = self._is_derive_source(source_path)
             download_console("[DBG] _process_pending_tasks_for_url 即將取得 _lock", level=LogLevel.DEBUG)
             with self._lock:
                 if url not in self.pending_tasks_by_url:
@@ -761,94 +990,73 @@ class Api(QObject):
                     download_console("[DBG] _process_pending_tasks_for_url 列表空，return", level=LogLevel.DEBUG)
                     return
 
-                pending_task = pending_tasks.pop(0)
-                task_id = pending_task['task_id']
+                derived = []
+                if derivable:
+                    derived = [t for t in pending_tasks if t['format'] == '音訊']
+                    pending_tasks[:] = [t for t in pending_tasks if t['format'] != '音訊']
+                    for t in derived:
+                        self.derived_tasks.add(str(t['task_id']))
+                # 依序重新判斷：可同時下載的開始下載，與已開始的相同請求則跟隨，其餘繼續等待
+                started = []
+                attached = []
+                remaining = []
+                for t in pending_tasks:
+                    key, outtmpl = self._request_identity(
+                        url, t['quality'], t['format'], t['downloads_dir'], t['add_resolution'], t['original_format']
+                    )
+                    action, primary = self._sibling_action_locked(url, key, outtmpl, t['format'])
+                    if action == 'start':
+                        self._mark_downloading_locked(t['task_id'], url, key, outtmpl, t['original_format'])
+                        started.append(t)
+                    elif action == 'attach':
+                        self._attach_locked(t['task_id'], primary)
+                        attached.append((t, primary))
+                    else:
+                        remaining.append(t)
 
-                if not pending_tasks:
+                if remaining:
+                    pending_tasks[:] = remaining
+                else:
                     del self.pending_tasks_by_url[url]
-
-                self.downloading_urls.add(url)
             download_console("[DBG] _process_pending_tasks_for_url 已釋放 _lock", level=LogLevel.DEBUG)
-            download_console(f"開始下載等待中的任務 {task_id}（URL: {url}）", level=LogLevel.INFO)
 
-            task_format = ''
-            download_console("[DBG] _process_pending_tasks_for_url 即將取得 _lock(task_format)", level=LogLevel.DEBUG)
-            with self._lock:
-                task_format = self.task_formats.get(str(task_id), '')
-            download_console("[DBG] _process_pending_tasks_for_url 已釋放 _lock，即將 _safe_eval_js", level=LogLevel.DEBUG)
-            self._safe_eval_js("window.updateDownloadProgress", task_id, 0, "等待中", '', '', task_format)
-            
-            # 將任務提交到排程器
-            self.scheduler.submit(
-                task_id,
-                pending_task['url'],
-                pending_task['quality'],
-                pending_task['format'],
-                downloads_dir=pending_task['downloads_dir'],
-                add_resolution_to_filename=pending_task['add_resolution'],
-                original_format=pending_task['original_format'],
-            )
+            for t in derived:
+                self._submit_derived(t, source_path)
+            for t, primary in attached:
+                self._show_attached(t['task_id'], primary, t['original_format'])
+            for pending_task in started:
+                task_id = pending_task['task_id']
+                download_console(f"開始下載等待中的任務 {task_id}（URL: {url}）", level=LogLevel.INFO)
+                self.progress.update(task_id, 0, "等待中", '', '', pending_task['original_format'])
+
+                # 將任務提交到排程器
+                self.scheduler.submit(
+                    task_id,
+                    pending_task['url'],
+                    pending_task['quality'],
+                    pending_task['format'],
+                    downloads_dir=pending_task['downloads_dir'],
+                    add_resolution_to_filename=pending_task['add_resolution'],
+                    original_format=pending_task['original_format'],
+                )
         except Exception as e:
             download_console(f"處理等待中的任務時出錯: {e}", level=LogLevel.ERROR)
     
     @Slot(str, str, str, str, result=str)
     def check_file_exists_before_download(self, url, quality, format_type, original_format=None):
-        """在開始下載前檢查文件是否存在（不開始下載）"""
+        """在開始下載前檢查文件是否存在（不開始下載）
+        
+        只查詢記憶體（影片資訊快取 + 下載目錄索引 + 最近一次的設定），不解析、不讀檔、不等待，
+        尚未取得影片資訊時回傳 FILE_NOT_EXISTS。完整檢查由 start_download 的背景受理流程負責。
+        """
         try:
-            # 規範化格式
-            fmt = (original_format or format_type or '').strip().lower()
-            if fmt in ('mp3', 'aac', 'flac', 'wav', 'audio'):
-                normalized_format = '音訊'
-            else:
-                normalized_format = '影片'
-            
-            # 規範化畫質
-            q = (quality or '').strip()
-            if normalized_format == '影片':
-                import re
-                m = re.search(r"(\d+)", q)
-                normalized_quality = m.group(1) if m else '1080'
-            else:
-                import re
-                m = re.search(r"(\d+)", q)
-                normalized_quality = m.group(1) if m else '320'
-            
-            # 獲取下載路徑
-            settings = self.settings_manager.load_settings()
-            add_resolution = settings.get('addResolutionToFilename', False)
-            resolved_download_dir = get_download_path(self.root_dir, self.settings_manager)
-            
-            # 檢查文件是否存在
-            existing_file = None
-            try:
-                import threading
-                
-                result = [None]
-                exception = [None]
-                
-                def check_file():
-                    try:
-                        result[0] = self._check_file_exists(url, normalized_quality, normalized_format, 
-                                                           resolved_download_dir, add_resolution, original_format=fmt)
-                    except Exception as e:
-                        exception[0] = e
-                
-                thread = threading.Thread(target=check_file, daemon=True)
-                thread.start()
-                thread.join(timeout=5)  # 5秒超時
-                
-                if thread.is_alive():
-                    download_console(f"文件存在檢查超時，跳過檢查", level=LogLevel.WARNING)
-                    existing_file = None
-                elif exception[0]:
-                    download_console(f"文件存在檢查出錯: {exception[0]}，跳過檢查", level=LogLevel.WARNING)
-                    existing_file = None
-                else:
-                    existing_file = result[0]
-            except Exception as e:
-                download_console(f"文件存在檢查失敗: {e}，跳過檢查", level=LogLevel.WARNING)
-                existing_file = None
-            
+            fmt, normalized_format, normalized_quality = self._normalize_download_request(quality, original_format or format_type)
+            snapshot = dict(self._admission_snapshot)
+            existing_file = self._check_file_exists(
+                url, normalized_quality, normalized_format,
+                snapshot['downloads_dir'], snapshot['add_resolution'],
+                original_format=fmt, allow_extract=False
+            )
             if existing_file:
                 return f"FILE_EXISTS:{existing_file}"
             return "FILE_NOT_EXISTS"
@@ -874,110 +1082,195 @@ class Api(QObject):
                 download_console(f"檔案不存在或非檔案，跳過刪除: {file_real}", level=LogLevel.INFO)
                 return "OK"
             os.remove(file_real)
+            self.catalog.remove_file(file_real)
             download_console(f"已刪除舊檔案: {file_real}", level=LogLevel.INFO)
             return "OK"
         except Exception as e:
             download_console(f"刪除檔案失敗: {e}", level=LogLevel.ERROR)
             return f"失敗: {e}"
     
-    def _check_file_exists(self, url, quality, format_type, downloads_dir, add_resolution, original_format=None):
+    def _check_file_exists(self, url, quality, format_type, downloads_dir, add_resolution, original_format=None, allow_extract=True):
         """檢查目標文件是否存在，返回文件路徑（如果存在）
         
-        只檢查相同格式的文件，例如：
-        - 如果 original_format='mp3'，只檢查 .mp3 文件
-        - 如果 original_format='mp4'，只檢查 .mp4, .mkv, .webm 等影片格式
+        以 yt-dlp 的 prepare_filename 推算輸出路徑，再查詢下載目錄索引（記憶體），
+        影片資訊優先使用快取（取得資訊/畫質時已存入），沒有快取才重新解析。
+        只檢查相同格式的文件，例如已有 mp4，仍可再下載 mp3。
+        allow_extract=False 時只查記憶體（供主線程呼叫）。
         """
         try:
-            # 先獲取視頻信息以確定標題和高度
-            import yt_dlp
-            ffmpeg_path = safe_path_join(self.root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
-            ydl_opts = {
-                'quiet': True,
-                'simulate': True,
-                'extract_flat': False,
-            }
-            
-            # 設定 ffmpeg 路徑（如果存在）
-            if os.path.exists(ffmpeg_path):
-                ydl_opts['ffmpeg_location'] = ffmpeg_path
-            
-            # 配置 Deno 作為外部 JavaScript 執行時（用於 YouTube 支援）
-            deno_path = get_deno_path(self.root_dir)
-            if deno_path:
-                ydl_opts['js_runtimes'] = {'deno': {'path': deno_path}}
-                api_console(f"已配置 Deno 路徑: {deno_path}")
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
-            
-            title = info_dict.get('title', '無標題影片')
-            # 清理標題中的非法字符
-            import re
-            safe_title = re.sub(r'[<>:"/\\|?*]', '', title)
-            
-            # 規範化格式和畫質
-            fmt = (format_type or '').strip().lower()
-            if fmt in ('mp3', 'aac', 'flac', 'wav', 'audio'):
-                normalized_format = '音訊'
-                # 使用原始格式，如果沒有則預設為 mp3
-                if original_format:
-                    ext = original_format.strip().lower()
-                else:
-                    ext = 'mp3'
-            else:
-                normalized_format = '影片'
-                # 使用原始格式，如果沒有則預設為 mp4
-                if original_format:
-                    ext = original_format.strip().lower()
-                else:
-                    ext = 'mp4'
-            
-            q = (quality or '').strip()
-            import re as re_module
-            m = re_module.search(r"(\d+)", q)
-            qnum = m.group(1) if m else ('320' if normalized_format == '音訊' else '1080')
-            
-            # 構建可能的文件名列表
-            possible_files = []
-            
-            # 獲取實際高度（用於影片）
-            height = None
-            if normalized_format == '影片':
-                formats = info_dict.get('formats', [])
-                for f in formats:
-                    h = f.get('height')
-                    if h and h >= int(qnum):
-                        height = h
-                        break
-                if not height:
-                    height = qnum
-            
-            # 根據設定構建可能的文件名
-            if add_resolution:
-                if normalized_format == '音訊':
-                    # 音訊格式：標題_320kbps.{ext}
-                    possible_files.append(f"{safe_title}_{qnum}kbps.{ext}")
-                else:
-                    # 影片格式：標題_1080p.{ext}
-                    possible_files.append(f"{safe_title}_{height}p.{ext}")
-            else:
-                # 預設格式：標題.{ext}
-                possible_files.append(f"{safe_title}.{ext}")
-            
-            # 檢查文件是否存在（只檢查相同格式）
-            for filename in possible_files:
-                file_path = os.path.join(downloads_dir, filename)
-                if os.path.exists(file_path):
-                    return file_path
-            
-            # 只檢查用戶指定的格式，不檢查其他擴展名
-            # 這樣可以允許用戶下載同一影片的不同格式（例如已有 mp4，可以再下載 mp3）
-            
+            info = get_cached_video_info(url)
+            if info is None:
+                if not allow_extract:
+                    return None
+                # 沒有快取（例如直接貼上網址下載）才解析一次
+                ydl_opts = {
+                    'quiet': True,
+                    'simulate': True,
+                    'extract_flat': False,
+                }
+                ffmpeg_path = safe_path_join(self.root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
+                if os.path.exists(ffmpeg_path):
+                    ydl_opts['ffmpeg_location'] = ffmpeg_path
+                # 配置 Deno 作為外部 JavaScript 執行時（用於 YouTube 支援）
+                deno_path = get_deno_path(self.root_dir)
+                if deno_path:
+                    ydl_opts['js_runtimes'] = {'deno': {'path': deno_path}}
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info_dict = ydl.extract_info(url, download=False)
+                remember_video_info(url, info_dict)
+                info = get_cached_video_info(url)
+                if info is None:
+                    return None
+
+            # 影片：推估實際下載高度（不超過所選畫質的最高可用高度）
+            if add_resolution and format_type != '音訊':
+                heights = info.get('_heights') or []
+                try:
+                    qnum = int(quality)
+                    below = [h for h in heights if h <= qnum]
+                    info['height'] = max(below) if below else (min(heights) if heights else qnum)
+                except (TypeError, ValueError):
+                    pass
+
+            self.catalog.watch_directory(downloads_dir, scan=allow_extract)
+            outtmpl = self.downloader.build_output_template(quality, format_type, downloads_dir, add_resolution, original_format)
+            expected = self.catalog.expected_path(info, outtmpl)
+            entry = self.catalog.lookup(expected)
+            if entry:
+                return entry['path']
+            # 目錄剛加入監看、索引尚未建好時，直接確認一次
+            if allow_extract and expected and os.path.isfile(expected):
+                return expected
             return None
         except Exception as e:
             api_console(f"檢查文件是否存在時出錯: {e}")
             return None
     
+    def _request_identity(self, url, quality, format_type, downloads_dir, add_resolution, original_format):
+        """請求鍵與輸出檔名模板：請求鍵相同代表完全相同的下載，模板相同代表會寫到同一個檔案"""
+        outtmpl = self.downloader.build_output_template(quality, format_type, downloads_dir, add_resolution, original_format)
+        key = (url, (original_format or '').lower(), str(quality), format_type, os.path.normcase(outtmpl))
+        return key, outtmpl
+
+    def _sibling_action_locked(self, url, key, outtmpl, format_type):
+        """同一 URL 的新任務如何處理（須持有 _lock）：回傳 (動作, 被跟隨的任務ID)
+
+        - attach：相同請求正在下載，跟隨其進度並以相同檔案完成
+        - wait：會寫到同一個檔案，或音訊可在影片下載完成後於本地產生，進入等待佇列
+        - start：輸出不同，直接同時下載
+        """
+        primary = self.inflight_requests.get(key)
+        if primary is not None:
+            return 'attach', primary
+        for other in (self.downloading_urls.get(url) or {}).values():
+            if os.path.normcase(other['outtmpl']) == os.path.normcase(outtmpl):
+                return 'wait', None
+            if format_type == '音訊' and other['ext'] in DERIVE_SOURCE_FORMATS:
+                return 'wait', None
+        return 'start', None
+
+    def _mark_downloading_locked(self, task_id, url, key, outtmpl, ext):
+        """標記任務正在下載（須持有 _lock）"""
+        self.downloading_urls.setdefault(url, {})[str(task_id)] = {'key': key, 'outtmpl': outtmpl, 'ext': (ext or '').lower()}
+        self.inflight_requests[key] = str(task_id)
+
+    def _unmark_downloading_locked(self, task_id, url):
+        """移除任務的正在下載標記（須持有 _lock），回傳是否有標記"""
+        active = self.downloading_urls.get(url)
+        entry = active.pop(str(task_id), None) if active is not None else None
+        if active is not None and not active:
+            del self.downloading_urls[url]
+        if entry is None:
+            return False
+        if self.inflight_requests.get(entry['key']) == str(task_id):
+            del self.inflight_requests[entry['key']]
+        return True
+
+    def _attach_locked(self, task_id, primary):
+        """讓任務跟隨正在下載的相同請求（須持有 _lock）"""
+        self.task_followers.setdefault(str(primary), []).append(int(task_id))
+        self.follower_of[str(task_id)] = str(primary)
+
+    def _show_attached(self, task_id, primary, task_format):
+        download_console(f"任務 {task_id} 與下載中的任務 {primary} 相同，跟隨其進度", level=LogLevel.INFO)
+        self.progress.update(task_id, 0, f"與任務 {primary} 相同，跟隨下載中", '', '', task_format)
+
+    def _is_derive_source(self, path):
+        """檔案是否可作為本地產生音訊的來源（已下載的影片檔）"""
+        if not path:
+            return False
+        ext = os.path.splitext(path)[1].lstrip('.').lower()
+        return ext in DERIVE_SOURCE_FORMATS and os.path.isfile(path)
+
+    def _find_derive_source(self, url, downloads_dir, add_resolution):
+        """在下載目錄索引中找同一影片已下載的影片檔（依影片 ID，或依輸出檔名推算），找不到回傳 None"""
+        try:
+            info = get_cached_video_info(url)
+            if not info:
+                return None
+            for entry in self.catalog.find_by_video_id(info.get('id'), DERIVE_SOURCE_FORMATS):
+                if self._is_derive_source(entry['path']):
+                    return entry['path']
+            # 先前啟動時下載的檔案沒有影片 ID：以各影片格式的輸出檔名查詢
+            heights = (info.get('_heights') or [None]) if add_resolution else [None]
+            for ext in DERIVE_SOURCE_FORMATS:
+                for height in reversed(heights):
+                    candidate = dict(info)
+                    if height:
+                        candidate['height'] = height
+                    outtmpl = self.downloader.build_output_template(str(height or ''), '影片', downloads_dir, add_resolution, ext)
+                    entry = self.catalog.lookup(self.catalog.expected_path(candidate, outtmpl))
+                    if entry and self._is_derive_source(entry['path']):
+                        return entry['path']
+        except Exception as e:
+            api_console(f"尋找可產生音訊的已下載影片失敗: {e}", level=LogLevel.WARNING)
+        return None
+
+    def _submit_derived(self, task, source_path):
+        """把音訊任務交給排程器，於後處理階段從 source_path 在本地產生（輸出檔名與直接下載時相同）"""
+        task_id = task['task_id']
+        url = task['url']
+        key, outtmpl = self._request_identity(
+            url, task['quality'], task['format'], task['downloads_dir'], task['add_resolution'], task['original_format']
+        )
+        target_path = self.catalog.expected_path(get_cached_video_info(url), outtmpl)
+        if not target_path:
+            # 無法推算輸出檔名（沒有影片資訊）：照常下載，與其他下載一樣標記正在下載
+            with self._lock:
+                self.derived_tasks.discard(str(task_id))
+                self._mark_downloading_locked(task_id, url, key, outtmpl, task['original_format'])
+            source_path = None
+        else:
+            download_console(f"任務 {task_id} 將從已下載的檔案產生音訊: {source_path}", level=LogLevel.INFO)
+        self.progress.update(task_id, 0, "等待中", '', '', task['original_format'])
+        self.scheduler.submit(
+            task_id,
+            url,
+            task['quality'],
+            task['format'],
+            downloads_dir=task['downloads_dir'],
+            add_resolution_to_filename=task['add_resolution'],
+            original_format=task['original_format'],
+            derive_from=source_path,
+            derive_to=target_path,
+        )
+
+    def _normalize_download_request(self, quality, format_type):
+        """規範化前端傳入的畫質與格式，回傳 (副檔名格式, 語義分類, 畫質數字)"""
+        import re
+        fmt = (format_type or '').strip().lower()
+        # 對齊下載器分支：將具體副檔名映射為語義分類
+        if fmt in ('mp3', 'aac', 'flac', 'wav', 'audio'):
+            normalized_format = '音訊'
+        else:
+            normalized_format = '影片'
+        m = re.search(r"(\d+)", (quality or '').strip())
+        if m:
+            normalized_quality = m.group(1)
+        else:
+            normalized_quality = '1080' if normalized_format == '影片' else '320'
+        return fmt, normalized_format, normalized_quality
+
     @Slot(str, result=str)
     def start_batch_download(self, video_data_json):
         """批量下載（主要給播放清單使用）
@@ -988,6 +1281,11 @@ class Api(QObject):
           ]
 
         - **重要**：`id` 會直接當作任務ID回報進度/完成，必須與前端佇列對齊。
+        - 主線程只解析參數並立即回傳；讀取設定、建立資料夾與排入佇列在 file_io 執行器中進行
+          （與 start_download 相同），各任務的結果以 window.__onDownloadAdmission 推送，
+          略過的任務另以提示訊息彙總。
+        - 整批一次驗證、去重並交給排程器（scheduler.submit_many），不再每項開一條延遲執行緒；
+          啟動節奏由排程器的啟動節流控制。批次不做逐項的檔案存在檢查。
         """
         try:
             video_list = json.loads(video_data_json or '[]')
@@ -995,80 +1293,174 @@ class Api(QObject):
                 return "批量下載失敗: 參數格式錯誤（需為 JSON 陣列）"
 
             download_console(f"開始批量下載，共 {len(video_list)} 部影片", level=LogLevel.INFO)
+            executors.submit('file_io', self._admit_batch_download, video_list)
+            return f"已受理批量下載 {len(video_list)} 部影片"
+        except Exception as e:
+            download_console(f"批量下載失敗: {e}", level=LogLevel.ERROR)
+            return f"批量下載失敗: {e}"
 
-            def delayed_start(delay_s, tid, u, q, f):
-                import time
-                try:
-                    if delay_s and delay_s > 0:
-                        time.sleep(delay_s)
-                    # 直接使用前端提供的 task id（不可亂轉換，避免對不到 UI）
-                    self.start_download(int(tid), u, q, f)
-                except Exception as e:
-                    download_console(f"批量下載啟動失敗(task_id={tid}): {e}", level=LogLevel.ERROR)
+    def _admit_batch_download(self, video_list):
+        """背景受理批量下載（見 start_batch_download）"""
+        try:
+            # 設定與下載目錄整批只解析一次
+            settings = self.settings_manager.load_settings()
+            add_resolution = settings.get('addResolutionToFilename', False)
+            resolved_download_dir = get_download_path(self.root_dir, self.settings_manager)
+            try:
+                os.makedirs(resolved_download_dir, exist_ok=True)
+            except Exception as e:
+                download_console(f"創建下載資料夾失敗，改用預設: {e}", level=LogLevel.ERROR)
+                resolved_download_dir = safe_path_join(self.root_dir, 'downloads')
+                os.makedirs(resolved_download_dir, exist_ok=True)
+            self._admission_snapshot = {
+                'downloads_dir': resolved_download_dir,
+                'add_resolution': add_resolution,
+            }
+            # 新的下載目錄交由索引背景掃描
+            self.catalog.watch_directory(resolved_download_dir, scan=False)
+
+            jobs = []
+            waiting = []  # (task_id, fmt)：同名影片正在下載，進入等待佇列
+            attached = []  # (task_id, 被跟隨的任務ID, fmt)：相同請求正在下載
+            rejected = []  # (task_id, 原因)：未排入的任務，回報給前端
+            seen_ids = set()
+            with self._lock:
+                for idx, item in enumerate(video_list):
+                    if not isinstance(item, dict):
+                        continue
+                    url = (item.get('url') or '').strip()
+                    if not url:
+                        continue
+                    task_id = item.get('id')
+                    if task_id is None:
+                        # 若前端未提供，退回用序號（仍維持 int）
+                        task_id = idx
                     try:
-                        self._notify_download_complete_safely(int(tid), u, error=str(e))
-                    except Exception:
-                        pass
+                        # 直接使用前端提供的 task id（不可亂轉換，避免對不到 UI）
+                        task_id = int(task_id)
+                    except (TypeError, ValueError):
+                        download_console(f"批量下載略過無效任務ID: {task_id}", level=LogLevel.WARNING)
+                        continue
+                    if task_id in seen_ids:
+                        continue
+                    seen_ids.add(task_id)
+                    if self.scheduler.is_known(task_id):
+                        # 任務ID已在排程器中：不可覆寫該任務的狀態
+                        rejected.append((task_id, '任務已在佇列中'))
+                        continue
+                    self.progress.reset(task_id)
 
-            started = 0
-            for idx, item in enumerate(video_list):
-                if not isinstance(item, dict):
-                    continue
-                url = (item.get('url') or '').strip()
-                if not url:
-                    continue
-                task_id = item.get('id')
-                if task_id is None:
-                    # 若前端未提供，退回用序號（仍維持 int）
-                    task_id = idx
-                quality = item.get('quality', '1080p')
-                format_type = item.get('format', 'mp4')
-
-                # 以背景執行緒做簡單排程，避免一次啟動太多 yt-dlp 實例
-                t = threading.Thread(
-                    target=delayed_start,
-                    args=(idx * 0.5, task_id, url, quality, format_type),
-                    daemon=True,
-                )
-                t.start()
-                started += 1
+                    fmt, normalized_format, normalized_quality = self._normalize_download_request(
+                        item.get('quality', '1080p'), item.get('format', 'mp4')
+                    )
+                    self.task_download_paths[str(task_id)] = resolved_download_dir
+                    self.task_formats[str(task_id)] = fmt
+                    self.task_urls[str(task_id)] = url
+
+                    key, outtmpl = self._request_identity(
+                        url, normalized_quality, normalized_format, resolved_download_dir, add_resolution, fmt
+                    )
+                    action, primary = self._sibling_action_locked(url, key, outtmpl, normalized_format)
+                    if action == 'attach':
+                        # 相同請求正在下載（含本批前面的項目）：跟隨其進度
+                        self._attach_locked(task_id, primary)
+                        attached.append((task_id, primary, fmt))
+                        continue
+                    if action == 'wait':
+                        # 同名影片正在下載且會寫到同一個檔案（或音訊可於下載後本地產生）：加入等待佇列
+                        self.pending_tasks_by_url.setdefault(url, []).append({
+                            'task_id': task_id,
+                            'url': url,
+                            'quality': normalized_quality,
+                            'format': normalized_format,
+                            'downloads_dir': resolved_download_dir,
+                            'add_resolution': add_resolution,
+                            'original_format': fmt,
+                        })
+                        waiting.append((task_id, fmt))
+                        continue
+
+                    self._mark_downloading_locked(task_id, url, key, outtmpl, fmt)
+                    jobs.append({
+                        'task_id': task_id,
+                        'url': url,
+                        'quality': normalized_quality,
+                        'format_type': normalized_format,
+                        'downloads_dir': resolved_download_dir,
+                        'add_resolution_to_filename': add_resolution,
+                        'original_format': fmt,
+                    })
+
+            result = self.scheduler.submit_many(jobs)
+            # 排程器拒絕的任務：撤銷正在下載標記與任務狀態，跟隨它的任務一併撤銷，等待中的同名任務重新判斷
+            rolled_back_urls = set()
+            with self._lock:
+                for task_id, reason in result.get('rejected', []):
+                    if task_id is None:
+                        continue
+                    url = self.task_urls.get(str(task_id))
+                    if url is not None and self._unmark_downloading_locked(task_id, url):
+                        rolled_back_urls.add(url)
+                    for tid in [task_id] + self.task_followers.pop(str(task_id), []):
+                        self.follower_of.pop(str(tid), None)
+                        self.task_download_paths.pop(str(tid), None)
+                        self.task_formats.pop(str(tid), None)
+                        self.task_urls.pop(str(tid), None)
+                        rejected.append((int(tid), reason))
+            rejected_ids = {tid for tid, _ in rejected}
+            attached = [a for a in attached if a[0] not in rejected_ids]
+            for task_id, reason in rejected:
+                download_console(f"批量下載略過任務 {task_id}: {reason}", level=LogLevel.WARNING)
+                self.progress.finish(task_id, 0, '錯誤', reason)
+            for task_id in result.get('accepted', []):
+                self.events.post('downloadAdmission', int(task_id), "queued", "")
+            for task_id, fmt in waiting:
+                self.progress.update(task_id, 0, "等待同名影片下載完成", '', '', fmt)
+                self.events.post('downloadAdmission', int(task_id), "waiting", "")
+            for task_id, primary, fmt in attached:
+                self._show_attached(task_id, primary, fmt)
+                self.events.post('downloadAdmission', int(task_id), "queued", "")
+            for url in rolled_back_urls:
+                self._process_pending_tasks_for_url(url)
 
-            return f"已開始批量下載 {started} 部影片"
+            started = len(result.get('accepted', [])) + len(waiting) + len(attached)
+            download_console(f"批量下載已排入 {started} 部影片（略過 {len(rejected)} 部）", level=LogLevel.INFO)
+            if rejected:
+                # 逐項的錯誤狀態已顯示在佇列中，這裡只彙總一次，不逐項彈窗
+                self.events.post('toast', "批量下載", f"已開始 {started} 部影片，略過任務: {', '.join(str(tid) for tid, _ in rejected)}")
         except Exception as e:
             download_console(f"批量下載失敗: {e}", level=LogLevel.ERROR)
-            return f"批量下載失敗: {e}"
+            self.events.post('toast', "批量下載失敗", str(e))
     
     @Slot(int, str, str, str, result=str)
     def start_download(self, task_id, url, quality, format_type):
-        """開始下載"""
+        """開始下載
+        
+        主線程只受理並立即回傳 ACCEPTED；讀取設定、建立資料夾、檔案存在檢查與排入佇列
+        都在背景執行，結果以 window.__onDownloadAdmission(taskId, status, detail) 推送給前端：
+          - queued：已加入下載佇列
+          - waiting：同名影片正在下載，進入等待佇列
+          - file_exists：目標檔案已存在（detail 為檔案路徑），等待 confirm_redownload
+          - error：受理失敗（detail 為錯誤訊息）
+        """
         try:
-            download_console(f"[DBG] start_download 進入 task_id={task_id}", level=LogLevel.DEBUG)
             download_console(f"開始下載任務 {task_id}: {url}", level=LogLevel.INFO)
+            # 任務ID可能沿用先前已結束的任務：清除其終止標記，否則新的進度會被丟棄
+            self.progress.reset(task_id)
+            executors.submit('file_io', self._admit_download, task_id, url, quality, format_type)
+            return "ACCEPTED"
+        except Exception as e:
+            download_console(f"開始下載失敗: {e}", level=LogLevel.ERROR)
+            return f"下載失敗: {e}"
+
+    def _admit_download(self, task_id, url, quality, format_type):
+        """背景受理單一下載請求（見 start_download）"""
+        try:
             # 規範化前端傳入的格式與畫質
-            fmt = (format_type or '').strip().lower()
-            # 對齊下載器分支：將具體副檔名映射為語義分類
-            if fmt in ('mp3', 'aac', 'flac', 'wav', 'audio'):
-                normalized_format = '音訊'
-            else:
-                # 預設走影片路徑（包含 mp4、mkv、webm 或未指定時）
-                normalized_format = '影片'
-
-            # 將畫質轉為下載器可理解的數值或保留音訊位元率
-            q = (quality or '').strip()
-            if normalized_format == '影片':
-                # 允許 '1080p' 或 '1080'，只取數字
-                import re
-                m = re.search(r"(\d+)", q)
-                normalized_quality = m.group(1) if m else '1080'
-            else:
-                # 音訊使用位元率數字（例如 '320'）
-                import re
-                m = re.search(r"(\d+)", q)
-                normalized_quality = m.group(1) if m else '320'
+            fmt, normalized_format, normalized_quality = self._normalize_download_request(quality, format_type)
 
             # 讀取設定中的下載路徑和解析度檔名選項
             settings = self.settings_manager.load_settings()
-            custom_path = settings.get('customDownloadPath', '')
             add_resolution = settings.get('addResolutionToFilename', False)
             
             # 決定下載目錄
@@ -1081,11 +1473,25 @@ class Api(QObject):
                 download_console(f"創建下載資料夾失敗，改用預設: {e}", level=LogLevel.ERROR)
                 resolved_download_dir = safe_path_join(self.root_dir, 'downloads')
                 os.makedirs(resolved_download_dir, exist_ok=True)
+            self._admission_snapshot = {
+                'downloads_dir': resolved_download_dir,
+                'add_resolution': add_resolution,
+            }
 
-            # 先檢查是否有同名影片正在下載（這個很快，不會阻塞）
-            download_console("[DBG] start_download 即將取得 _lock（檢查同名）", level=LogLevel.DEBUG)
+            # 先檢查是否有同名影片正在下載：相同請求直接跟隨（不重複下載、不詢問檔案已存在），
+            # 會寫到同一個檔案的才等待，其他格式同時下載
+            key, outtmpl = self._request_identity(
+                url, normalized_quality, normalized_format, resolved_download_dir, add_resolution, fmt
+            )
             with self._lock:
-                if url in self.downloading_urls:
+                action, primary = self._sibling_action_locked(url, key, outtmpl, normalized_format)
+                if action == 'attach':
+                    self.task_download_paths[str(task_id)] = resolved_download_dir
+                    self.task_formats[str(task_id)] = fmt
+                    self.task_urls[str(task_id)] = url
+                    self._attach_locked(task_id, primary)
+                    need_waiting_ui = False
+                elif action == 'wait':
                     # 有同名影片正在下載，將任務加入等待佇列（僅在鎖內做 dict 更新，不呼叫 JS）
                     download_console(f"發現同名影片正在下載: {url}，任務 {task_id} 將等待下載完成", level=LogLevel.INFO)
                     self.task_download_paths[str(task_id)] = resolved_download_dir
@@ -1105,50 +1511,28 @@ class Api(QObject):
                     need_waiting_ui = True
                 else:
                     need_waiting_ui = False
-            download_console("[DBG] start_download 已釋放 _lock（檢查同名）", level=LogLevel.DEBUG)
+            if action == 'attach':
+                self._show_attached(task_id, primary, fmt)
+                self.events.post('downloadAdmission', int(task_id), "queued", "")
+                return
             if need_waiting_ui:
-                download_console("[DBG] start_download 即將 _safe_eval_js 等待中 UI", level=LogLevel.DEBUG)
-                self._safe_eval_js("window.updateDownloadProgress", task_id, 0, "等待同名影片下載完成", '', '', fmt)
-                return "已加入等待佇列（等待同名影片下載完成）"
+                self.progress.update(task_id, 0, "等待同名影片下載完成", '', '', fmt)
+                self.events.post('downloadAdmission', int(task_id), "waiting", "")
+                return
 
-            # 檢查文件是否已存在（在背景線程執行，主線程僅短暫等待，避免 UI 卡死）
-            existing_file = None
+            # 檢查文件是否已存在（已在背景線程，直接執行即可）
             try:
-                result = [None]
-                exception = [None]
-
-                def check_file():
-                    try:
-                        result[0] = self._check_file_exists(
-                            url, normalized_quality, normalized_format,
-                            resolved_download_dir, add_resolution, original_format=fmt
-                        )
-                    except Exception as e:
-                        exception[0] = e
-
-                thread = threading.Thread(target=check_file, daemon=True)
-                thread.start()
-                download_console("[DBG] start_download 主線程即將 thread.join(1.5s)", level=LogLevel.DEBUG)
-                # 主線程最多等 1.5 秒，避免長期佔用導致「開啟資料夾」等操作無回應
-                thread.join(timeout=1.5)
-                download_console("[DBG] start_download 主線程 thread.join 已返回", level=LogLevel.DEBUG)
-
-                if thread.is_alive():
-                    download_console("文件存在檢查超時，跳過檢查", level=LogLevel.WARNING)
-                    existing_file = None
-                elif exception[0]:
-                    download_console(f"文件存在檢查出錯: {exception[0]}，跳過檢查", level=LogLevel.WARNING)
-                    existing_file = None
-                else:
-                    existing_file = result[0]
+                existing_file = self._check_file_exists(
+                    url, normalized_quality, normalized_format,
+                    resolved_download_dir, add_resolution, original_format=fmt
+                )
             except Exception as e:
                 download_console(f"文件存在檢查失敗: {e}，跳過檢查", level=LogLevel.WARNING)
                 existing_file = None
             
             if existing_file:
-                # 文件已存在，返回特殊狀態讓前端顯示確認對話框
+                # 文件已存在，通知前端顯示確認對話框，等待用戶確認（confirm_redownload）
                 download_console(f"發現已存在的文件: {existing_file}")
-                # 將信息存儲在臨時變量中，等待用戶確認
                 with self._lock:
                     if not hasattr(self, '_pending_downloads'):
                         self._pending_downloads = {}
@@ -1161,19 +1545,47 @@ class Api(QObject):
                         'add_resolution': add_resolution,
                         'existing_file': existing_file
                     }
-                return f"FILE_EXISTS:{existing_file}"
+                self.events.post('downloadAdmission', int(task_id), "file_exists", existing_file)
+                return
+
+            # 音訊：同一影片已有下載好的影片檔時，直接在本地產生（不經網路）
+            if normalized_format == '音訊':
+                source_path = self._find_derive_source(url, resolved_download_dir, add_resolution)
+                if source_path:
+                    with self._lock:
+                        self.task_download_paths[str(task_id)] = resolved_download_dir
+                        self.task_formats[str(task_id)] = fmt
+                        self.task_urls[str(task_id)] = url
+                        self.derived_tasks.add(str(task_id))
+                    self._submit_derived({
+                        'task_id': task_id,
+                        'url': url,
+                        'quality': normalized_quality,
+                        'format': normalized_format,
+                        'downloads_dir': resolved_download_dir,
+                        'add_resolution': add_resolution,
+                        'original_format': fmt,
+                    }, source_path)
+                    self.events.post('downloadAdmission', int(task_id), "queued", "")
+                    return
 
             # 記錄任務路徑與格式，並標記此 URL 為正在下載（單一鎖區塊，不長期佔用）
-            download_console("[DBG] start_download 即將取得 _lock（記錄路徑）", level=LogLevel.DEBUG)
             with self._lock:
                 self.task_download_paths[str(task_id)] = resolved_download_dir
                 self.task_formats[str(task_id)] = fmt
                 self.task_urls[str(task_id)] = url
-                self.downloading_urls.add(url)
-            download_console("[DBG] start_download 已釋放 _lock（記錄路徑）", level=LogLevel.DEBUG)
+                # 檔案檢查期間相同請求可能已開始下載：改為跟隨
+                primary = self.inflight_requests.get(key)
+                if primary is None:
+                    self._mark_downloading_locked(task_id, url, key, outtmpl, fmt)
+                else:
+                    self._attach_locked(task_id, primary)
+            if primary is not None:
+                self._show_attached(task_id, primary, fmt)
+                self.events.post('downloadAdmission', int(task_id), "queued", "")
+                return
 
             download_console(f"任務 {task_id} 下載路徑已記錄: {resolved_download_dir}, 格式: {fmt}, URL: {url}")
-            download_console(f"開始下載任務 {task_id}，URL: {url}")
 
             # 丟給全域排程器（控制同時下載上限 + 重試）
             self.scheduler.submit(
@@ -1185,10 +1597,10 @@ class Api(QObject):
                 add_resolution_to_filename=add_resolution,
                 original_format=fmt,
             )
-            return "已加入下載佇列"
+            self.events.post('downloadAdmission', int(task_id), "queued", "")
         except Exception as e:
             download_console(f"開始下載失敗: {e}", level=LogLevel.ERROR)
-            return f"下載失敗: {e}"
+            self.events.post('downloadAdmission', int(task_id), "error", f"下載失敗: {e}")
     
     @Slot(int, bool, result=str)
     def confirm_redownload(self, task_id, should_delete):
@@ -1219,12 +1631,11 @@ class Api(QObject):
             
             # 如果用戶確認刪除，刪除舊文件（在後台線程執行，不阻塞 UI）
             if should_delete:
-                import threading
-                
                 def delete_file_thread():
                     try:
                         if os.path.exists(existing_file):
                             os.remove(existing_file)
+                            self.catalog.remove_file(existing_file)
                             download_console(f"已刪除舊文件: {existing_file}", level=LogLevel.INFO)
                         else:
                             download_console(f"文件不存在，無需刪除: {existing_file}", level=LogLevel.INFO)
@@ -1232,9 +1643,11 @@ class Api(QObject):
                         download_console(f"刪除舊文件失敗（將在下載時覆蓋）: {e}", level=LogLevel.WARNING)
                         # 不返回錯誤，讓下載繼續進行（下載器會處理文件覆蓋）
                 
-                # 在單獨的線程中執行刪除操作，不等待完成
-                delete_thread = threading.Thread(target=delete_file_thread, daemon=True)
-                delete_thread.start()
+                # 交給 file_io 執行器刪除，不等待完成
+                try:
+                    executors.submit('file_io', delete_file_thread)
+                except ExecutorBusy as e:
+                    download_console(f"無法排入刪除舊文件（將在下載時覆蓋）: {e}", level=LogLevel.WARNING)
                 # 不等待刪除完成，直接繼續執行下載（下載器會處理文件覆蓋）
             else:
                 # 用戶取消，移除待處理任務和相關數據
@@ -1250,12 +1663,16 @@ class Api(QObject):
             
             # 記錄任務的下載路徑和格式（與 start_download 保持一致）
             download_console(f"[confirm_redownload] 準備記錄任務信息", level=LogLevel.INFO)
+            self.progress.reset(task_id)
             with self._lock:
                 self.task_download_paths[str(task_id)] = resolved_download_dir
                 self.task_formats[str(task_id)] = original_format or normalized_format  # 記錄格式（如 mp3, mp4）
                 self.task_urls[str(task_id)] = url  # 記錄 URL
                 # 標記此 URL 為正在下載
-                self.downloading_urls.add(url)
+                key, outtmpl = self._request_identity(
+                    url, normalized_quality, normalized_format, resolved_download_dir, add_resolution, original_format
+                )
+                self._mark_downloading_locked(task_id, url, key, outtmpl, original_format or normalized_format)
             
             download_console(f"任務 {task_id} 下載路徑已記錄: {resolved_download_dir}, 格式: {original_format or normalized_format}, URL: {url}")
             download_console(f"開始下載任務 {task_id}，URL: {url}")
@@ -1329,8 +1746,8 @@ class Api(QObject):
                 if err_msg:
                     QTimer.singleShot(0, lambda msg=err_msg: self._safe_eval_js("window.showModal", "錯誤", msg))
 
-            api_console("[DBG] open_file_location_by_task 即將 start 背景線程", level=LogLevel.DEBUG)
-            threading.Thread(target=_run_open, daemon=True).start()
+            api_console("[DBG] open_file_location_by_task 即將交給 ui_effects 執行器", level=LogLevel.DEBUG)
+            executors.submit('ui_effects', _run_open)
             api_console("[DBG] open_file_location_by_task 即將 return", level=LogLevel.DEBUG)
             return "正在開啟檔案位置..."
         except Exception as e:
@@ -1400,7 +1817,7 @@ class Api(QObject):
                     api_console(f"開啟資料夾時出錯: {e}", level=LogLevel.ERROR)
 
             if os.path.exists(fp):
-                threading.Thread(target=open_folder_thread, daemon=True).start()
+                executors.submit('ui_effects', open_folder_thread)
                 return "正在開啟檔案位置..."
             return "檔案不存在"
         except Exception as e:
@@ -1453,7 +1870,18 @@ class Api(QObject):
     def cancel_download(self, task_id):
         """取消下載"""
         try:
-            self.downloader.cancel_download(task_id)
+            # 跟隨中的任務只解除跟隨，不影響被跟隨的下載
+            with self._lock:
+                primary = self.follower_of.pop(str(task_id), None)
+                if primary is not None:
+                    followers = self.task_followers.get(primary, [])
+                    if int(task_id) in followers:
+                        followers.remove(int(task_id))
+            if primary is not None:
+                return "下載已取消"
+            # 先登記到排程器，進行中的嘗試中止後不再重試；等待磁碟空間中的任務直接結束並釋放預留
+            self.scheduler.cancel(int(task_id))
+            self.downloader.cancel_download(int(task_id))
             return "下載已取消"
         except Exception as e:
             download_console(f"取消下載失敗: {e}", level=LogLevel.ERROR)
@@ -2026,7 +2454,11 @@ class Api(QObject):
                 api_console(f"更新執行失敗: {e}", level=LogLevel.ERROR)
                 safe_msg = str(e).replace('\\', '/')
                 self._eval_js(f"window.__ofUpdateDone && window.__ofUpdateDone(false, '更新過程發生錯誤：{safe_msg}');")
-        threading.Thread(target=run_update, daemon=True).start()
+        try:
+            executors.submit('ui_effects', run_update)
+        except ExecutorBusy as e:
+            api_console(f"無法啟動 yt-dlp 更新: {e}", level=LogLevel.ERROR)
+            self._eval_js("window.__ofUpdateDone && window.__ofUpdateDone(false, '目前背景工作過多，請稍後再試。');")
 
     def show_update_dialog(self, version_info):
         """顯示更新對話框（完全對齊舊版樣式與互動）"""
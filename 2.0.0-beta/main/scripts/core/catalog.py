@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下載目錄索引模組
+
+啟動時掃描下載目錄建立索引（檔名 / 影片 ID → 路徑、大小、格式），
+之後由輪詢監看目錄變動與下載完成回調保持最新，
+讓「檔案是否已存在」的檢查只需查詢記憶體。
+"""
+
+import os
+import sys
+import threading
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+from scripts.config.constants import CATALOG_POLL_INTERVAL_SECONDS
+
+# 下載中或中間產物，不列入索引
+_IGNORED_SUFFIXES = ('.part', '.ytdl', '.temp', '.tmp')
+
+
+def _norm(path):
+    """索引鍵：正規化大小寫與分隔符（Windows 檔名不分大小寫）"""
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+class DownloadCatalog:
+    """下載目錄索引"""
+
+    def __init__(self, poll_interval=CATALOG_POLL_INTERVAL_SECONDS):
+        self.poll_interval = max(0.5, float(poll_interval or CATALOG_POLL_INTERVAL_SECONDS))
+        self._lock = threading.Lock()
+        self._entries = {}     # 正規化路徑 -> {'path', 'name', 'size', 'format', 'video_id'}
+        self._by_video_id = {}  # video_id -> set(正規化路徑)
+        self._dirs = {}        # 正規化目錄 -> {'path', 'mtime', 'keys': set(正規化路徑)}
+        self._stop = threading.Event()
+        self._thread = None
+        self._ydl = None
+        self._ydl_lock = threading.Lock()
+
+    # ---- 目錄監看 ----
+
+    def start(self, directories):
+        """登記要監看的目錄並啟動背景監看執行緒（首次掃描也在背景進行）"""
+        for d in directories or []:
+            self.watch_directory(d, scan=False)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch_loop, name='download-catalog', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def watch_directory(self, directory, scan=True):
+        """新增監看目錄（已監看則忽略）；scan=True 時立即掃描"""
+        if not directory:
+            return
+        key = _norm(directory)
+        with self._lock:
+            if key in self._dirs:
+                return
+            self._dirs[key] = {'path': os.path.abspath(directory), 'mtime': None, 'keys': set()}
+        if scan:
+            self._rescan_if_changed(key)
+
+    def _watch_loop(self):
+        while True:
+            with self._lock:
+                dir_keys = list(self._dirs.keys())
+            for key in dir_keys:
+                try:
+                    self._rescan_if_changed(key)
+                except Exception as e:
+                    download_console(f"下載目錄索引更新失敗: {e}", level=LogLevel.WARNING)
+            if self._stop.wait(self.poll_interval):
+                return
+
+    def _rescan_if_changed(self, dir_key):
+        """目錄的 mtime 有變（新增、刪除、改名）才重新掃描該目錄"""
+        with self._lock:
+            info = self._dirs.get(dir_key)
+            if info is None:
+                return
+            path = info['path']
+            last_mtime = info['mtime']
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime == last_mtime:
+            return
+
+        found = {}
+        if mtime is not None:
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        name = entry.name
+                        if name.startswith('.') or name.lower().endswith(_IGNORED_SUFFIXES):
+                            continue
+                        try:
+                            if not entry.is_file():
+                                continue
+                            size = entry.stat().st_size
+                        except OSError:
+                            continue
+                        found[_norm(entry.path)] = (entry.path, name, size)
+            except OSError as e:
+                download_console(f"掃描下載目錄失敗: {path}: {e}", level=LogLevel.WARNING)
+                return
+
+        with self._lock:
+            info = self._dirs.get(dir_key)
+            if info is None:
+                return
+            for key in info['keys'] - set(found):
+                self._remove_locked(key)
+            for key, (full_path, name, size) in found.items():
+                old = self._entries.get(key)
+                self._entries[key] = {
+                    'path': full_path,
+                    'name': name,
+                    'size': size,
+                    'format': os.path.splitext(name)[1].lstrip('.').lower(),
+                    'video_id': old.get('video_id') if old else None,
+                }
+            info['keys'] = set(found)
+            info['mtime'] = mtime
+        download_console(f"下載目錄索引已更新: {path}（{len(found)} 個檔案）")
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry and entry.get('video_id'):
+            paths = self._by_video_id.get(entry['video_id'])
+            if paths:
+                paths.discard(key)
+                if not paths:
+                    del self._by_video_id[entry['video_id']]
+
+    # ---- 完成回調 ----
+
+    def add_file(self, path, video_id=None):
+        """下載完成時登記檔案（不必等下一次輪詢）"""
+        if not path:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        key = _norm(path)
+        name = os.path.basename(path)
+        dir_key = _norm(os.path.dirname(path))
+        with self._lock:
+            old = self._entries.get(key)
+            vid = video_id or (old.get('video_id') if old else None)
+            self._entries[key] = {
+                'path': path,
+                'name': name,
+                'size': size,
+                'format': os.path.splitext(name)[1].lstrip('.').lower(),
+                'video_id': vid,
+            }
+            if vid:
+                self._by_video_id.setdefault(vid, set()).add(key)
+            if dir_key in self._dirs:
+                self._dirs[dir_key]['keys'].add(key)
+
+    def remove_file(self, path):
+        """檔案被刪除時移出索引"""
+        if not path:
+            return
+        with self._lock:
+            self._remove_locked(_norm(path))
+
+    # ---- 查詢 ----
+
+    def lookup(self, path):
+        """依完整路徑查詢索引，回傳項目（dict）或 None"""
+        if not path:
+            return None
+        with self._lock:
+            entry = self._entries.get(_norm(path))
+            return dict(entry) if entry else None
+
+    def find_by_video_id(self, video_id, formats=None):
+        """依影片 ID 查詢已下載的檔案，可用 formats（副檔名集合）過濾"""
+        if not video_id:
+            return []
+        wanted = {f.lower() for f in formats} if formats else None
+        with self._lock:
+            result = []
+            for key in self._by_video_id.get(video_id, ()):
+                entry = self._entries.get(key)
+                if entry and (wanted is None or entry['format'] in wanted):
+                    result.append(dict(entry))
+            return result
+
+    def expected_path(self, info, outtmpl):
+        """以 yt-dlp 自身的 prepare_filename 推算輸出路徑（與實際下載的檔名清理規則一致）"""
+        if not info or not outtmpl:
+            return None
+        with self._ydl_lock:
+            if self._ydl is None:
+                import yt_dlp
+                self._ydl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True})
+            try:
+                return self._ydl.prepare_filename(dict(info), outtmpl=outtmpl) or None
+            except Exception as e:
+                download_console(f"推算輸出檔名失敗: {e}", level=LogLevel.WARNING)
+                return None
@@ -2,15 +2,22 @@
 # -*- coding: utf-8 -*-
 """
 下載功能模組
+
+基準測試（本地限速伺服器：單一連線 vs 分段下載 http_chunk_size）：
+    python scripts/core/downloader.py --benchmark [--size-mb 40] [--rate-kb 1024] [--burst-mb 10] [--chunk-mb 10]
 """
 
 print("downloader.py is starting...")
 
 import os
 import sys
+import time
 import threading
 import queue
+import traceback
+from collections import deque
 import yt_dlp
+from yt_dlp.utils import DownloadCancelled
 
 # 添加父目錄到路徑，以便導入其他模組
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +28,70 @@ if root_dir not in sys.path:
 
 from scripts.utils.logger import download_console, LogLevel
 from scripts.utils.file_utils import safe_path_join, resolve_relative_path, get_deno_path
+from scripts.core.video_info import remember_video_info, get_cached_video_info
+from scripts.core import executors
+from scripts.core import ffmpeg_governor
+from scripts.core import storage
+from scripts.core.postprocess_planner import make_plan_postprocessor, derive_audio
+from scripts.core.parallel_streams import ParallelStreamsYoutubeDL, StreamProgress
+from scripts.core.format_preference import height_range, ranked_tiers, remux_tier, audio_format_selector
+from scripts.config.constants import (
+    HTTP_CHUNK_SIZE_BY_EXTRACTOR,
+    THROTTLE_SPEED_FLOOR_KB,
+    THROTTLE_WINDOW_SECONDS,
+    THROTTLE_MAX_REEXTRACT,
+    STALL_TIMEOUT_SECONDS,
+    WATCHDOG_INTERVAL_SECONDS,
+    DOWNLOAD_START_INTERVAL_SECONDS,
+    PIPELINE_EXTRACT_SLOTS,
+    PIPELINE_EXTRACT_AHEAD,
+    PIPELINE_POSTPROCESS_SLOTS,
+    PREPARED_INFO_MAX_AGE_SECONDS,
+    STORAGE_WRITE_BUFFER_KB,
+    STORAGE_MIN_FREE_MB,
+    STORAGE_SPACE_RECHECK_SECONDS,
+)
+
+_STAGE_TIMING_WINDOW = 500  # 各階段計算百分位數時保留的最近樣本數
+# 管線階段與顯示名稱
+_STAGE_LABELS = {'extract': '解析', 'network': '下載', 'postprocess': '後處理'}
+
+
+class ThrottledDownload(DownloadCancelled):
+    """下載速度持續低於下限，中止本次嘗試以重新解析串流網址"""
+    msg = '下載速度過低，疑似串流網址被限速'
+
+
+class ThrottleMonitor:
+    """限速偵測器：速度連續低於下限達 window 秒即判定為限速。
+
+    剛開始下載的前 window 秒不判定（連線建立、TCP 慢啟動期間速度本來就低）。
+    """
+
+    def __init__(self, floor_bytes, window_seconds):
+        self.floor_bytes = max(0, int(floor_bytes or 0))
+        self.window_seconds = max(1.0, float(window_seconds or 1))
+        self._started_at = None
+        self._below_since = None
+
+    def feed(self, speed, now=None):
+        """餵入一次速度樣本（bytes/s），回傳是否判定為限速"""
+        if not self.floor_bytes:
+            return False
+        now = time.monotonic() if now is None else now
+        if self._started_at is None:
+            self._started_at = now
+        if speed is None:
+            return False
+        if speed >= self.floor_bytes:
+            self._below_since = None
+            return False
+        if self._below_since is None:
+            self._below_since = now
+        if now - self._started_at < self.window_seconds:
+            return False
+        return now - self._below_since >= self.window_seconds
+
 
 class Downloader:
     """下載器類別"""
@@ -32,6 +103,27 @@ class Downloader:
         self.complete_callback = complete_callback
         self.active_downloads = {}
         self._lock = threading.Lock()
+        # 分段下載（避開單一連線限速），由 Api 依設定 enableChunkedDownload 切換
+        self.throttle_avoidance = True
+        # 限速偵測下限（KB/s），由 Api 依設定 throttleSpeedFloorKB 調整
+        self.throttle_floor_kb = THROTTLE_SPEED_FLOOR_KB
+        self.reextract_counts = {}  # task_id -> 因限速重新解析的次數
+        # 心跳回調：任何位元組或處理階段進度都會呼叫 fn(task_id)，供排程器偵測停滯
+        self.heartbeat_callback = None
+        self._cancel_events = {}  # task_id -> 目前這次嘗試的取消旗標
+        # 取消查詢：fn(task_id) -> 是否已被使用者取消（由排程器指定），嘗試開始前已取消的直接中止
+        self.cancel_check = None
+        # 下載子行程池（設定 useProcessWorkers 時由 Api 指定）；設定後 download_once 改在子行程執行
+        self.process_pool = None
+        # ffmpeg 後處理：限制同時數、分配 -threads、降低優先權
+        ffmpeg_governor.install()
+        # 階段回調：下載進入後處理時呼叫 fn(task_id, 'postprocess')，可阻塞至取得後處理名額（由排程器指定）
+        self.stage_callback = None
+        # 合併格式的影像/音訊串流同時下載，由 Api 依設定 parallelStreamDownload 切換
+        self.parallel_streams = True
+        # 下載寫入緩衝（KB），由 Api 依設定 writeBufferKB 調整；.part 改寫在下載目錄內的暫存目錄
+        self.write_buffer_kb = STORAGE_WRITE_BUFFER_KB
+        storage.install()
     
     def start_download(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None):
         """開始下載"""
@@ -54,22 +146,22 @@ class Downloader:
                 if self.complete_callback:
                     self.complete_callback(task_id, url, error=str(e))
         
-        # 在單獨的執行緒中執行下載
-        thread = threading.Thread(target=download_task, daemon=True)
-        thread.start()
+        # 交給 download 執行器（有上限的具名工作執行緒）
+        future = executors.submit('download', download_task)
         
-        # 使用鎖保護執行緒字典的更新
+        # 使用鎖保護任務字典的更新
         with self._lock:
-            self.active_downloads[task_id] = thread
+            self.active_downloads[task_id] = future
 
-    def download_once(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None):
-        """同步執行一次下載（不自行開 thread；供排程器控制併發/重試）。\n\n        成功回傳最終檔案路徑（可能為 None）。失敗則 raise Exception。\n        """
-        download_console(f"【任務{task_id}】開始下載: {url}", level=LogLevel.INFO)
+    def prepare_download(self, task_id, url, quality, original_format=None):
+        """下載前解析：取得影片資訊並驗證可用格式（管線的解析階段，可在其他任務下載時預先執行）。
 
-        # 先驗證可用的格式（可選，用於調試）
+        回傳 {'extractor', 'info', 'extracted_at'}；解析失敗時 info 為 None，下載時再由 yt-dlp 重新解析。
+        """
+        prepared = {'extractor': None, 'info': None, 'extracted_at': time.time()}
         try:
             import yt_dlp
-            download_console(f"驗證可用格式: 目標畫質={quality}, 目標格式={original_format}")
+            download_console(f"【任務{task_id}】驗證可用格式: 目標畫質={quality}, 目標格式={original_format}")
             # 獲取格式列表以便驗證
             test_opts = {
                 'quiet': True,
@@ -82,6 +174,11 @@ class Downloader:
             
             with yt_dlp.YoutubeDL(test_opts) as ydl:
                 info_dict = ydl.extract_info(url, download=False)
+                prepared['extractor'] = info_dict.get('extractor_key') or info_dict.get('extractor')
+                # 與 yt-dlp --load-info-json 相同：去除私有欄位後可直接交給 process_ie_result 下載
+                prepared['info'] = ydl.sanitize_info(info_dict, remove_private_keys=True)
+                prepared['extracted_at'] = time.time()
+                remember_video_info(url, info_dict)
                 formats = info_dict.get('formats', [])
                 download_console(f"可用格式數量: {len(formats)}")
                 
@@ -118,31 +215,167 @@ class Downloader:
                     download_console(f"警告：未找到完全符合條件的格式，將使用最接近的格式", level=LogLevel.WARNING)
         except Exception as e:
             download_console(f"格式驗證失敗（將繼續下載）: {e}")
+        return prepared
+
+    def download_once(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None, prepared=None):
+        """同步執行一次下載（不自行開 thread；供排程器控制併發/重試）。\n\n        prepared 為 prepare_download 的結果（排程器的解析階段預先取得）；未提供時在此解析。\n        成功回傳最終檔案路徑（可能為 None）。失敗則 raise Exception。\n        """
+        if self._is_cancelled(task_id):
+            raise DownloadCancelled()
+        if self.process_pool is not None:
+            return self.process_pool.run(
+                task_id,
+                url,
+                quality,
+                format_type,
+                downloads_dir=downloads_dir,
+                add_resolution_to_filename=add_resolution_to_filename,
+                original_format=original_format,
+            )
+        download_console(f"【任務{task_id}】開始下載: {url}", level=LogLevel.INFO)
+
+        if prepared is None:
+            prepared = self.prepare_download(task_id, url, quality, original_format)
+        extractor = prepared.get('extractor')
+        info = prepared.get('info')
+        if info is not None and time.time() - (prepared.get('extracted_at') or 0) > PREPARED_INFO_MAX_AGE_SECONDS:
+            info = None  # 預先解析太久，串流網址可能已過期
 
         # 設定下載選項
-        ydl_opts = self._build_download_options(quality, format_type, downloads_dir, add_resolution_to_filename, original_format)
+        ydl_opts = self._build_download_options(quality, format_type, downloads_dir, add_resolution_to_filename, original_format, extractor=extractor)
 
         # 設定進度回調（注入 task_id，便於前端對應）
         last_filename = {'path': ''}
+        monitor = {'current': None}
+        streams = {'progress': StreamProgress()}
+        meter = storage.WriteMeter()
+        ydl_opts['_write_meter'] = meter
+        cancel_event = threading.Event()
+        with self._lock:
+            self.reextract_counts[task_id] = 0
+            self._cancel_events[task_id] = cancel_event
+        # 旗標登記之後再查一次：取消若發生在解析或等待名額期間，登記前的 request_cancel 找不到旗標
+        if self._is_cancelled(task_id):
+            cancel_event.set()
         def hook(d):
+            # 已被取消（例如停滯監控已放棄本次嘗試）：中止，不再回報進度
+            if cancel_event.is_set():
+                raise DownloadCancelled()
+            self._heartbeat(task_id)
             try:
                 d['task_id'] = task_id
+                d['reextract_count'] = self.reextract_counts.get(task_id, 0)
                 fn = d.get('filename')
                 if fn:
                     last_filename['path'] = fn
             except Exception:
                 pass
+            # 合併格式的各串流（可能同時下載）彙總為單一進度，限速偵測也以合計速度判斷
+            d = streams['progress'].update(d)
             self._progress_hook(d, task_id)
+            # 限速偵測：在 yt-dlp 的下載執行緒中拋出，中止本次嘗試（.part 檔保留供續傳）
+            m = monitor['current']
+            if m is not None and d.get('status') == 'downloading' and m.feed(d.get('speed')):
+                raise ThrottledDownload()
         ydl_opts['progress_hooks'] = [hook]
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        in_postprocess = {'value': False, 'keepalive': None}
+        def pp_hook(d):
+            # 後處理（合併/轉檔）階段的進度同樣算作心跳
+            if cancel_event.is_set():
+                raise DownloadCancelled()
+            if not in_postprocess['value'] and d.get('status') == 'started':
+                # 網路傳輸結束、進入後處理：通知排程器切換階段名額
+                in_postprocess['value'] = True
+                self._enter_stage(task_id, 'postprocess')
+                if cancel_event.is_set():
+                    raise DownloadCancelled()  # 等待後處理名額期間被取消
+                # 後處理只有 started/finished 回調：ffmpeg 執行（或等待 ffmpeg 名額）期間定期回報心跳
+                in_postprocess['keepalive'] = self._start_keepalive(task_id)
+            self._heartbeat(task_id)
+        ydl_opts['postprocessor_hooks'] = [pp_hook]
+        # 所有後處理完成後的最終檔案路徑（合併/轉檔後的檔名與最後一個下載串流不同）
+        ydl_opts['post_hooks'] = [lambda fn: last_filename.update(final=fn)]
+        postprocess_plan = ydl_opts.pop('_postprocess_plan', None)
 
-        download_console(f"【任務{task_id}】下載完成", level=LogLevel.INFO)
-        final_path = last_filename['path'] if last_filename.get('path') else None
+        reextracts = 0
+        try:
+            while True:
+                # 每次嘗試使用新的偵測器；重新解析次數用盡後不再偵測，讓下載以目前速度完成
+                if reextracts < THROTTLE_MAX_REEXTRACT:
+                    monitor['current'] = ThrottleMonitor(int(self.throttle_floor_kb or 0) * 1024, THROTTLE_WINDOW_SECONDS)
+                else:
+                    monitor['current'] = None
+                streams['progress'] = StreamProgress()
+                try:
+                    # 每次都建立新的 YoutubeDL；第一次使用預先解析的資訊，限速重試時重新 extract 取得新的串流網址並由 .part 檔續傳
+                    with ParallelStreamsYoutubeDL(
+                        ydl_opts,
+                        parallel=self.parallel_streams,
+                        stream_callback=streams['progress'].expect,
+                    ) as ydl:
+                        if postprocess_plan:
+                            ydl.add_post_processor(make_plan_postprocessor(ydl, postprocess_plan, task_id=task_id), when='post_process')
+                        if info is not None:
+                            ydl.process_ie_result(info, download=True)
+                        else:
+                            ydl.download([url])
+                    break
+                except ThrottledDownload:
+                    info = None
+                    reextracts += 1
+                    with self._lock:
+                        self.reextract_counts[task_id] = reextracts
+                    download_console(
+                        f"【任務{task_id}】下載速度持續低於 {self.throttle_floor_kb}KB/s 達 {THROTTLE_WINDOW_SECONDS} 秒，"
+                        f"重新解析串流網址並續傳（第 {reextracts}/{THROTTLE_MAX_REEXTRACT} 次）",
+                        level=LogLevel.WARNING,
+                    )
+                    if self.progress_callback:
+                        try:
+                            self.progress_callback(task_id, {'status': 'reextracting', 'task_id': task_id, 'reextract_count': reextracts})
+                        except Exception:
+                            pass
+        finally:
+            if in_postprocess['keepalive'] is not None:
+                in_postprocess['keepalive'].set()
+            # 移除本次嘗試的登記（停滯監控放棄後，同一任務的新嘗試可能已換上自己的旗標，不可移除）
+            with self._lock:
+                if self._cancel_events.get(task_id) is cancel_event:
+                    del self._cancel_events[task_id]
+                    self.reextract_counts.pop(task_id, None)
+
+        if reextracts:
+            download_console(f"【任務{task_id}】下載完成（因限速重新解析 {reextracts} 次）", level=LogLevel.INFO)
+        else:
+            download_console(f"【任務{task_id}】下載完成", level=LogLevel.INFO)
+        storage.record_task(task_id, meter)
+        storage.cleanup_temp_dir(ydl_opts['paths']['home'])
+        final_path = last_filename.get('final') or last_filename.get('path') or None
         return final_path
     
-    def _build_download_options(self, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None):
+    def derive_audio(self, task_id, source_path, target_path, quality=None, original_format=None):
+        """從已下載的影片檔在本地產生音訊輸出（不經網路）。成功回傳輸出路徑，失敗則 raise Exception。"""
+        if self._is_cancelled(task_id):
+            raise DownloadCancelled()
+        download_console(f"【任務{task_id}】從已下載的檔案產生音訊: {source_path}", level=LogLevel.INFO)
+        ydl_opts = {'quiet': True}
+        ffmpeg_path = safe_path_join(self.root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
+        if os.path.exists(ffmpeg_path):
+            ydl_opts['ffmpeg_location'] = ffmpeg_path
+        codec = original_format.strip().lower() if original_format else 'mp3'
+        kbps = self._extract_quality_number(quality) or '320'
+
+        # ffmpeg 執行期間沒有進度回調：定期回報心跳，避免長檔案被停滯監控誤判
+        done = self._start_keepalive(task_id)
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                final_path = derive_audio(ydl, source_path, target_path, codec=codec, kbps=kbps, task_id=task_id)
+        finally:
+            done.set()
+        download_console(f"【任務{task_id}】已在本地產生音訊: {final_path}", level=LogLevel.INFO)
+        return final_path
+
+    def _build_download_options(self, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None, extractor=None):
         """建構下載選項"""
         # 設定 FFMPEG 路徑（使用相對路徑）
         ffmpeg_path = safe_path_join(self.root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
@@ -162,44 +395,21 @@ class Downloader:
         
         # 正規化輸入
         fmt_type = (format_type or '').strip()
-        qval = (quality or '').strip()
         download_console(f"接收到的畫質參數: quality='{quality}', format_type='{format_type}'")
-        
-        # 若畫質帶有 'p'，僅取數字
-        try:
-            import re
-            m = re.search(r"(\d+)", qval)
-            qnum = m.group(1) if m else qval
-            download_console(f"提取的畫質數字: {qnum}")
-        except Exception:
-            qnum = qval or '1080'
-            download_console(f"畫質提取失敗，使用預設值: {qnum}")
-
-        # 使用用戶選擇的原始格式作為擴展名（如 mp3, mp4, mkv, webm 等）
-        # 如果沒有提供原始格式，則根據格式類型推斷
-        if original_format:
-            file_ext = original_format.strip().lower()
-        elif fmt_type == "音訊":
-            file_ext = 'mp3'  # 預設音訊格式
-        else:
-            file_ext = 'mp4'  # 預設影片格式
-
-        # 根據設定決定檔名模板，使用用戶選擇的格式作為擴展名
-        if add_resolution_to_filename:
-            if fmt_type == "音訊":
-                # 音訊格式：標題_320kbps.{用戶選擇的格式}
-                outtmpl = os.path.join(target_dir, f'%(title)s_{qnum}kbps.{file_ext}')
-            else:
-                # 影片格式：標題_1080p.{用戶選擇的格式}
-                outtmpl = os.path.join(target_dir, f'%(title)s_%(height)sp.{file_ext}')
-        else:
-            # 使用用戶選擇的格式作為擴展名
-            outtmpl = os.path.join(target_dir, f'%(title)s.{file_ext}')
+        qnum = self._extract_quality_number(quality)
+        # 檔名模板使用相對路徑，由 paths 決定目錄：下載中的檔案寫在同一磁碟區的暫存目錄，完成後 rename 到下載目錄
+        outtmpl = self.build_output_template(quality, format_type, '', add_resolution_to_filename, original_format)
+        paths = {'home': target_dir}
+        temp_dir = storage.temp_dir_for(target_dir)
+        if temp_dir:
+            paths['temp'] = temp_dir
 
         ydl_opts = {
             'outtmpl': outtmpl,
+            'paths': paths,
             'format': self._get_format_selector(qnum, fmt_type, original_format),
             'quiet': True,
+            '_write_buffer_size': max(0, int(self.write_buffer_kb or 0)) * 1024,
         }
         
         # 設定 ffmpeg 路徑（如果存在）
@@ -218,19 +428,26 @@ class Downloader:
         else:
             download_console("未找到 Deno，YouTube 下載可能受限", level=LogLevel.WARNING)
         
+        # 限速迴避：以固定大小的 Range 請求分段下載（單一長連線常被限制在接近即時播放的速度）
+        if self.throttle_avoidance:
+            chunk_size = self._get_http_chunk_size(extractor)
+            if chunk_size:
+                ydl_opts['http_chunk_size'] = chunk_size
+                download_console(f"已啟用分段下載: http_chunk_size={chunk_size // 1024}KB (extractor={extractor or '未知'})")
+        
         # 根據格式類型設定額外選項
         if fmt_type == "音訊":
             # 使用用戶選擇的音訊格式作為 codec（如 mp3, aac, flac, wav）
             audio_codec = original_format.strip().lower() if original_format else 'mp3'
-            ydl_opts.update({
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': audio_codec,
-                    # 音訊位元率使用純數字，如 '320'
-                    'preferredquality': str(qnum or '320'),
-                }],
-            })
+            # 選擇不低於要求位元率的最小串流（同編碼優先）；下載後依來源決定直接複製串流或轉檔，
+            # 轉檔位元率不超過來源（由 download_once 加入 AudioPlanPP，取代固定位元率的 FFmpegExtractAudio）
+            ydl_opts['format'] = audio_format_selector(audio_codec, qnum)
+            ydl_opts['_postprocess_plan'] = {
+                'kind': 'audio',
+                'codec': audio_codec,
+                # 音訊位元率使用純數字，如 '320'
+                'kbps': str(qnum or '320'),
+            }
         else:
             # 影片格式：如果用戶指定了格式（如 mp4），確保輸出格式正確
             if original_format:
@@ -242,19 +459,10 @@ class Downloader:
                     ydl_opts['merge_output_format'] = 'mp4'
                     download_console(f"已設置 merge_output_format=mp4，確保合併後的輸出為 mp4")
                     
-                    # 同時添加 FFmpegVideoConvertor 作為備選，確保最終輸出為 mp4
-                    postprocessors = ydl_opts.get('postprocessors', [])
-                    has_video_converter = any(
-                        pp.get('key') == 'FFmpegVideoConvertor' 
-                        for pp in postprocessors
-                    )
-                    if not has_video_converter:
-                        postprocessors.append({
-                            'key': 'FFmpegVideoConvertor',
-                            'preferedformat': 'mp4',  # 注意：yt-dlp 使用的是 'preferedformat'（拼寫錯誤但這是官方 API）
-                        })
-                        ydl_opts['postprocessors'] = postprocessors
-                        download_console(f"已添加 FFmpegVideoConvertor postprocessor，確保最終輸出為 mp4")
+                    # 確保最終輸出為 mp4：下載後依實際編碼決定不處理/重新封裝/轉檔（不再無條件 FFmpegVideoConvertor）
+                    # ContainerPlanPP 需要 YoutubeDL 實例，由 download_once 取出此鍵後加入
+                    ydl_opts['_postprocess_plan'] = {'kind': 'container', 'target': 'mp4'}
+                    download_console(f"已啟用後處理計畫，確保最終輸出為 mp4")
                 elif target_format in ['webm', 'mkv', 'flv', 'avi']:
                     # 對於其他格式，也設置 merge_output_format
                     if ffmpeg_path and os.path.exists(ffmpeg_path):
@@ -263,11 +471,99 @@ class Downloader:
         
         return ydl_opts
     
+    def _extract_quality_number(self, quality):
+        """若畫質帶有 'p' 或 'kbps'，僅取數字"""
+        qval = (quality or '').strip()
+        try:
+            import re
+            m = re.search(r"(\d+)", qval)
+            return m.group(1) if m else qval
+        except Exception:
+            return qval or '1080'
+
+    def build_output_template(self, quality, format_type, target_dir, add_resolution_to_filename=False, original_format=None):
+        """建構輸出檔名模板（yt-dlp outtmpl）；下載與「檔案是否存在」檢查共用"""
+        fmt_type = (format_type or '').strip()
+        qnum = self._extract_quality_number(quality)
+
+        # 使用用戶選擇的原始格式作為擴展名（如 mp3, mp4, mkv, webm 等）
+        # 如果沒有提供原始格式，則根據格式類型推斷
+        if original_format:
+            file_ext = original_format.strip().lower()
+        elif fmt_type == "音訊":
+            file_ext = 'mp3'  # 預設音訊格式
+        else:
+            file_ext = 'mp4'  # 預設影片格式
+
+        # 根據設定決定檔名模板，使用用戶選擇的格式作為擴展名
+        if add_resolution_to_filename:
+            if fmt_type == "音訊":
+                # 音訊格式：標題_320kbps.{用戶選擇的格式}
+                return os.path.join(target_dir, f'%(title)s_{qnum}kbps.{file_ext}')
+            # 影片格式：標題_1080p.{用戶選擇的格式}
+            return os.path.join(target_dir, f'%(title)s_%(height)sp.{file_ext}')
+        # 使用用戶選擇的格式作為擴展名
+        return os.path.join(target_dir, f'%(title)s.{file_ext}')
+
+    def _start_keepalive(self, task_id):
+        """定期回報心跳直到回傳的 Event 被設定（ffmpeg 執行期間沒有進度回調）"""
+        done = threading.Event()
+        def keepalive():
+            while not done.wait(WATCHDOG_INTERVAL_SECONDS):
+                self._heartbeat(task_id)
+        threading.Thread(target=keepalive, name=f'pp-heartbeat-{task_id}', daemon=True).start()
+        return done
+
+    def _heartbeat(self, task_id):
+        """回報任務仍有進度（供停滯監控使用）"""
+        try:
+            if callable(self.heartbeat_callback):
+                self.heartbeat_callback(task_id)
+        except Exception:
+            pass
+
+    def _enter_stage(self, task_id, stage):
+        """通知排程器任務進入新階段（可能阻塞等待該階段名額）"""
+        try:
+            if callable(self.stage_callback):
+                self.stage_callback(task_id, stage)
+        except Exception as e:
+            download_console(f"【任務{task_id}】切換至{_STAGE_LABELS.get(stage, stage)}階段失敗: {e}", level=LogLevel.WARNING)
+
+    def _is_cancelled(self, task_id):
+        """任務是否已被使用者取消（排程器的取消集合）"""
+        try:
+            return callable(self.cancel_check) and bool(self.cancel_check(task_id))
+        except Exception:
+            return False
+
+    def request_cancel(self, task_id):
+        """要求中止任務目前這次嘗試；於下一次進度回調時生效"""
+        if self.process_pool is not None:
+            return self.process_pool.cancel(task_id)
+        with self._lock:
+            ev = self._cancel_events.get(task_id)
+        if ev is not None:
+            ev.set()
+            return True
+        return False
+
+    def _get_http_chunk_size(self, extractor=None):
+        """依 extractor 取得分段下載大小（bytes），0 代表不分段"""
+        # extractor_key 沒有冒號；傳入 IE 名稱（如 'twitch:vod'）時也對應到同一項
+        key = (extractor or '').strip().lower().replace(':', '')
+        try:
+            if key in HTTP_CHUNK_SIZE_BY_EXTRACTOR:
+                return int(HTTP_CHUNK_SIZE_BY_EXTRACTOR[key] or 0)
+            return int(HTTP_CHUNK_SIZE_BY_EXTRACTOR.get('default', 0) or 0)
+        except (TypeError, ValueError):
+            return 0
+    
     def _get_format_selector(self, quality, format_type, original_format=None):
         """獲取格式選擇器 - 使用更嚴格的篩選機制確保畫質匹配"""
         # 影片：依高度限制，音訊：無高度限制
         if format_type == "音訊":
-            return "bestaudio/best"
+            return audio_format_selector(original_format, self._extract_quality_number(quality))
         
         # 將畫質字符串轉換為數字
         try:
@@ -282,72 +578,38 @@ class Downloader:
             target_ext = original_format.strip().lower()
             download_console(f"用戶選擇的格式: {target_ext}")
         
-        # 定義畫質容差範圍（允許的偏差）
-        # 策略：優先選擇不超過目標的畫質，如果沒有才選擇略高的畫質
-        # 對於常見畫質，定義允許的範圍
-        quality_ranges = {
-            360: (360, 480),   # 360p: 允許 360-480p（上限）
-            480: (480, 720),   # 480p: 允許 480-720p（上限）
-            720: (720, 1080),  # 720p: 允許 720-1080p（上限）
-            1080: (1080, 1440), # 1080p: 允許 1080-1440p（上限）
-            1440: (1440, 2160), # 1440p: 允許 1440-2160p（上限）
-            2160: (2160, 4320), # 2160p: 允許 2160-4320p（上限）
-            4320: (4320, 9999), # 4320p: 允許 4320p 及以上
-        }
-        
-        # 找到最接近的畫質級別並設定範圍
-        min_height = max(360, qnum - 20)  # 允許 -20p 偏差（更嚴格）
-        max_height = qnum + 50  # 允許 +50p 偏差（更嚴格，避免選擇過高畫質）
-        
-        # 根據目標畫質調整範圍
-        for base_quality, (min_q, max_q) in sorted(quality_ranges.items()):
-            if qnum <= base_quality:
-                # 使用該級別的下限作為最小高度
-                min_height = min_q
-                # 最大高度不超過該級別的上限，且不超過目標+50p
-                max_height = min(max_q, qnum + 50)
-                break
-        else:
-            # 如果目標畫質超過 4320p，使用更寬鬆的範圍
-            min_height = max(360, qnum - 50)
-            max_height = qnum + 100
-        
+        # 畫質容差範圍：優先選擇不超過目標的畫質，如果沒有才選擇略高的畫質
+        min_height, max_height = height_range(qnum)
         download_console(f"畫質範圍: {min_height}p - {max_height}p (目標: {qnum}p)")
         
         # 構建格式選擇器，使用更嚴格的優先級
         # 注意：yt-dlp 不支持 height={qnum} 精確匹配，使用 height<= 和 height>= 組合
+        in_range = f"[height>={min_height}][height<={qnum}]"
+        above = f"[height>{qnum}][height<={max_height}]"
         if target_ext and target_ext in ['mp4', 'webm', 'mkv', 'flv', 'avi']:
-            # 優先選擇指定格式，嚴格限制畫質範圍
-            # 使用 height<=qnum 和 height>=qnum 組合來近似精確匹配
-            format_selector = (
+            # 每個畫質範圍內依成本排序：原生編碼組合 → 指定副檔名 → 可直接封裝的編碼 → 需重新編碼的組合
+            tiers = (
                 # 第一優先級：在允許範圍內的最佳格式（不超過目標，最接近目標）
-                f"bestvideo[ext={target_ext}][height>={min_height}][height<={qnum}]+bestaudio[ext=m4a]/"
-                f"bestvideo[ext={target_ext}][height>={min_height}][height<={qnum}]+bestaudio/"
-                f"best[ext={target_ext}][height>={min_height}][height<={qnum}]/"
+                ranked_tiers(target_ext, in_range)
                 # 第二優先級：在允許範圍內但略高於目標（僅當沒有符合的較低畫質時，且不超過最大限制）
-                f"bestvideo[ext={target_ext}][height>{qnum}][height<={max_height}]+bestaudio[ext=m4a]/"
-                f"bestvideo[ext={target_ext}][height>{qnum}][height<={max_height}]+bestaudio/"
-                f"best[ext={target_ext}][height>{qnum}][height<={max_height}]/"
+                + ranked_tiers(target_ext, above)
                 # 第三優先級：不限制格式，但嚴格限制畫質範圍（不超過目標）
-                f"bestvideo[height>={min_height}][height<={qnum}]+bestaudio/"
-                f"best[height>={min_height}][height<={qnum}]/"
+                + [remux_tier(target_ext, in_range), f"bestvideo{in_range}+bestaudio", f"best{in_range}"]
                 # 第四優先級：不限制格式，但略高於目標（且不超過最大限制）
-                f"bestvideo[height>{qnum}][height<={max_height}]+bestaudio/"
-                f"best[height>{qnum}][height<={max_height}]/"
+                + [remux_tier(target_ext, above), f"bestvideo{above}+bestaudio", f"best{above}"]
                 # 最後回退：不限制格式和畫質（僅當沒有符合條件的格式時）
-                f"bestvideo[ext={target_ext}]+bestaudio/"
-                f"best[ext={target_ext}]/"
-                f"bestvideo+bestaudio/best"
+                + [f"bestvideo[ext={target_ext}]+bestaudio", f"best[ext={target_ext}]", "bestvideo+bestaudio", "best"]
             )
+            format_selector = "/".join(t for t in tiers if t)
         else:
             # 如果沒有指定格式，使用通用選擇器，但嚴格限制畫質範圍
             format_selector = (
                 # 第一優先級：在允許範圍內的最佳格式（不超過目標）
-                f"bestvideo[height>={min_height}][height<={qnum}]+bestaudio/"
-                f"best[height>={min_height}][height<={qnum}]/"
+                f"bestvideo{in_range}+bestaudio/"
+                f"best{in_range}/"
                 # 第二優先級：在允許範圍內但略高於目標（僅當沒有符合的較低畫質時，且不超過最大限制）
-                f"bestvideo[height>{qnum}][height<={max_height}]+bestaudio/"
-                f"best[height>{qnum}][height<={max_height}]/"
+                f"bestvideo{above}+bestaudio/"
+                f"best{above}/"
                 # 最後回退：不限制畫質（僅當沒有符合條件的格式時）
                 f"bestvideo+bestaudio/best"
             )
@@ -365,11 +627,15 @@ class Downloader:
     
     def cancel_download(self, task_id):
         """取消下載"""
+        task_id = int(task_id)
+        # yt-dlp 沒有直接的取消方法：設定取消旗標，由進度回調拋出 DownloadCancelled 中止
+        self.request_cancel(task_id)
         with self._lock:
-            if task_id in self.active_downloads:
-                # 注意：yt-dlp 沒有直接的取消方法，這裡只是移除追蹤
-                del self.active_downloads[task_id]
-                download_console(f"【任務{task_id}】下載已取消")
+            future = self.active_downloads.pop(task_id, None)
+        if future is not None:
+            # 尚未開始的直接取消；執行中的由取消旗標中止
+            future.cancel()
+            download_console(f"【任務{task_id}】下載已取消")
     
     def get_download_status(self, task_id):
         """獲取下載狀態"""
@@ -377,25 +643,133 @@ class Downloader:
             return task_id in self.active_downloads
 
 
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return round(values[k], 1)
+
+
+class _StageGate:
+    """管線階段名額：限制同時處於該階段的任務數，並記錄等待/執行時間"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(1, int(limit or 1))
+        self._sem = threading.Semaphore(self.limit)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._completed = 0
+        self._wait_ms = deque(maxlen=_STAGE_TIMING_WINDOW)
+        self._run_ms = deque(maxlen=_STAGE_TIMING_WINDOW)
+
+    def acquire(self, on_wait=None):
+        """取得名額（必要時阻塞）；需要等待時先呼叫 on_wait()。回傳等待秒數"""
+        started = time.monotonic()
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                self._waiting += 1
+            try:
+                if callable(on_wait):
+                    on_wait()
+                self._sem.acquire()
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        waited = time.monotonic() - started
+        with self._lock:
+            self._active += 1
+            self._wait_ms.append(waited * 1000.0)
+        return waited
+
+    def release(self, elapsed):
+        self._sem.release()
+        with self._lock:
+            self._active -= 1
+            self._completed += 1
+            self._run_ms.append(elapsed * 1000.0)
+
+    def stats(self):
+        with self._lock:
+            wait_ms = list(self._wait_ms)
+            run_ms = list(self._run_ms)
+            return {
+                'limit': self.limit,
+                'active': self._active,
+                'waiting': self._waiting,
+                'completed': self._completed,
+                'wait_p50_ms': _percentile(wait_ms, 50),
+                'wait_p99_ms': _percentile(wait_ms, 99),
+                'run_p50_ms': _percentile(run_ms, 50),
+                'run_p99_ms': _percentile(run_ms, 99),
+            }
+
+
 class DownloadScheduler:
-    """全域下載排程器：控制同時下載數、集中重試。\n\n    - 使用固定 worker 數量確保同時下載上限。\n+    - 每個任務最多重試 retry_count 次（總嘗試次數 = retry_count）。\n    """
+    """全域下載排程器：控制同時下載數、集中重試。\n\n    - 下載管線分為解析 → 網路傳輸 → 後處理三個階段，各有獨立名額：\n      網路名額（= 同時下載上限）只在傳輸期間佔用，進入 ffmpeg 後處理即釋放；\n      額外的 worker 在其他任務下載時預先解析後續任務。\n    - 空間預留：解析後依預估大小預留下載目錄所在磁碟區的空間，放不下的任務等待（不佔任何名額），\n      任務結束或取消時釋放預留。\n    - 每個任務最多重試 retry_count 次（總嘗試次數 = retry_count）。\n    - 停滯監控：任務超過 stall_timeout 秒沒有進度即放棄該次嘗試、補上新的 worker 並重新排入佇列。\n    - 啟動節流：任兩個任務開始下載至少間隔 start_interval 秒（批次提交時不需自行錯開）。\n    """
 
-    def __init__(self, downloader: Downloader, max_concurrent: int = 3, retry_count: int = 3, status_callback=None):
+    def __init__(self, downloader: Downloader, max_concurrent: int = 3, retry_count: int = 3, status_callback=None, stall_timeout: float = STALL_TIMEOUT_SECONDS, start_interval: float = DOWNLOAD_START_INTERVAL_SECONDS, min_free_mb: int = STORAGE_MIN_FREE_MB):
         self.downloader = downloader
         self.max_concurrent = max(1, int(max_concurrent or 1))
         self.retry_count = max(1, int(retry_count or 1))
         self.status_callback = status_callback  # fn(task_id, status_text)
+        self.stall_timeout = float(stall_timeout or STALL_TIMEOUT_SECONDS)
+        self.start_interval = max(0.0, float(start_interval or 0))
 
         self._q = queue.Queue()
         self._stop = threading.Event()
         self._workers = []
+        self._next_worker_id = 0
+        # 執行中的嘗試：task_id -> {'job', 'attempt', 'thread', 'last_activity', 'abandoned'}
+        self._running = {}
+        self._running_lock = threading.Lock()
+        # 已排入或執行中的任務 ID（去重用）
+        self._known_task_ids = set()
+        self._known_lock = threading.Lock()
+        # 啟動節流：下一個任務最早可開始的時間
+        self._next_start_at = 0.0
+        self._pace_lock = threading.Lock()
+        # 管線階段名額；worker 目前的嘗試記在 thread-local，供下載器的階段回調使用
+        self._gates = {
+            'extract': _StageGate('extract', PIPELINE_EXTRACT_SLOTS),
+            'network': _StageGate('network', self.max_concurrent),
+            'postprocess': _StageGate('postprocess', PIPELINE_POSTPROCESS_SLOTS),
+        }
+        self._local = threading.local()
+        # 空間預留；_space_cond 在預留釋放或任務取消時喚醒等待空間的任務
+        self._space = storage.SpaceReservations(int(min_free_mb or 0) * 1024 * 1024)
+        self._space_cond = threading.Condition()
+        self._cancelled = set()
 
-        for i in range(self.max_concurrent):
-            t = threading.Thread(target=self._worker_loop, args=(i,), daemon=True)
-            t.start()
-            self._workers.append(t)
+        self.downloader.heartbeat_callback = self._touch
+        self.downloader.stage_callback = self._on_stage
+        self.downloader.cancel_check = self._is_cancelled
+
+        # 子行程模式下解析與後處理都在子行程內，只有網路名額生效；否則多開預先解析與後處理用的 worker
+        if self.downloader.process_pool is not None:
+            worker_count = self.max_concurrent
+        else:
+            worker_count = self.max_concurrent + PIPELINE_EXTRACT_AHEAD + PIPELINE_POSTPROCESS_SLOTS
+        for _ in range(worker_count):
+            self._spawn_worker()
 
-    def submit(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None):
+        self._watchdog = threading.Thread(target=self._watchdog_loop, name='download-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def _spawn_worker(self):
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        t = threading.Thread(target=self._worker_loop, args=(worker_id,), name=f'download-worker-{worker_id}', daemon=True)
+        t.start()
+        self._workers.append(t)
+        return t
+
+    def submit(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None, derive_from=None, derive_to=None):
+        """排入任務；derive_from/derive_to 指定時，改為從已下載的檔案在後處理階段本地產生音訊（失敗才下載）"""
+        with self._known_lock:
+            self._known_task_ids.add(int(task_id))
         self._q.put({
             'task_id': int(task_id),
             'url': url,
@@ -404,8 +778,156 @@ class DownloadScheduler:
             'downloads_dir': downloads_dir,
             'add_resolution_to_filename': add_resolution_to_filename,
             'original_format': original_format,
+            'derive_from': derive_from,
+            'derive_to': derive_to,
         })
 
+    def submit_many(self, jobs):
+        """批次提交：一次驗證、去重並排入整批任務（O(n)，不另開執行緒）。
+
+        jobs: [{'task_id', 'url', 'quality', 'format_type', 'downloads_dir', 'add_resolution_to_filename', 'original_format'}, ...]
+        回傳 {'accepted': [task_id, ...], 'rejected': [(task_id, 原因), ...]}。
+        開始下載的節奏交由排程器的啟動節流控制。
+        """
+        accepted = []
+        rejected = []
+        to_enqueue = []
+        with self._known_lock:
+            for job in jobs or []:
+                if not isinstance(job, dict):
+                    rejected.append((None, '格式錯誤'))
+                    continue
+                try:
+                    task_id = int(job.get('task_id'))
+                except (TypeError, ValueError):
+                    rejected.append((job.get('task_id'), '任務ID無效'))
+                    continue
+                url = str(job.get('url') or '').strip()
+                if not url:
+                    rejected.append((task_id, '缺少 URL'))
+                    continue
+                if task_id in self._known_task_ids:
+                    rejected.append((task_id, '任務已在佇列中'))
+                    continue
+                self._known_task_ids.add(task_id)
+                to_enqueue.append({
+                    'task_id': task_id,
+                    'url': url,
+                    'quality': job.get('quality'),
+                    'format_type': job.get('format_type'),
+                    'downloads_dir': job.get('downloads_dir'),
+                    'add_resolution_to_filename': job.get('add_resolution_to_filename', False),
+                    'original_format': job.get('original_format'),
+                })
+                accepted.append(task_id)
+        for job in to_enqueue:
+            self._q.put(job)
+        download_console(f"批次提交 {len(accepted)} 個任務（略過 {len(rejected)} 個）", level=LogLevel.INFO)
+        return {'accepted': accepted, 'rejected': rejected}
+
+    def is_known(self, task_id):
+        """任務 ID 是否已排入或執行中"""
+        with self._known_lock:
+            return int(task_id) in self._known_task_ids
+
+    def _forget(self, task_id):
+        """任務結束（完成或最終失敗）後移出去重集合，並釋放空間預留"""
+        with self._known_lock:
+            self._known_task_ids.discard(task_id)
+        with self._space_cond:
+            self._cancelled.discard(task_id)
+            if self._space.release(task_id):
+                self._space_cond.notify_all()
+
+    def cancel(self, task_id):
+        """取消任務：等待空間中的任務立即結束並釋放預留（下載中的嘗試由下載器的取消旗標中止）"""
+        task_id = int(task_id)
+        with self._known_lock:
+            if task_id not in self._known_task_ids:
+                return
+        with self._space_cond:
+            self._cancelled.add(task_id)
+            self._space_cond.notify_all()
+
+    def _is_cancelled(self, task_id):
+        """任務是否已被取消（排程器停止時視同全部取消）"""
+        if self._stop.is_set():
+            return True
+        with self._space_cond:
+            return task_id in self._cancelled
+
+    def _check_cancelled(self, task_id):
+        """階段之間的取消檢查：解析或等待名額期間被取消時中止本次嘗試"""
+        if self._is_cancelled(task_id):
+            raise DownloadCancelled()
+
+    def stop(self, timeout=1.0):
+        """關閉視窗時停止排程器：不再取出新任務、中止執行中的嘗試（.part 檔保留供下次續傳），
+        timeout 秒內等待 worker 與停滯監控執行緒結束"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        with self._space_cond:
+            self._space_cond.notify_all()
+        with self._running_lock:
+            running = list(self._running)
+        for task_id in running:
+            try:
+                self.downloader.request_cancel(task_id)
+            except Exception:
+                pass
+        deadline = time.monotonic() + max(0.0, timeout)
+        for t in list(self._workers) + [self._watchdog]:
+            t.join(max(0.0, deadline - time.monotonic()))
+        alive = sum(1 for t in self._workers if t.is_alive())
+        if alive:
+            download_console(f"下載排程器已停止，{alive} 個 worker 仍在結束中", level=LogLevel.WARNING)
+
+    def _reserve_space(self, run, task_id, downloads_dir, nbytes):
+        """預留任務的磁碟空間；放不下時釋放目前的名額並等待。回傳 False 代表等待中被取消"""
+        target = downloads_dir or self.downloader.downloads_dir
+        ok, available = self._space.try_reserve(task_id, target, nbytes)
+        if ok:
+            return True
+        self._space.note_held()
+        self._leave_stage(run)
+        download_console(
+            f"【任務{task_id}】磁碟空間不足：預估需要 {nbytes / 1048576:.0f}MB，可預留 {available / 1048576:.0f}MB，等待其他任務釋放空間",
+            level=LogLevel.WARNING,
+        )
+        self._emit_status(task_id, "磁碟空間不足，等待中")
+        with self._running_lock:
+            run['waiting'] = True
+        try:
+            while not self._stop.is_set():
+                with self._space_cond:
+                    if task_id in self._cancelled:
+                        return False
+                    self._space_cond.wait(STORAGE_SPACE_RECHECK_SECONDS)
+                    if task_id in self._cancelled:
+                        return False
+                ok, available = self._space.try_reserve(task_id, target, nbytes)
+                if ok:
+                    download_console(f"【任務{task_id}】已取得磁碟空間，開始下載", level=LogLevel.INFO)
+                    return True
+            return False
+        finally:
+            with self._running_lock:
+                run['waiting'] = False
+                run['last_activity'] = time.monotonic()
+
+    def _pace_start(self):
+        """啟動節流：確保任兩個任務開始下載至少間隔 start_interval 秒"""
+        if not self.start_interval:
+            return
+        with self._pace_lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_start_at)
+            self._next_start_at = start_at + self.start_interval
+        wait = start_at - now
+        if wait > 0:
+            self._stop.wait(wait)
+
     def _emit_status(self, task_id, text):
         try:
             if callable(self.status_callback):
@@ -413,6 +935,68 @@ class DownloadScheduler:
         except Exception:
             pass
 
+    def _touch(self, task_id):
+        """下載器心跳：更新任務最後進度時間"""
+        with self._running_lock:
+            run = self._running.get(task_id)
+            if run is not None:
+                run['last_activity'] = time.monotonic()
+
+    def _enter_stage(self, run, stage, on_wait=None):
+        """釋放目前的階段名額並取得 stage 的名額；等待名額期間不列入停滯監控"""
+        self._leave_stage(run)
+        gate = self._gates[stage]
+        with self._running_lock:
+            run['waiting'] = True
+        try:
+            waited = gate.acquire(on_wait=on_wait)
+        finally:
+            now = time.monotonic()
+            with self._running_lock:
+                run['waiting'] = False
+                run['last_activity'] = now
+        with self._running_lock:
+            run['held'] = (gate, now)
+        timings = run['timings']
+        timings[f'{stage}_wait'] = timings.get(f'{stage}_wait', 0.0) + waited
+
+    def _leave_stage(self, run):
+        """釋放嘗試目前佔用的階段名額（可重複呼叫；停滯監控放棄嘗試時也會代為釋放）"""
+        with self._running_lock:
+            held, run['held'] = run.get('held'), None
+        if held is None:
+            return
+        gate, entered_at = held
+        elapsed = time.monotonic() - entered_at
+        gate.release(elapsed)
+        timings = run['timings']
+        timings[gate.name] = timings.get(gate.name, 0.0) + elapsed
+
+    def _on_stage(self, task_id, stage):
+        """下載器的階段回調（在下載執行緒中呼叫）：進入後處理時把網路名額換成後處理名額"""
+        run = getattr(self._local, 'run', None)
+        if run is None or run['abandoned'] or run['job'].get('task_id') != task_id or stage not in self._gates:
+            return
+        self._enter_stage(run, stage, on_wait=lambda: self._emit_status(task_id, "等待後處理"))
+
+    def _log_stage_timings(self, task_id, timings):
+        parts = []
+        for stage in ('extract', 'network', 'postprocess'):
+            if stage in timings:
+                parts.append(
+                    f"{_STAGE_LABELS[stage]} {timings[stage]:.1f}s（等待 {timings.get(f'{stage}_wait', 0.0):.1f}s）"
+                )
+        if parts:
+            download_console(f"【任務{task_id}】階段耗時: " + " / ".join(parts), level=LogLevel.INFO)
+
+    def stage_stats(self):
+        """各管線階段的名額、執行中/等待中數量與等待/執行時間（p50/p99）"""
+        return {name: gate.stats() for name, gate in self._gates.items()}
+
+    def space_stats(self):
+        """空間預留：預留中的任務數與位元組、保留空間與因空間不足等待過的次數"""
+        return self._space.stats()
+
     def _worker_loop(self, worker_id):
         while not self._stop.is_set():
             job = None
@@ -432,27 +1016,128 @@ class DownloadScheduler:
             original_format = job.get('original_format')
 
             last_err = None
-            for attempt in range(1, self.retry_count + 1):
+            abandoned = False
+            timings = {}
+            for attempt in range(int(job.get('attempt', 1) or 1), self.retry_count + 1):
+                if self._is_cancelled(task_id):
+                    # 使用者已取消（排隊中或重試前）：不再嘗試
+                    last_err = Exception("下載已取消")
+                    break
+                run = {
+                    'job': job,
+                    'attempt': attempt,
+                    'thread': threading.current_thread(),
+                    'last_activity': time.monotonic(),
+                    'abandoned': False,
+                    'waiting': False,
+                    'held': None,
+                    'timings': timings,
+                }
+                with self._running_lock:
+                    self._running[task_id] = run
+                self._local.run = run
                 try:
                     if attempt > 1:
                         self._emit_status(task_id, f"下載失敗，重試中({attempt}/{self.retry_count})")
-                    final_path = self.downloader.download_once(
-                        task_id,
-                        url,
-                        quality,
-                        format_type,
-                        downloads_dir=downloads_dir,
-                        add_resolution_to_filename=add_resolution,
-                        original_format=original_format,
-                    )
+                    if job.get('derive_from'):
+                        # 同一影片已下載：只佔後處理名額，在本地產生音訊
+                        self._enter_stage(run, 'postprocess', on_wait=lambda: self._emit_status(task_id, "等待後處理"))
+                        self._check_cancelled(task_id)
+                        self._emit_status(task_id, "從已下載的影片產生音訊")
+                        try:
+                            final_path = self.downloader.derive_audio(
+                                task_id,
+                                job['derive_from'],
+                                job.get('derive_to'),
+                                quality=quality,
+                                original_format=original_format,
+                            )
+                        except DownloadCancelled:
+                            raise
+                        except Exception as e:
+                            # 本地產生失敗（例如來源已刪除、沒有音訊）：改為從網路下載
+                            download_console(f"【任務{task_id}】本地產生音訊失敗，改為下載: {e}", level=LogLevel.WARNING)
+                            job = dict(job, derive_from=None, derive_to=None)
+                            run['job'] = job
+                            self._leave_stage(run)
+                        else:
+                            self._leave_stage(run)
+                            if self._finish_run(task_id, run):
+                                abandoned = True
+                                break
+                            if self.downloader.complete_callback:
+                                self.downloader.complete_callback(task_id, url, file_path=final_path)
+                            last_err = None
+                            break
+                    prepared = None
+                    if self.downloader.process_pool is None:
+                        # 解析階段：不佔網路名額，其他任務下載時即可預先解析
+                        self._enter_stage(run, 'extract')
+                        self._check_cancelled(task_id)
+                        prepared = self.downloader.prepare_download(task_id, url, quality, original_format)
+                        self._check_cancelled(task_id)
+                    # 空間預留：子行程模式沒有預先解析，改用快取的影片資訊（只有頂層欄位）估計
+                    info = (prepared or {}).get('info') or get_cached_video_info(url)
+                    estimate = storage.estimate_task_bytes(info, quality, format_type, original_format)
+                    if not self._reserve_space(run, task_id, downloads_dir, estimate):
+                        self._finish_run(task_id, run)
+                        last_err = Exception("下載已取消")
+                        break
+                    self._enter_stage(run, 'network')
+                    # 啟動節流只作用在網路傳輸（本地產生音訊不經網路）
+                    self._pace_start()
+                    self._check_cancelled(task_id)
+                    try:
+                        final_path = self.downloader.download_once(
+                            task_id,
+                            url,
+                            quality,
+                            format_type,
+                            downloads_dir=downloads_dir,
+                            add_resolution_to_filename=add_resolution,
+                            original_format=original_format,
+                            prepared=prepared,
+                        )
+                    finally:
+                        self._leave_stage(run)
+                    if self._finish_run(task_id, run):
+                        abandoned = True
+                        break
                     if self.downloader.complete_callback:
                         self.downloader.complete_callback(task_id, url, file_path=final_path)
                     last_err = None
                     break
                 except Exception as e:
+                    self._leave_stage(run)
+                    if self._finish_run(task_id, run):
+                        abandoned = True
+                        break
+                    if isinstance(e, DownloadCancelled) or self._is_cancelled(task_id):
+                        # 使用者取消：不重試，結束任務並釋放空間預留
+                        download_console(f"【任務{task_id}】下載已取消", level=LogLevel.INFO)
+                        last_err = Exception("下載已取消")
+                        break
                     last_err = e
                     download_console(f"【任務{task_id}】worker{worker_id} 下載失敗({attempt}/{self.retry_count}): {e}", level=LogLevel.ERROR)
 
+            self._local.run = None
+            try:
+                self._q.task_done()
+            except Exception:
+                pass
+            self._log_stage_timings(task_id, timings)
+
+            if self._stop.is_set():
+                # 排程器停止（關閉視窗）：任務未完成，不回報結果
+                return
+
+            if abandoned:
+                # 這次嘗試已被停滯監控放棄（已補上新 worker、任務已重新排入），此 worker 直接結束
+                download_console(f"【任務{task_id}】worker{worker_id} 已被停滯監控放棄，結束此 worker", level=LogLevel.WARNING)
+                return
+
+            self._forget(task_id)
+
             if last_err is not None:
                 # 最終失敗才回報 error（由 Api 決定是否彈窗）
                 if self.downloader.complete_callback:
@@ -461,7 +1146,192 @@ class DownloadScheduler:
                     except Exception:
                         pass
 
+    def _finish_run(self, task_id, run):
+        """結束一次嘗試的追蹤；回傳該嘗試是否已被停滯監控放棄"""
+        with self._running_lock:
+            if self._running.get(task_id) is run:
+                del self._running[task_id]
+            return run.get('abandoned', False)
+
+    def _watchdog_loop(self):
+        """停滯監控：定期檢查執行中任務的最後進度時間"""
+        while not self._stop.wait(WATCHDOG_INTERVAL_SECONDS):
+            now = time.monotonic()
+            stalled = []
+            with self._running_lock:
+                for task_id, run in list(self._running.items()):
+                    if run['abandoned'] or run['waiting']:
+                        continue
+                    if now - run['last_activity'] >= self.stall_timeout:
+                        run['abandoned'] = True
+                        del self._running[task_id]
+                        stalled.append((task_id, run))
+            for task_id, run in stalled:
+                try:
+                    self._handle_stalled(task_id, run, now - run['last_activity'])
+                except Exception as e:
+                    download_console(f"【任務{task_id}】停滯處理失敗: {e}", level=LogLevel.ERROR)
+
+    def _handle_stalled(self, task_id, run, idle_seconds):
+        """放棄卡住的嘗試：記錄堆疊、要求取消、補上 worker，並依重試規則重新排入佇列"""
+        thread = run.get('thread')
+        frame = sys._current_frames().get(getattr(thread, 'ident', None))
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '（無法取得堆疊）'
+        download_console(
+            f"【任務{task_id}】已 {idle_seconds:.0f} 秒沒有進度（第 {run['attempt']}/{self.retry_count} 次嘗試），"
+            f"執行緒 {getattr(thread, 'name', '?')} 堆疊快照:\n{stack}",
+            level=LogLevel.WARNING,
+        )
+
+        # 卡住的執行緒無法強制結束：設定取消旗標，若之後恢復會在下一次進度回調中止
+        self.downloader.request_cancel(task_id)
+        # 釋放被佔住的階段名額，並補上新的 worker
+        self._leave_stage(run)
+        self._spawn_worker()
+
+        job = run['job']
+        next_attempt = run['attempt'] + 1
+        if next_attempt <= self.retry_count:
+            self._emit_status(task_id, f"下載停滯，重試中({next_attempt}/{self.retry_count})")
+            requeued = dict(job)
+            requeued['attempt'] = next_attempt
+            self._q.put(requeued)
+            return
+        self._forget(task_id)
+        if self.downloader.complete_callback:
             try:
-                self._q.task_done()
+                self.downloader.complete_callback(task_id, job.get('url'), error=f"下載停滯超過 {int(self.stall_timeout)} 秒")
             except Exception:
                 pass
+
+
+# ---- 基準測試 ----
+
+def _throttling_handler(payload, rate_bytes, burst_bytes):
+    """本地限速伺服器的請求處理：每條連線前 burst_bytes 全速送出，之後限制在 rate_bytes/s
+    （模擬串流網站對長時間連線的限速；支援 Range，回應後關閉連線，分段請求各自是新連線）"""
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _range(self):
+            size = len(payload)
+            header = self.headers.get('Range') or ''
+            if not header.startswith('bytes='):
+                return 0, size - 1, False
+            first, _, last = header[len('bytes='):].split(',')[0].partition('-')
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            return start, end, True
+
+        def _headers(self, start, end, partial):
+            self.send_response(206 if partial else 200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            if partial:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._headers(*self._range())
+
+        def do_GET(self):
+            start, end, partial = self._range()
+            self._headers(start, end, partial)
+            sent = 0
+            throttled_at = None  # 用完免限速額度的時間
+            pos = start
+            try:
+                while pos <= end:
+                    block = payload[pos:min(pos + 65536, end + 1)]
+                    self.wfile.write(block)
+                    pos += len(block)
+                    sent += len(block)
+                    if sent > burst_bytes:
+                        # 超過免限速額度：依限速補足應花的時間
+                        if throttled_at is None:
+                            throttled_at = time.monotonic()
+                        due = throttled_at + (sent - burst_bytes) / rate_bytes
+                        delay = due - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
+
+
+def benchmark(size_mb=40, rate_kb=1024, burst_mb=10, chunk_mb=None):
+    """以本地限速伺服器比較單一連線與分段下載（http_chunk_size）的吞吐量"""
+    import tempfile
+    from http.server import ThreadingHTTPServer
+
+    size = int(size_mb * 1024 * 1024)
+    chunk_size = int(chunk_mb * 1024 * 1024) if chunk_mb else int(HTTP_CHUNK_SIZE_BY_EXTRACTOR.get('default', 0) or 0)
+    payload = os.urandom(size)
+    handler = _throttling_handler(payload, int(rate_kb * 1024), int(burst_mb * 1024 * 1024))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='throttle-server', daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/benchmark.mp4'
+
+    results = {}
+    try:
+        for mode, chunk in (('single_connection', 0), ('chunked', chunk_size)):
+            with tempfile.TemporaryDirectory() as tmp:
+                ydl_opts = {
+                    'quiet': True,
+                    'no_warnings': True,
+                    'noprogress': True,
+                    'outtmpl': os.path.join(tmp, '%(id)s.%(ext)s'),
+                }
+                if chunk:
+                    ydl_opts['http_chunk_size'] = chunk
+                started = time.perf_counter()
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    ydl.process_ie_result({
+                        'id': 'benchmark',
+                        'title': 'benchmark',
+                        'url': url,
+                        'ext': 'mp4',
+                        'extractor': 'benchmark',
+                        'extractor_key': 'Benchmark',
+                        'webpage_url': url,
+                    }, download=True)
+                elapsed = time.perf_counter() - started
+                downloaded = os.path.getsize(os.path.join(tmp, 'benchmark.mp4'))
+            results[mode] = {
+                'http_chunk_size': chunk,
+                'bytes': downloaded,
+                'seconds': round(elapsed, 2),
+                'throughput_mb_s': round(downloaded / 1048576 / elapsed, 2) if elapsed > 0 else 0.0,
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+    single = results['single_connection']['seconds']
+    chunked = results['chunked']['seconds']
+    results['speedup'] = round(single / chunked, 2) if chunked > 0 else 0.0
+    results['server'] = {'size_mb': size_mb, 'rate_kb': rate_kb, 'burst_mb': burst_mb}
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='分段下載：本地限速伺服器上的單一連線 vs http_chunk_size 吞吐量基準測試')
+    parser.add_argument('--benchmark', action='store_true', required=True, help='執行基準測試')
+    parser.add_argument('--size-mb', type=float, default=40, help='測試檔案大小（MB，預設 40）')
+    parser.add_argument('--rate-kb', type=float, default=1024, help='每條連線超過免限速額度後的速度上限（KB/s，預設 1024）')
+    parser.add_argument('--burst-mb', type=float, default=10, help='每條連線的免限速額度（MB，預設 10）')
+    parser.add_argument('--chunk-mb', type=float, default=0, help='分段大小（MB，預設 HTTP_CHUNK_SIZE_BY_EXTRACTOR 的 default）')
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.size_mb, args.rate_kb, args.burst_mb, args.chunk_mb or None), ensure_ascii=False, indent=2))
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+背景工作執行器模組
+
+以少數具名、有上限的執行器取代各處臨時開的 daemon 執行緒：
+  - extraction：yt-dlp 資訊解析與其他網路查詢
+  - file_io：下載受理（設定讀取、檔案檢查）、刪檔等檔案操作
+  - ui_effects：開啟資料夾、更新 yt-dlp 等使用者觸發的副作用
+  - download：舊版 Downloader.start_download 的單次下載（排程器有自己的工作執行緒）
+每個執行器有固定的工作執行緒數與佇列上限（滿了即拒絕，不阻塞呼叫端），
+提供佇列深度、等待/執行時間等統計、依群組取消，以及關閉視窗時的有序停止。
+工作執行緒為 daemon，關閉時不會因為執行中的長時間工作卡住行程結束。
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import api_console, LogLevel
+from scripts.config.constants import EXECUTOR_LIMITS
+
+_TIMING_WINDOW = 1000  # 計算百分位數時保留的最近樣本數
+
+
+class ExecutorBusy(RuntimeError):
+    """執行器佇列已滿（或已關閉），工作未被接受"""
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return round(values[k], 1)
+
+
+class _WorkItem:
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'group', 'queued_at')
+
+    def __init__(self, future, fn, args, kwargs, group):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.group = group
+        self.queued_at = time.monotonic()
+
+
+class ManagedExecutor:
+    """具名、有上限的執行器（介面與 concurrent.futures 的 submit/Future 相同）"""
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(1, int(max_queue))
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+        self._active = 0
+        self._shutdown = False
+        self._groups = {}  # group -> set(Future)
+        self._wait_ms = deque(maxlen=_TIMING_WINDOW)
+        self._run_ms = deque(maxlen=_TIMING_WINDOW)
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'rejected': 0}
+
+    def submit(self, fn, *args, group=None, **kwargs):
+        """排入工作並回傳 Future；佇列已滿或已關閉時拋出 ExecutorBusy"""
+        future = Future()
+        item = _WorkItem(future, fn, args, kwargs, group)
+        with self._lock:
+            if self._shutdown:
+                self._counts['rejected'] += 1
+                raise ExecutorBusy(f"執行器 {self.name} 已關閉")
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._counts['rejected'] += 1
+                raise ExecutorBusy(f"執行器 {self.name} 佇列已滿（{self.max_queue}）")
+            self._counts['submitted'] += 1
+            if group is not None:
+                self._groups.setdefault(group, set()).add(future)
+                future.add_done_callback(lambda f, g=group: self._forget(g, f))
+            # 排隊中的工作多於閒置的 worker 即補執行緒（連續提交時閒置 worker 可能還沒取走前一個工作）
+            if self._queue.qsize() > self._idle and len(self._threads) < self.max_workers:
+                t = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"{self.name}-{len(self._threads) + 1}",
+                    daemon=True,
+                )
+                self._threads.append(t)
+                t.start()
+        return future
+
+    def _forget(self, group, future):
+        with self._lock:
+            futures = self._groups.get(group)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._groups[group]
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            item = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if item is None:
+                return
+            if not item.future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._counts['cancelled'] += 1
+                continue
+            started = time.monotonic()
+            with self._lock:
+                self._active += 1
+                self._wait_ms.append((started - item.queued_at) * 1000.0)
+            try:
+                result = item.fn(*item.args, **item.kwargs)
+            except BaseException as e:
+                item.future.set_exception(e)
+                outcome = 'failed'
+                api_console(f"[{self.name}] 背景工作失敗: {e}", level=LogLevel.WARNING)
+            else:
+                item.future.set_result(result)
+                outcome = 'completed'
+            finally:
+                item = None
+            with self._lock:
+                self._active -= 1
+                self._counts[outcome] += 1
+                self._run_ms.append((time.monotonic() - started) * 1000.0)
+
+    def cancel_group(self, group):
+        """取消群組中尚未開始的工作，回傳取消數量（執行中的工作不受影響）"""
+        with self._lock:
+            futures = list(self._groups.get(group, ()))
+        return sum(1 for f in futures if f.cancel())
+
+    def shutdown(self, timeout=0.0):
+        """停止接受新工作、取消佇列中的工作；timeout 秒內等待執行中的工作結束"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        cancelled = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item.future.cancel():
+                cancelled += 1
+        with self._lock:
+            self._counts['cancelled'] += cancelled
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + max(0.0, timeout)
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            wait_ms = list(self._wait_ms)
+            run_ms = list(self._run_ms)
+            return {
+                'workers': len(self._threads),
+                'max_workers': self.max_workers,
+                'active': self._active,
+                'queued': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                **self._counts,
+                'wait_p50_ms': _percentile(wait_ms, 50),
+                'wait_p99_ms': _percentile(wait_ms, 99),
+                'run_p50_ms': _percentile(run_ms, 50),
+                'run_p99_ms': _percentile(run_ms, 99),
+            }
+
+
+_registry_lock = threading.Lock()
+_executors = {}
+
+
+def get_executor(name):
+    """取得具名執行器（第一次使用時依 EXECUTOR_LIMITS 建立）"""
+    with _registry_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            if name not in EXECUTOR_LIMITS:
+                raise KeyError(f"未定義的執行器: {name}")
+            max_workers, max_queue = EXECUTOR_LIMITS[name]
+            executor = ManagedExecutor(name, max_workers, max_queue)
+            _executors[name] = executor
+        return executor
+
+
+def submit(name, fn, *args, **kwargs):
+    """get_executor(name).submit(...) 的簡寫"""
+    return get_executor(name).submit(fn, *args, **kwargs)
+
+
+def executor_stats():
+    """所有已建立執行器的統計（name -> stats）"""
+    with _registry_lock:
+        executors = dict(_executors)
+    return {name: executor.stats() for name, executor in executors.items()}
+
+
+def shutdown_executors(timeout=1.0):
+    """關閉所有執行器（共用 timeout 秒等待執行中的工作）"""
+    with _registry_lock:
+        executors = list(_executors.values())
+    deadline = time.monotonic() + max(0.0, timeout)
+    for executor in executors:
+        try:
+            executor.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            api_console(f"關閉執行器 {executor.name} 失敗: {e}", level=LogLevel.WARNING)
+    api_console("背景執行器已關閉", level=LogLevel.INFO)
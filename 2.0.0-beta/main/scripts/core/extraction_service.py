@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+影片資訊解析服務模組
+
+以行程池執行 yt-dlp 的 extract_info：輸入 (url, ydl 選項)，回傳精簡後的 info
+（頂層純量欄位、formats 與 thumbnails 的必要欄位），可跨行程傳送。
+yt-dlp 的解析與 extractor 邏輯有相當比例是 CPU 工作，執行緒受限於 GIL，
+行程池則可依 CPU 核心數擴展。由設定 useProcessExtraction 啟用後，
+video_info 的 extract_video_info / get_video_qualities_and_formats 會透過
+_extract_info 改走此服務，函式簽名與回傳內容不變。
+
+基準測試（執行緒 vs 行程吞吐量）：
+    python scripts/core/extraction_service.py --benchmark corpus.txt [--workers N]
+corpus.txt 每行一筆：影片網址，或 yt-dlp 的 .info.json 檔案路徑（離線重播
+process_ie_result，只量測 CPU 部分）；空行與 # 開頭的行會略過。
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import video_info_console, LogLevel
+from scripts.config.constants import EXTRACTION_PROCESS_WORKERS
+
+# 跨行程回傳時保留的 format / thumbnail 欄位
+_FORMAT_FIELDS = (
+    'format_id', 'format_note', 'ext', 'height', 'width', 'fps', 'vcodec', 'acodec',
+    'abr', 'vbr', 'tbr', 'asr', 'filesize', 'filesize_approx', 'protocol', 'dynamic_range',
+)
+_THUMBNAIL_FIELDS = ('url', 'width', 'height', 'id', 'preference')
+
+
+def trim_info(info_dict):
+    """精簡 info：頂層純量欄位，加上 formats / thumbnails 的必要欄位"""
+    if not isinstance(info_dict, dict):
+        return info_dict
+    trimmed = {k: v for k, v in info_dict.items() if isinstance(v, (str, int, float, bool)) or v is None}
+    trimmed['formats'] = [
+        {k: f.get(k) for k in _FORMAT_FIELDS if k in f}
+        for f in (info_dict.get('formats') or []) if isinstance(f, dict)
+    ]
+    trimmed['thumbnails'] = [
+        {k: t.get(k) for k in _THUMBNAIL_FIELDS if k in t}
+        for t in (info_dict.get('thumbnails') or []) if isinstance(t, dict)
+    ]
+    return trimmed
+
+
+# ---- 子行程 ----
+
+def _init_worker():
+    """子行程初始化：降低優先權並預先載入 yt_dlp"""
+    try:
+        if sys.platform.startswith('win'):
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00004000)  # BELOW_NORMAL_PRIORITY_CLASS
+        else:
+            os.nice(5)
+    except Exception:
+        pass
+    import yt_dlp  # noqa: F401
+
+
+def _extract_in_worker(url, ydl_opts):
+    import yt_dlp
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if url.lower().endswith('.info.json') and os.path.isfile(url):
+            # 基準測試：離線重播已存的 info（不經網路，只有格式排序/選擇等 CPU 工作）
+            with open(url, 'r', encoding='utf-8') as f:
+                info_dict = ydl.sanitize_info(ydl.process_ie_result(json.load(f), download=False))
+        else:
+            info_dict = ydl.extract_info(url, download=False)
+    return trim_info(info_dict)
+
+
+# ---- 主行程 ----
+
+class ExtractionService:
+    """行程池解析服務；extract() 為同步呼叫（供執行緒中的既有流程使用），submit() 回傳 Future"""
+
+    def __init__(self, max_workers=EXTRACTION_PROCESS_WORKERS):
+        self.max_workers = int(max_workers or 0) or (os.cpu_count() or 2)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._closed = False
+
+    def _get_pool(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("解析服務已關閉")
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+                video_info_console(f"已啟動影片資訊解析行程池（{self.max_workers} 個行程）", level=LogLevel.INFO)
+            return self._pool
+
+    def start(self):
+        """預先建立行程池（子行程在第一個工作送出時啟動）"""
+        self._get_pool()
+
+    def submit(self, url, ydl_opts):
+        return self._get_pool().submit(_extract_in_worker, url, dict(ydl_opts or {}))
+
+    def extract(self, url, ydl_opts):
+        """在子行程中解析並回傳精簡後的 info；子行程異常結束時重建行程池並重試一次"""
+        try:
+            return self.submit(url, ydl_opts).result()
+        except BrokenProcessPool:
+            video_info_console("解析行程池異常結束，重新建立", level=LogLevel.WARNING)
+            self._reset_pool()
+            return self.submit(url, ydl_opts).result()
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---- 基準測試 ----
+
+def _load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def _run_batch(items, worker, max_workers):
+    started = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for future in [pool.submit(worker, item) for item in items]:
+            try:
+                future.result()
+            except Exception:
+                failures += 1
+    return time.perf_counter() - started, failures
+
+
+def benchmark(corpus, workers=None, app_root_dir=root_dir):
+    """以相同的語料分別用執行緒與行程池解析，回傳兩者的耗時與吞吐量"""
+    from scripts.core import video_info
+
+    workers = int(workers or 0) or (os.cpu_count() or 2)
+    ydl_opts = video_info._base_ydl_opts(app_root_dir, quiet=True)
+
+    def thread_worker(url):
+        # 與子行程執行相同的工作，只差在執行緒/行程
+        return _extract_in_worker(url, ydl_opts)
+
+    service = ExtractionService(max_workers=workers)
+    try:
+        # 先暖機：子行程啟動與 import 不列入量測
+        pool = service._get_pool()
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        results = {}
+        for name, worker in (
+            ('thread', thread_worker),
+            ('process', lambda url: service.extract(url, ydl_opts)),
+        ):
+            elapsed, failures = _run_batch(corpus, worker, workers)
+            results[name] = {
+                'items': len(corpus),
+                'failures': failures,
+                'seconds': round(elapsed, 3),
+                'items_per_second': round(len(corpus) / elapsed, 2) if elapsed > 0 else 0.0,
+            }
+    finally:
+        service.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='影片資訊解析：執行緒 vs 行程池吞吐量基準測試')
+    parser.add_argument('--benchmark', metavar='CORPUS', required=True, help='語料檔（每行一個網址或 .info.json 路徑）')
+    parser.add_argument('--workers', type=int, default=0, help='併發數（預設為 CPU 核心數）')
+    args = parser.parse_args()
+
+    corpus = _load_corpus(args.benchmark)
+    report = benchmark(corpus, workers=args.workers)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report['thread']['seconds'] > 0 and report['process']['seconds'] > 0:
+        print(f"行程池 / 執行緒 吞吐量比: {report['thread']['seconds'] / report['process']['seconds']:.2f}x")
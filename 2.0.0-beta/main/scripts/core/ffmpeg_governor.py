@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ffmpeg 後處理資源控管模組
+
+多個 FFmpegExtractAudio / FFmpegVideoConvertor 同時結束下載時，每個 ffmpeg 預設都會
+依核心數開執行緒，整台機器被塞滿、UI 跟著卡頓。本模組在 yt-dlp 的 ffmpeg 後處理上：
+  - 限制同時執行的 ffmpeg 數（FFMPEG_MAX_JOBS）
+  - 依全域核心預算分配每個 ffmpeg 的 -threads（預算 // 同時數）
+  - ffmpeg/ffprobe 子行程以較低的作業系統優先權執行，並累計其 CPU 時間（child_cpu_seconds）
+install() 包裝 FFmpegPostProcessor.real_run_ffmpeg（所有 ffmpeg 後處理的共同入口），
+由 Downloader 建立時呼叫；使用者自訂的 postprocessor_args 仍排在 -threads 之後，可覆寫。
+
+基準測試（播放清單轉 mp3：全部同時轉檔 vs 經過控管）：
+    python scripts/core/ffmpeg_governor.py --benchmark <媒體檔目錄> [--codec mp3] [--quality 192]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+from scripts.utils.file_utils import safe_path_join
+from scripts.config.constants import FFMPEG_MAX_JOBS, FFMPEG_CORE_BUDGET, FFMPEG_RESERVED_CORES, FFMPEG_NICE
+
+_BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+_TIMING_WINDOW = 500
+
+
+def default_core_budget():
+    """預設核心預算：全部核心扣除保留給 UI 的核心數"""
+    return max(1, (os.cpu_count() or 2) - FFMPEG_RESERVED_CORES)
+
+
+def _process_cpu_seconds(handle):
+    """Windows：以 GetProcessTimes 取得子行程的 CPU 時間（核心 + 使用者，秒）；失敗回傳 None"""
+    import ctypes
+    from ctypes import wintypes
+    creation, exited, kernel, user = (wintypes.FILETIME() for _ in range(4))
+    ok = ctypes.windll.kernel32.GetProcessTimes(
+        wintypes.HANDLE(int(handle)),
+        ctypes.byref(creation), ctypes.byref(exited), ctypes.byref(kernel), ctypes.byref(user),
+    )
+    if not ok:
+        return None
+    # FILETIME 以 100 奈秒為單位
+    return sum(((ft.dwHighDateTime << 32) | ft.dwLowDateTime) / 1e7 for ft in (kernel, user))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return round(values[k], 1)
+
+
+class FfmpegGovernor:
+    """ffmpeg 同時數與執行緒預算控管"""
+
+    def __init__(self, max_jobs=FFMPEG_MAX_JOBS, core_budget=FFMPEG_CORE_BUDGET):
+        self.enabled = True
+        self.max_jobs = 1
+        self.core_budget = 1
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._completed = 0
+        self.cpu_seconds = 0.0  # 已結束的 ffmpeg/ffprobe 子行程累計 CPU 時間（Windows）
+        self._wait_ms = deque(maxlen=_TIMING_WINDOW)
+        self._run_ms = deque(maxlen=_TIMING_WINDOW)
+        self.configure(max_jobs=max_jobs, core_budget=core_budget)
+
+    def configure(self, max_jobs=None, core_budget=None):
+        """調整同時數與核心預算（core_budget 為 0 代表依核心數）"""
+        with self._cond:
+            if max_jobs is not None:
+                self.max_jobs = max(1, int(max_jobs or 1))
+            if core_budget is not None:
+                self.core_budget = int(core_budget or 0) or default_core_budget()
+            self._cond.notify_all()
+
+    @property
+    def threads_per_job(self):
+        return max(1, self.core_budget // self.max_jobs)
+
+    @contextmanager
+    def job(self):
+        """取得一個 ffmpeg 名額（必要時等待），產出該工作可用的執行緒數"""
+        started = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._active >= self.max_jobs:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            threads = self.threads_per_job
+            self._wait_ms.append((time.monotonic() - started) * 1000.0)
+        entered = time.monotonic()
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._completed += 1
+                self._run_ms.append((time.monotonic() - entered) * 1000.0)
+                self._cond.notify()
+
+    def record_cpu(self, seconds):
+        with self._cond:
+            self.cpu_seconds += seconds
+
+    def stats(self):
+        with self._cond:
+            wait_ms = list(self._wait_ms)
+            run_ms = list(self._run_ms)
+            return {
+                'enabled': self.enabled,
+                'max_jobs': self.max_jobs,
+                'core_budget': self.core_budget,
+                'threads_per_job': self.threads_per_job,
+                'active': self._active,
+                'waiting': self._waiting,
+                'completed': self._completed,
+                'cpu_seconds': round(self.cpu_seconds, 2),
+                'wait_p50_ms': _percentile(wait_ms, 50),
+                'wait_p99_ms': _percentile(wait_ms, 99),
+                'run_p50_ms': _percentile(run_ms, 50),
+                'run_p99_ms': _percentile(run_ms, 99),
+            }
+
+
+governor = FfmpegGovernor()
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """把控管套用到 yt-dlp 的 ffmpeg 後處理（可重複呼叫）；回傳是否已套用"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return True
+        try:
+            from yt_dlp.postprocessor import ffmpeg as ffmpeg_pp
+            base_popen = ffmpeg_pp.Popen
+            original_run = ffmpeg_pp.FFmpegPostProcessor.real_run_ffmpeg
+        except Exception as e:
+            download_console(f"無法套用 ffmpeg 資源控管: {e}", level=LogLevel.WARNING)
+            return False
+
+        class _LowPriorityPopen(base_popen):
+            """後處理的 ffmpeg/ffprobe 子行程以較低優先權執行；結束時累計 CPU 時間"""
+
+            def __init__(self, *args, **kwargs):
+                self._cpu_recorded = False
+                lower = governor.enabled
+                if lower and sys.platform.startswith('win'):
+                    kwargs['creationflags'] = kwargs.get('creationflags', 0) | _BELOW_NORMAL_PRIORITY_CLASS
+                super().__init__(*args, **kwargs)
+                if lower and not sys.platform.startswith('win'):
+                    try:
+                        os.setpriority(os.PRIO_PROCESS, self.pid, FFMPEG_NICE)
+                    except (OSError, AttributeError):
+                        pass
+
+            def wait(self, *args, **kwargs):
+                returncode = super().wait(*args, **kwargs)
+                # communicate() 最後也會呼叫 wait；行程控制代碼在 Popen 關閉前仍可查詢
+                if sys.platform.startswith('win') and not self._cpu_recorded:
+                    self._cpu_recorded = True
+                    try:
+                        seconds = _process_cpu_seconds(self._handle)
+                    except Exception:
+                        seconds = None
+                    if seconds is not None:
+                        governor.record_cpu(seconds)
+                return returncode
+
+        @functools.wraps(original_run)
+        def governed_run_ffmpeg(pp, input_path_opts, output_path_opts, *args, **kwargs):
+            if not governor.enabled:
+                return original_run(pp, input_path_opts, output_path_opts, *args, **kwargs)
+            with governor.job() as threads:
+                output_path_opts = [
+                    (path, ['-threads', str(threads)] + list(opts))
+                    for path, opts in output_path_opts
+                ]
+                return original_run(pp, input_path_opts, output_path_opts, *args, **kwargs)
+
+        ffmpeg_pp.Popen = _LowPriorityPopen
+        ffmpeg_pp.FFmpegPostProcessor.real_run_ffmpeg = governed_run_ffmpeg
+        _installed = True
+        download_console(
+            f"ffmpeg 資源控管: 同時 {governor.max_jobs} 個，每個 {governor.threads_per_job} 執行緒（核心預算 {governor.core_budget}）",
+            level=LogLevel.INFO,
+        )
+        return True
+
+
+def child_cpu_seconds():
+    """ffmpeg/ffprobe 子行程累計的 CPU 時間（秒）：Windows 為各子行程 GetProcessTimes 的合計，
+    其他平台為 RUSAGE_CHILDREN；無法取得時回傳 None"""
+    if sys.platform.startswith('win'):
+        return governor.cpu_seconds if install() else None
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+    except Exception:
+        return None
+
+
+# ---- 基準測試 ----
+
+_MEDIA_EXTS = ('.mp4', '.webm', '.mkv', '.m4a', '.opus', '.mp3', '.flac', '.wav', '.ogg', '.aac', '.mov')
+
+
+def _measure_lag(stop, samples, interval=0.01):
+    """模擬 UI 事件迴圈：每 interval 秒醒來一次，記錄實際延遲（毫秒）"""
+    while not stop.is_set():
+        started = time.monotonic()
+        time.sleep(interval)
+        samples.append(max(0.0, (time.monotonic() - started - interval) * 1000.0))
+
+
+def benchmark(media_dir, codec='mp3', quality='192', app_root_dir=root_dir):
+    """把目錄中的媒體檔同時轉成音訊（模擬播放清單下載同時結束），比較未控管與控管後的耗時與延遲"""
+    import yt_dlp
+    from concurrent.futures import ThreadPoolExecutor
+    from yt_dlp.postprocessor import FFmpegExtractAudioPP
+
+    install()
+    files = sorted(
+        os.path.join(media_dir, name) for name in os.listdir(media_dir)
+        if name.lower().endswith(_MEDIA_EXTS)
+    )
+    if not files:
+        raise ValueError(f"目錄中沒有媒體檔: {media_dir}")
+    ydl_opts = {'quiet': True}
+    ffmpeg_path = safe_path_join(app_root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
+    if os.path.exists(ffmpeg_path):
+        ydl_opts['ffmpeg_location'] = ffmpeg_path
+
+    results = {}
+    for mode in ('ungoverned', 'governed'):
+        governor.enabled = mode == 'governed'
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs = []
+            for path in files:
+                target = os.path.join(tmp, os.path.basename(path))
+                shutil.copyfile(path, target)
+                inputs.append(target)
+            lag = []
+            stop = threading.Event()
+            probe = threading.Thread(target=_measure_lag, args=(stop, lag), daemon=True)
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                def convert(path):
+                    pp = FFmpegExtractAudioPP(ydl, preferredcodec=codec, preferredquality=quality)
+                    pp.run({'filepath': path, 'ext': os.path.splitext(path)[1].lstrip('.')})
+
+                probe.start()
+                started = time.perf_counter()
+                failures = 0
+                with ThreadPoolExecutor(max_workers=len(inputs)) as pool:
+                    for future in [pool.submit(convert, path) for path in inputs]:
+                        try:
+                            future.result()
+                        except Exception as e:
+                            failures += 1
+                            download_console(f"轉檔失敗: {e}", level=LogLevel.WARNING)
+                elapsed = time.perf_counter() - started
+                stop.set()
+                probe.join()
+        results[mode] = {
+            'files': len(inputs),
+            'failures': failures,
+            'seconds': round(elapsed, 2),
+            'files_per_second': round(len(inputs) / elapsed, 2) if elapsed > 0 else 0.0,
+            'lag_p50_ms': _percentile(lag, 50),
+            'lag_p99_ms': _percentile(lag, 99),
+            'lag_max_ms': round(max(lag), 1) if lag else 0.0,
+        }
+    governor.enabled = True
+    results['governor'] = governor.stats()
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ffmpeg 後處理控管：播放清單轉音訊吞吐量基準測試')
+    parser.add_argument('--benchmark', metavar='DIR', required=True, help='媒體檔目錄（下載後、轉檔前的檔案）')
+    parser.add_argument('--codec', default='mp3', help='目標音訊格式（預設 mp3）')
+    parser.add_argument('--quality', default='192', help='目標位元率（預設 192）')
+    parser.add_argument('--jobs', type=int, default=0, help='同時 ffmpeg 數（預設 FFMPEG_MAX_JOBS）')
+    args = parser.parse_args()
+
+    if args.jobs:
+        governor.configure(max_jobs=args.jobs)
+    print(json.dumps(benchmark(args.benchmark, codec=args.codec, quality=args.quality), ensure_ascii=False, indent=2))
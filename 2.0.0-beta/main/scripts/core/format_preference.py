@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+格式偏好模組
+
+依目標容器排定串流組合的優先順序（每個畫質範圍內）：
+  1. native：容器原生的編碼組合（mp4：avc1/hevc + mp4a；webm：vp9/av1 + opus），不需任何後處理
+  2. 副檔名符合目標容器的串流（原有的選擇方式）
+  3. remux：編碼可直接放入目標容器（合併/重新封裝即可，不重新編碼）
+  4. 其他組合：下載後需要重新編碼
+下載的格式選擇器（Downloader._get_format_selector）與畫質清單上的成本提示
+（「將重新編碼」）共用這裡的排序與判斷。
+
+音訊則選擇「不低於要求位元率的最小串流」，並優先選擇與目標格式相同的編碼（可直接複製串流）。
+"""
+
+import os
+import re
+import sys
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.core.postprocess_planner import CONTAINER_CODECS, AUDIO_NATIVE_CODECS, LOSSLESS_AUDIO, codec_family
+
+# 容器 -> (原生影像編碼, 原生音訊編碼)；未列出的容器沒有編碼偏好
+NATIVE_CODECS = {
+    'mp4': ({'h264', 'h265'}, {'aac'}),
+    'webm': ({'vp9', 'av1'}, {'opus'}),
+}
+
+# 編碼族 -> yt-dlp vcodec/acodec 字串的前綴（供格式選擇器的 ~= 篩選使用）
+_FAMILY_PATTERNS = {
+    'h264': ('avc1', 'avc3', 'h264'),
+    'h265': ('hvc1', 'hev1', 'h265', 'hevc'),
+    'av1': ('av01', 'av1'),
+    'vp9': ('vp09', 'vp9'),
+    'vp8': ('vp08', 'vp8'),
+    'mpeg4': ('mp4v', 'mpeg4'),
+    'aac': ('mp4a', 'aac'),
+    'mp3': ('mp3',),
+    'opus': ('opus',),
+    'vorbis': ('vorbis',),
+    'flac': ('flac',),
+    'alac': ('alac',),
+    'ac3': ('ac-3', 'ac3'),
+    'eac3': ('ec-3', 'eac3'),
+}
+
+# 畫質提示：成本 -> 顯示文字（不需重新編碼的組合不另外標示）
+COST_NOTES = {'native': '', 'remux': '', 'reencode': '將重新編碼'}
+
+# 常見畫質的允許範圍（下限, 上限）
+_QUALITY_RANGES = {
+    360: (360, 480),
+    480: (480, 720),
+    720: (720, 1080),
+    1080: (1080, 1440),
+    1440: (1440, 2160),
+    2160: (2160, 4320),
+    4320: (4320, 9999),
+}
+
+
+def height_range(qnum):
+    """目標畫質的允許高度範圍 (min_height, max_height)：優先不超過目標，必要時略高"""
+    for base_quality, (min_q, max_q) in sorted(_QUALITY_RANGES.items()):
+        if qnum <= base_quality:
+            # 使用該級別的下限作為最小高度；最大高度不超過該級別的上限，且不超過目標+50p
+            return min_q, min(max_q, qnum + 50)
+    # 目標畫質超過 4320p，使用更寬鬆的範圍
+    return max(360, qnum - 50), qnum + 100
+
+
+def codec_filter(kind, families):
+    """產生 yt-dlp 格式篩選字串，例如 [vcodec~='^(avc1|avc3|h264)']；families 為 None 時不篩選"""
+    if not families:
+        return ''
+    prefixes = sorted({p for family in families for p in _FAMILY_PATTERNS.get(family, (family,))})
+    return f"[{kind}~='^({'|'.join(prefixes)})']"
+
+
+def ranked_tiers(target_ext, band):
+    """某個畫質範圍（band 為高度篩選字串）內，依成本排序的格式選擇器片段"""
+    tiers = []
+    native_v, native_a = NATIVE_CODECS.get(target_ext, (None, None))
+    if native_v:
+        tiers.append(f"bestvideo{band}{codec_filter('vcodec', native_v)}+bestaudio{codec_filter('acodec', native_a)}")
+    tiers += [
+        f"bestvideo[ext={target_ext}]{band}+bestaudio[ext=m4a]",
+        f"bestvideo[ext={target_ext}]{band}+bestaudio",
+        f"best[ext={target_ext}]{band}",
+    ]
+    return tiers
+
+
+def remux_tier(target_ext, band):
+    """某個畫質範圍內，編碼可直接放入目標容器的組合（無可篩選的限制時回傳空字串）"""
+    allowed_v, allowed_a = CONTAINER_CODECS.get(target_ext, (None, None))
+    if not allowed_v:
+        return ''
+    return f"bestvideo{band}{codec_filter('vcodec', allowed_v)}+bestaudio{codec_filter('acodec', allowed_a)}"
+
+
+def estimate_cost(formats, qnum, target_ext):
+    """估計以 target_ext 下載 qnum 畫質的後處理成本：'native' / 'remux' / 'reencode'"""
+    target_ext = (target_ext or '').strip().lower()
+    allowed_v, allowed_a = CONTAINER_CODECS.get(target_ext, (None, None))
+    if allowed_v is None and allowed_a is None:
+        return 'remux'
+    min_height, max_height = height_range(qnum)
+    video_families = set()
+    audio_families = set()
+    for f in formats or []:
+        if not isinstance(f, dict) or (f.get('ext') or '').lower() == 'mhtml':
+            continue
+        vfam = codec_family(f.get('vcodec'))
+        afam = codec_family(f.get('acodec'))
+        height = f.get('height')
+        if vfam and height and min_height <= height <= max_height:
+            video_families.add(vfam)
+        if afam and vfam == '':
+            audio_families.add(afam)
+    if not video_families:
+        return 'remux'  # 無法判斷（例如格式清單不完整），不標示
+    native_v, native_a = NATIVE_CODECS.get(target_ext, (set(), set()))
+    has_audio = bool(audio_families)
+    if video_families & native_v and (not has_audio or audio_families & native_a):
+        return 'native'
+    if video_families & allowed_v and (not has_audio or allowed_a is None or audio_families & allowed_a):
+        return 'remux'
+    return 'reencode'
+
+
+def annotate_quality_costs(qualities, formats, target_ext='mp4'):
+    """為畫質清單（{'label', 'ratio'}）加上 cost 與 note（例如「將重新編碼」）"""
+    for q in qualities or []:
+        match = re.search(r'(\d+)', str(q.get('label') or ''))
+        if not match:
+            continue
+        cost = estimate_cost(formats, int(match.group(1)), target_ext)
+        q['cost'] = cost
+        q['note'] = COST_NOTES.get(cost, '')
+    return qualities
+
+
+def audio_format_selector(target_codec, kbps):
+    """音訊格式選擇器：不低於 kbps 的最小串流（同編碼優先，可直接複製），都沒有時退回最佳音訊"""
+    target = (target_codec or 'mp3').strip().lower()
+    try:
+        kbps = int(kbps)
+    except (TypeError, ValueError):
+        kbps = 0
+    if target in LOSSLESS_AUDIO or kbps <= 0:
+        return 'bestaudio/best'
+    tiers = []
+    native = AUDIO_NATIVE_CODECS.get(target)
+    if native:
+        tiers.append(f"worstaudio[abr>={kbps}]{codec_filter('acodec', native)}")
+    tiers += [f"worstaudio[abr>={kbps}]", "bestaudio", "best"]
+    return "/".join(tiers)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合併格式串流平行下載模組
+
+yt-dlp 對 bestvideo+bestaudio 這類合併格式是依序下載各串流（process_info 逐一呼叫 dl），
+在限速的主機上音訊串流整段排在影像之後，成為整個任務的關鍵路徑。
+ParallelStreamsYoutubeDL 讓同一任務的各串流同時下載：
+  - process_info 逐一呼叫 dl 時，前面的串流改在輔助執行緒下載並立即返回
+  - 最後一個串流在原執行緒下載，完成後等待其他串流，回傳彙總的結果
+之後 yt-dlp 照常合併（合併在所有串流完成後立即開始）。任一串流失敗或被中止時，
+其他串流會在下一次進度回調時中止，錯誤由原執行緒拋出，與依序下載時相同。
+由 ffmpeg 一次下載多個串流、或只有單一串流時不受影響。
+
+StreamProgress 把各串流的進度依位元組加總為單一進度，供 _download_progress_hook 顯示一個百分比。
+"""
+
+import os
+import sys
+import threading
+
+import yt_dlp
+from yt_dlp.utils import DownloadCancelled
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+
+
+def _expected_size(fmt):
+    return fmt.get('filesize') or fmt.get('filesize_approx') or 0
+
+
+class _StreamBatch:
+    """一次合併下載中的各串流：輔助執行緒、結果與錯誤"""
+
+    def __init__(self, format_ids):
+        self.owner = threading.current_thread()
+        self.pending = set(format_ids)
+        self.size = len(self.pending)
+        self.abort = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._results = []
+        self.error = None
+
+    def start(self, dl, name, info):
+        """在輔助執行緒下載一個串流（屬於同一任務的網路名額，不經共用執行器排隊）"""
+        def run():
+            try:
+                result = dl(name, info)
+            except BaseException as e:
+                with self._lock:
+                    if self.error is None:
+                        self.error = e
+                self.abort.set()
+                return
+            with self._lock:
+                self._results.append(result)
+
+        t = threading.Thread(target=run, name=f"stream-{info.get('format_id')}", daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def combine(self, result):
+        """與原執行緒的結果合併為 (success, real_download)"""
+        with self._lock:
+            results = list(self._results)
+        success, real_download = result
+        return (
+            success and all(r[0] for r in results),
+            real_download or any(r[1] for r in results),
+        )
+
+
+class ParallelStreamsYoutubeDL(yt_dlp.YoutubeDL):
+    """合併格式的各串流同時下載的 YoutubeDL"""
+
+    def __init__(self, params=None, auto_init=True, parallel=True, stream_callback=None):
+        super().__init__(params, auto_init)
+        self.parallel_streams = parallel
+        # 合併下載開始時呼叫 fn([(format_id, 預估大小), ...])，供進度彙總預先得知各串流
+        self.stream_callback = stream_callback
+        self._stream_batch = None
+        self.add_progress_hook(self._check_stream_abort)
+
+    def _check_stream_abort(self, d):
+        batch = self._stream_batch
+        if batch is not None and batch.abort.is_set():
+            raise DownloadCancelled()
+
+    def process_info(self, info_dict):
+        formats = info_dict.get('requested_formats') or []
+        batch = None
+        if len(formats) > 1:
+            if callable(self.stream_callback):
+                try:
+                    self.stream_callback([(str(f.get('format_id')), _expected_size(f)) for f in formats])
+                except Exception:
+                    pass
+            if self.parallel_streams:
+                batch = _StreamBatch(str(f.get('format_id')) for f in formats)
+        self._stream_batch = batch
+        try:
+            return super().process_info(info_dict)
+        finally:
+            if batch is not None:
+                if batch.pending:
+                    # 最後一個串流沒有開始（例如建立目錄失敗）：中止已開始的串流
+                    batch.abort.set()
+                batch.join()
+            self._stream_batch = None
+
+    def dl(self, name, info, subtitle=False, test=False):
+        batch = self._stream_batch
+        format_id = str(info.get('format_id'))
+        if (batch is None or subtitle or test or name == '-'
+                or info.get('requested_formats')
+                or threading.current_thread() is not batch.owner
+                or format_id not in batch.pending):
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        batch.pending.discard(format_id)
+        if batch.pending:
+            # 還有其他串流：此串流改在輔助執行緒下載，讓 process_info 繼續處理下一個串流
+            batch.start(super().dl, name, info)
+            return True, False
+
+        # 最後一個串流：在原執行緒下載，完成後等待其他串流
+        try:
+            result = super().dl(name, info)
+        except BaseException:
+            batch.abort.set()
+            batch.join()
+            if batch.error is not None:
+                # 原執行緒是因其他串流失敗而中止：回報真正的錯誤
+                raise batch.error
+            raise
+        batch.join()
+        if batch.error is not None:
+            raise batch.error
+        combined = batch.combine(result)
+        download_console(f"合併格式的 {batch.size} 個串流已同時下載完成", level=LogLevel.DEBUG)
+        return combined
+
+
+class StreamProgress:
+    """把合併格式各串流的進度加總為單一進度（單一串流時原樣回傳）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def _stream(self, key, total=0):
+        return self._streams.setdefault(key, {'downloaded': 0, 'total': total, 'speed': None, 'done': False})
+
+    def expect(self, streams):
+        """預先登記各串流與預估大小（避免第二個串流開始時百分比倒退）"""
+        with self._lock:
+            for key, total in streams:
+                self._stream(key, total)
+
+    def update(self, d):
+        """更新一個串流的進度，回傳彙總後的進度 dict"""
+        status = d.get('status')
+        if status not in ('downloading', 'finished'):
+            return d
+        key = str((d.get('info_dict') or {}).get('format_id') or d.get('filename'))
+        with self._lock:
+            s = self._stream(key)
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                s['total'] = total
+            if d.get('downloaded_bytes') is not None:
+                s['downloaded'] = d['downloaded_bytes']
+            s['speed'] = d.get('speed') if status == 'downloading' else None
+            if status == 'finished':
+                s['done'] = True
+                s['total'] = s['downloaded'] = max(s['total'] or 0, s['downloaded'] or 0)
+            if len(self._streams) < 2:
+                return d
+            streams = list(self._streams.values())
+        downloaded = sum(x['downloaded'] or 0 for x in streams)
+        known = all(x['total'] for x in streams)
+        total = sum(x['total'] or 0 for x in streams) if known else None
+        speed = sum(x['speed'] for x in streams if x['speed']) or None
+        combined = dict(d)
+        combined['downloaded_bytes'] = downloaded
+        combined['total_bytes'] = total
+        combined['total_bytes_estimate'] = None
+        combined['speed'] = speed
+        combined['eta'] = (total - downloaded) / speed if speed and total and total > downloaded else None
+        if not all(x['done'] for x in streams):
+            # 單一串流完成但仍有其他串流下載中：對外仍是下載中
+            combined['status'] = 'downloading'
+        return combined
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+後處理計畫模組
+
+下載（含合併）完成後，依實際選到的串流編碼決定如何得到目標容器：
+  - none：已是目標格式，不處理
+  - remux：編碼可直接放入目標容器，以 stream copy 重新封裝（數秒）
+  - transcode：編碼不被目標容器支援，才以 FFmpegVideoConvertor 重新編碼（每支影片可能數分鐘）
+編碼未知時先嘗試 remux，失敗再轉檔。
+音訊（FFmpegExtractAudio）同樣依來源決定：編碼與目標相同時直接複製串流，
+否則轉檔且輸出位元率不超過來源位元率（低位元率來源轉成高位元率沒有畫質/音質上的好處）。
+每次決定都會寫入日誌並累計次數，可由 plan_stats() 看出昂貴的轉檔路徑被走到的比例。
+derive_audio() 以相同的計畫從已下載的影片檔在本地產生音訊輸出（同一影片的 mp4 + mp3 只需下載一次）。
+
+音訊基準測試（原本的固定位元率轉檔 vs 依來源計畫）：
+    python scripts/core/postprocess_planner.py --audio-benchmark <音訊串流目錄> [--codec mp3] [--kbps 320]
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.postprocessor.ffmpeg import (
+    ACODECS,
+    FFmpegExtractAudioPP,
+    FFmpegPostProcessor,
+    FFmpegPostProcessorError,
+    FFmpegVideoConvertorPP,
+    FFmpegVideoRemuxerPP,
+)
+from yt_dlp.utils import PostProcessingError, prepend_extension, replace_extension
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+from scripts.utils.file_utils import safe_path_join
+
+# 容器 -> (可放入的影像編碼, 可放入的音訊編碼)；None 代表不限
+CONTAINER_CODECS = {
+    'mp4': ({'h264', 'h265', 'av1', 'vp9', 'mpeg4'}, {'aac', 'mp3', 'opus', 'flac', 'alac', 'ac3', 'eac3'}),
+    'mov': ({'h264', 'h265', 'av1', 'mpeg4', 'prores'}, {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'pcm'}),
+    'webm': ({'vp8', 'vp9', 'av1'}, {'opus', 'vorbis'}),
+    'mkv': (None, None),
+    'flv': ({'h264'}, {'aac', 'mp3'}),
+    'avi': ({'h264', 'mpeg4', 'mjpeg'}, {'mp3', 'ac3', 'pcm'}),
+}
+
+# 音訊目標格式 -> 可直接複製串流的來源編碼
+AUDIO_NATIVE_CODECS = {
+    'mp3': {'mp3'},
+    'aac': {'aac'},
+    'm4a': {'aac'},
+    'opus': {'opus'},
+    'vorbis': {'vorbis'},
+    'flac': {'flac'},
+    'alac': {'alac'},
+}
+# 無損目標：位元率沒有意義，選擇最佳來源
+LOSSLESS_AUDIO = {'flac', 'wav', 'alac'}
+
+# 轉檔位元率階梯（kbps）：來源位元率向上取到最近的一階作為輸出上限
+_AUDIO_BITRATE_LADDER = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+# yt-dlp 的 vcodec/acodec 字串（例如 avc1.64001F、mp4a.40.2）前綴 -> 編碼族
+_CODEC_PREFIXES = (
+    ('avc', 'h264'), ('h264', 'h264'),
+    ('hvc1', 'h265'), ('hev1', 'h265'), ('h265', 'h265'), ('hevc', 'h265'),
+    ('av01', 'av1'), ('av1', 'av1'),
+    ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp08', 'vp8'), ('vp8', 'vp8'),
+    ('mp4v', 'mpeg4'), ('mpeg4', 'mpeg4'), ('mjpeg', 'mjpeg'), ('prores', 'prores'),
+    ('mp4a', 'aac'), ('aac', 'aac'), ('mp3', 'mp3'), ('mp4a.6b', 'mp3'), ('mp4a.69', 'mp3'),
+    ('opus', 'opus'), ('vorbis', 'vorbis'), ('flac', 'flac'), ('alac', 'alac'),
+    ('ac-3', 'ac3'), ('ac3', 'ac3'), ('ec-3', 'eac3'), ('eac3', 'eac3'), ('pcm', 'pcm'),
+)
+
+_stats_lock = threading.Lock()
+_stats = {'none': 0, 'remux': 0, 'transcode': 0, 'remux_failed': 0, 'audio_copy': 0, 'audio_transcode': 0, 'audio_derived': 0}
+
+
+def codec_family(codec):
+    """正規化 yt-dlp 的編碼字串；'none' 回傳 ''（沒有該類串流），無法辨識回傳 None"""
+    value = (codec or '').strip().lower()
+    if value == 'none':
+        return ''
+    if not value:
+        return None
+    # 較長的前綴優先（mp4a.6b 是 mp3，不是 aac）
+    for prefix, family in sorted(_CODEC_PREFIXES, key=lambda p: -len(p[0])):
+        if value.startswith(prefix):
+            return family
+    return None
+
+
+def plan_container(info, target):
+    """決定把 info 對應的檔案轉成 target 容器的方式，回傳 (action, 原因)"""
+    target = (target or '').strip().lower()
+    source_ext = (info.get('ext') or '').lower()
+    if source_ext == target:
+        return 'none', f"已是 {target}"
+    allowed_video, allowed_audio = CONTAINER_CODECS.get(target, (None, None))
+    unknown = []
+    for kind, codec, allowed in (
+        ('影像', info.get('vcodec'), allowed_video),
+        ('音訊', info.get('acodec'), allowed_audio),
+    ):
+        family = codec_family(codec)
+        if family == '' or allowed is None:
+            continue
+        if family is None:
+            unknown.append(kind)
+            continue
+        if family not in allowed:
+            return 'transcode', f"{kind}編碼 {family} 不能放入 {target}"
+    if unknown:
+        return 'remux', f"{'/'.join(unknown)}編碼未知，先嘗試重新封裝"
+    return 'remux', f"{info.get('vcodec') or '-'} + {info.get('acodec') or '-'} 可直接放入 {target}"
+
+
+def plan_audio(source_codec, source_kbps, target, kbps):
+    """決定音訊的處理方式，回傳 (action, 輸出位元率或 None, 原因)；action 為 copy 或 transcode"""
+    target = (target or 'mp3').strip().lower()
+    family = codec_family(source_codec) if source_codec else None
+    if family and family in AUDIO_NATIVE_CODECS.get(target, ()):
+        return 'copy', None, f"來源 {family} 與 {target} 相同，直接複製串流"
+    if target in LOSSLESS_AUDIO:
+        return 'transcode', None, f"轉成無損 {target}"
+    try:
+        requested = int(float(kbps))
+    except (TypeError, ValueError):
+        requested = 320
+    if source_kbps:
+        # 來源位元率向上取到階梯的下一階（例如 129k -> 160k），避免低於來源
+        ceiling = next((b for b in _AUDIO_BITRATE_LADDER if b >= math.ceil(source_kbps)), _AUDIO_BITRATE_LADDER[-1])
+        if ceiling < requested:
+            return 'transcode', ceiling, f"來源 {family or '未知'} {source_kbps:.0f}kbps，輸出上限 {ceiling}kbps（要求 {requested}kbps）"
+    return 'transcode', requested, f"來源 {family or '未知'} {f'{source_kbps:.0f}kbps' if source_kbps else '位元率未知'}，輸出 {requested}kbps"
+
+
+def _count(action):
+    with _stats_lock:
+        _stats[action] = _stats.get(action, 0) + 1
+
+
+def plan_stats():
+    """累計的後處理結果次數（影片 none/remux/transcode、音訊 audio_copy/audio_transcode；
+    remux_failed 為重新封裝失敗、改走轉檔的次數，audio_derived 為從已下載檔案本地產生音訊的次數）"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class ContainerPlanPP(PostProcessor):
+    """依計畫重新封裝或轉檔到目標容器（取代無條件的 FFmpegVideoConvertor）"""
+
+    def __init__(self, downloader=None, target='mp4', task_id=None):
+        super().__init__(downloader)
+        self.target = (target or 'mp4').strip().lower()
+        self.task_id = task_id
+
+    @PostProcessor._restrict_to(images=False)
+    def run(self, info):
+        action, reason = plan_container(info, self.target)
+        download_console(
+            f"【任務{self.task_id}】後處理計畫: {info.get('ext')} -> {self.target} = {action}（{reason}）",
+            level=LogLevel.INFO,
+        )
+        if action == 'none':
+            _count('none')
+            return [], info
+        if action == 'remux':
+            try:
+                result = FFmpegVideoRemuxerPP(self._downloader, self.target).run(info)
+                _count('remux')
+                return result
+            except FFmpegPostProcessorError as e:
+                _count('remux_failed')
+                download_console(f"【任務{self.task_id}】重新封裝失敗，改為轉檔: {e}", level=LogLevel.WARNING)
+        _count('transcode')
+        return FFmpegVideoConvertorPP(self._downloader, self.target).run(info)
+
+
+def probe_audio(ydl, path, codec=None, abr=None, task_id=None):
+    """來源的音訊編碼與位元率；codec/abr 未知時以 ffprobe 讀取檔案（檔案沒有音訊串流時 codec 為 None）"""
+    if (not codec_family(codec) or not abr) and path:
+        try:
+            meta = FFmpegPostProcessor(ydl).get_metadata_object(path)
+            for stream in meta.get('streams') or []:
+                if stream.get('codec_type') == 'audio':
+                    if not codec_family(codec):
+                        codec = stream.get('codec_name')
+                    if not abr and stream.get('bit_rate'):
+                        abr = int(stream['bit_rate']) / 1000.0
+                    break
+            else:
+                if not codec_family(codec):
+                    codec = None
+            if not abr and (meta.get('format') or {}).get('bit_rate'):
+                abr = int(meta['format']['bit_rate']) / 1000.0
+        except Exception as e:
+            download_console(f"【任務{task_id}】讀取音訊來源資訊失敗: {e}", level=LogLevel.WARNING)
+    return codec, abr
+
+
+class AudioPlanPP(PostProcessor):
+    """依來源音訊串流決定直接複製或轉檔（取代固定位元率的 FFmpegExtractAudio）"""
+
+    def __init__(self, downloader=None, codec='mp3', kbps=320, task_id=None):
+        super().__init__(downloader)
+        self.codec = (codec or 'mp3').strip().lower()
+        self.kbps = kbps
+        self.task_id = task_id
+
+    @PostProcessor._restrict_to(images=False)
+    def run(self, info):
+        codec, abr = probe_audio(self._downloader, info.get('filepath'), info.get('acodec'), info.get('abr'), task_id=self.task_id)
+        action, kbps, reason = plan_audio(codec, abr, self.codec, self.kbps)
+        download_console(
+            f"【任務{self.task_id}】後處理計畫: 音訊 -> {self.codec} = {action}（{reason}）",
+            level=LogLevel.INFO,
+        )
+        _count(f'audio_{action}')
+        pp = FFmpegExtractAudioPP(self._downloader, preferredcodec=self.codec, preferredquality=kbps)
+        return pp.run(info)
+
+
+def derive_audio(ydl, source_path, target_path, codec='mp3', kbps=320, task_id=None):
+    """從已下載的檔案在本地產生音訊輸出（不經網路、不更動來源檔），回傳實際輸出路徑。
+
+    輸出副檔名與 FFmpegExtractAudio 相同（例如 aac -> .m4a），與直接下載音訊時的檔名一致。
+    """
+    codec = (codec or 'mp3').strip().lower()
+    if codec not in ACODECS:
+        raise PostProcessingError(f"不支援的音訊格式: {codec}")
+    ext, encoder, extra_opts = ACODECS[codec]
+    final_path = replace_extension(target_path, ext)
+    if os.path.abspath(final_path) == os.path.abspath(source_path):
+        raise PostProcessingError(f"輸出與來源為同一個檔案: {source_path}")
+    source_codec, source_abr = probe_audio(ydl, source_path, task_id=task_id)
+    if not source_codec:
+        raise PostProcessingError(f"來源檔案沒有音訊串流: {source_path}")
+
+    action, out_kbps, reason = plan_audio(source_codec, source_abr, codec, kbps)
+    download_console(
+        f"【任務{task_id}】後處理計畫: 從 {os.path.basename(source_path)} 產生 {codec} = {action}（{reason}）",
+        level=LogLevel.INFO,
+    )
+    _count(f'audio_{action}')
+    _count('audio_derived')
+    if action == 'copy':
+        acodec, opts = 'copy', list(extra_opts)
+    else:
+        # 與 FFmpegExtractAudio 轉檔時相同：指定編碼器與位元率
+        acodec, opts = encoder, (['-b:a', f'{out_kbps}k'] if out_kbps else [])
+    temp_path = prepend_extension(final_path, 'temp')
+    FFmpegExtractAudioPP(ydl, preferredcodec=codec).run_ffmpeg(source_path, temp_path, acodec, opts)
+    os.replace(temp_path, final_path)
+    return final_path
+
+
+def make_plan_postprocessor(ydl, plan, task_id=None):
+    """依 Downloader 產生的後處理計畫建立對應的 PostProcessor"""
+    if plan.get('kind') == 'audio':
+        return AudioPlanPP(ydl, plan.get('codec'), plan.get('kbps'), task_id=task_id)
+    return ContainerPlanPP(ydl, plan.get('target'), task_id=task_id)
+
+
+# ---- 基準測試 ----
+
+def audio_benchmark(media_dir, codec='mp3', kbps=320, app_root_dir=root_dir):
+    """把目錄中的音訊串流（例如下載的 .webm/.m4a）轉成 codec：比較固定位元率轉檔與依來源計畫的耗時、CPU 時間與輸出大小"""
+    import shutil
+    import tempfile
+    import yt_dlp
+    from scripts.core.ffmpeg_governor import child_cpu_seconds
+
+    files = sorted(
+        os.path.join(media_dir, name) for name in os.listdir(media_dir)
+        if os.path.isfile(os.path.join(media_dir, name))
+    )
+    if not files:
+        raise ValueError(f"目錄中沒有檔案: {media_dir}")
+    ydl_opts = {'quiet': True}
+    ffmpeg_path = safe_path_join(app_root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
+    if os.path.exists(ffmpeg_path):
+        ydl_opts['ffmpeg_location'] = ffmpeg_path
+
+    results = {}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        for mode in ('fixed', 'planned'):
+            with tempfile.TemporaryDirectory() as tmp:
+                output_bytes = 0
+                failures = 0
+                cpu_before = child_cpu_seconds()
+                started = time.perf_counter()
+                for path in files:
+                    target = os.path.join(tmp, os.path.basename(path))
+                    shutil.copyfile(path, target)
+                    info = {'filepath': target, 'ext': os.path.splitext(target)[1].lstrip('.')}
+                    if mode == 'fixed':
+                        pp = FFmpegExtractAudioPP(ydl, preferredcodec=codec, preferredquality=str(kbps))
+                    else:
+                        pp = AudioPlanPP(ydl, codec, kbps, task_id='benchmark')
+                    try:
+                        _, info = pp.run(info)
+                        output_bytes += os.path.getsize(info['filepath'])
+                    except Exception as e:
+                        failures += 1
+                        download_console(f"轉檔失敗: {e}", level=LogLevel.WARNING)
+                elapsed = time.perf_counter() - started
+                cpu_after = child_cpu_seconds()
+            results[mode] = {
+                'files': len(files),
+                'failures': failures,
+                'seconds': round(elapsed, 2),
+                'ffmpeg_cpu_seconds': round(cpu_after - cpu_before, 2) if cpu_before is not None else None,
+                'output_mb': round(output_bytes / (1024 * 1024), 2),
+            }
+    results['plans'] = plan_stats()
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='音訊後處理計畫：固定位元率轉檔 vs 依來源計畫')
+    parser.add_argument('--audio-benchmark', metavar='DIR', required=True, help='音訊串流目錄（下載後、轉檔前的檔案）')
+    parser.add_argument('--codec', default='mp3', help='目標音訊格式（預設 mp3）')
+    parser.add_argument('--kbps', type=int, default=320, help='要求的位元率（預設 320）')
+    args = parser.parse_args()
+
+    print(json.dumps(audio_benchmark(args.audio_benchmark, codec=args.codec, kbps=args.kbps), ensure_ascii=False, indent=2))
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下載工作行程模組
+
+把 Downloader.download_once 移到預先啟動、已載入 yt_dlp 的子行程中執行，
+讓解析（正規表示式、JSON、簽章處理）與每個分段的進度回調不再和 Qt/QWebChannel
+搶同一個直譯器的 GIL。子行程以較低優先權執行；進度、心跳與完成結果經由 Pipe
+回到主行程，交給原本 Downloader 上的回調。子行程異常結束時，進行中的任務以錯誤
+結束（由排程器依重試規則處理），並自動補上新的子行程。
+
+取消或停滯監控放棄時先要求子行程自行中止，逾時仍未結束（卡在網路 I/O 或 ffmpeg）
+則強制結束該子行程並補上新的。
+由設定 useProcessWorkers 啟用；排程器的併發、重試與停滯監控維持不變。
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+import multiprocessing
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+from scripts.config.constants import PROCESS_WORKER_PROGRESS_INTERVAL_SECONDS, PROCESS_WORKER_CANCEL_GRACE_SECONDS
+from scripts.core.ffmpeg_governor import governor as ffmpeg_governor
+
+# 進度回調轉送給主行程的欄位（yt-dlp 的 info_dict 等大型物件不跨行程傳送）
+_PROGRESS_FIELDS = (
+    'status', 'task_id', 'filename', 'tmpfilename', 'downloaded_bytes', 'total_bytes',
+    'total_bytes_estimate', 'elapsed', 'eta', 'speed', 'fragment_index', 'fragment_count',
+    'reextract_count',
+)
+
+
+_MAX_STARTUP_FAILURES = 3
+
+
+class DownloadWorkerError(Exception):
+    """子行程中的下載失敗，或子行程異常結束"""
+
+
+# ---- 子行程 ----
+
+def _lower_priority():
+    """子行程以較低優先權執行，UI 所在的主行程優先取得 CPU"""
+    try:
+        if sys.platform.startswith('win'):
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(5)
+    except Exception as e:
+        download_console(f"調整下載子行程優先權失敗: {e}", level=LogLevel.WARNING)
+
+
+def _worker_main(conn, app_root_dir, ffmpeg_config=None):
+    """子行程進入點：接收 ('download', task_id, kwargs, settings) / ('cancel', task_id) / ('stop',)"""
+    _lower_priority()
+    import yt_dlp  # noqa: F401  預先載入，第一個任務不必等待 import
+    from scripts.core.downloader import Downloader
+    from scripts.core.ffmpeg_governor import governor
+
+    # 每個子行程一次只執行一個任務：ffmpeg 核心預算由主行程平均分給各子行程
+    if ffmpeg_config:
+        governor.configure(**ffmpeg_config)
+
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    last_sent = {}  # (task_id, kind) -> 上次送出時間
+
+    def throttled(task_id, kind):
+        now = time.monotonic()
+        key = (task_id, kind)
+        if now - last_sent.get(key, 0.0) < PROCESS_WORKER_PROGRESS_INTERVAL_SECONDS:
+            return True
+        last_sent[key] = now
+        return False
+
+    def on_progress(task_id, d):
+        # 下載中的進度只需最新一筆：限制送出頻率；其他狀態（例如 reextracting）一律送出
+        if d.get('status') == 'downloading' and throttled(task_id, 'progress'):
+            return
+        send(('progress', task_id, {k: d[k] for k in _PROGRESS_FIELDS if k in d}))
+
+    def on_heartbeat(task_id):
+        if not throttled(task_id, 'heartbeat'):
+            send(('heartbeat', task_id))
+
+    downloader = Downloader(app_root_dir, progress_callback=on_progress)
+    downloader.heartbeat_callback = on_heartbeat
+    jobs = queue.Queue()
+
+    def read_loop():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ('stop',)
+            kind = message[0]
+            if kind == 'download':
+                jobs.put(message)
+            elif kind == 'cancel':
+                downloader.request_cancel(message[1])
+            elif kind == 'stop':
+                jobs.put(None)
+                return
+
+    threading.Thread(target=read_loop, name='download-process-reader', daemon=True).start()
+    send(('ready', os.getpid()))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        _, task_id, kwargs, settings = job
+        downloader.throttle_avoidance = settings.get('throttle_avoidance', downloader.throttle_avoidance)
+        downloader.throttle_floor_kb = settings.get('throttle_floor_kb', downloader.throttle_floor_kb)
+        downloader.parallel_streams = settings.get('parallel_streams', downloader.parallel_streams)
+        downloader.write_buffer_kb = settings.get('write_buffer_kb', downloader.write_buffer_kb)
+        try:
+            final_path = downloader.download_once(task_id, **kwargs)
+            send(('done', task_id, final_path))
+        except BaseException as e:
+            send(('error', task_id, str(e) or type(e).__name__))
+        finally:
+            last_sent.pop((task_id, 'progress'), None)
+            last_sent.pop((task_id, 'heartbeat'), None)
+
+
+# ---- 主行程 ----
+
+class _Job:
+    __slots__ = ('task_id', 'done', 'result', 'error', 'cancel_at')
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancel_at = None  # 送出取消的時間（monotonic）
+
+
+class _WorkerProcess:
+    """主行程這端的子行程代表：一次只執行一個任務"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, pool.root_dir, {
+                'max_jobs': 1,
+                'core_budget': max(1, ffmpeg_governor.core_budget // pool.size),
+            }),
+            name=f'download-process-{index}',
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.job = None
+        self.alive = True
+        self.ready = False
+        self.retiring = False  # 主動停止（不需補上新的子行程）
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name=f'download-process-{index}-reader', daemon=True)
+        self._reader.start()
+
+    def send(self, message):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def _read_loop(self):
+        downloader = self.pool.downloader
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                kind = message[0]
+                if kind == 'progress':
+                    _, task_id, d = message
+                    downloader._heartbeat(task_id)
+                    if downloader.progress_callback:
+                        downloader.progress_callback(task_id, d)
+                elif kind == 'heartbeat':
+                    downloader._heartbeat(message[1])
+                elif kind in ('done', 'error'):
+                    job = self.job
+                    if job is not None and job.task_id == message[1]:
+                        if kind == 'done':
+                            job.result = message[2]
+                        else:
+                            job.error = DownloadWorkerError(message[2])
+                        job.done.set()
+                elif kind == 'ready':
+                    self.ready = True
+                    self.pool._startup_failures = 0
+                    download_console(f"下載子行程 {self.index} 已就緒（pid={message[1]}）")
+            except Exception as e:
+                download_console(f"處理下載子行程訊息失敗: {e}", level=LogLevel.WARNING)
+        self.alive = False
+        self.pool._on_worker_exit(self)
+
+
+class DownloadProcessPool:
+    """下載子行程池：run() 與 Downloader.download_once 的呼叫方式與回傳值相同（同步、失敗時拋出例外）"""
+
+    def __init__(self, downloader, size=3):
+        self.downloader = downloader
+        self.root_dir = downloader.root_dir
+        self.size = max(1, int(size or 1))
+        self._lock = threading.Lock()
+        self._idle = []
+        self._by_task = {}  # task_id -> _WorkerProcess
+        self._next_index = 0
+        self._stopping = False
+        self._startup_failures = 0  # 連續在就緒前就結束的子行程數
+        self.restarts = 0
+
+    def start(self):
+        """預先啟動 size 個子行程（各自已載入 yt_dlp）"""
+        for _ in range(self.size):
+            worker = self._spawn()
+            if worker is not None:
+                with self._lock:
+                    self._idle.append(worker)
+        download_console(f"已啟動 {self.size} 個下載子行程", level=LogLevel.INFO)
+
+    def _spawn(self):
+        with self._lock:
+            index = self._next_index
+            self._next_index += 1
+        try:
+            return _WorkerProcess(self, index)
+        except Exception as e:
+            download_console(f"啟動下載子行程失敗: {e}", level=LogLevel.ERROR)
+            return None
+
+    def _acquire(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+        # 全部忙碌（例如被停滯監控放棄、仍在結束中的嘗試）：臨時補一個
+        worker = self._spawn()
+        if worker is None:
+            raise DownloadWorkerError("無法啟動下載子行程")
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            if not worker.alive:
+                return  # 已結束（或被強制結束）：由 _on_worker_exit 補上新的子行程
+            if not self._stopping and len(self._idle) < self.size:
+                self._idle.append(worker)
+                return
+        self._stop_worker(worker)
+
+    def run(self, task_id, url, quality, format_type, downloads_dir=None, add_resolution_to_filename=False, original_format=None):
+        worker = self._acquire()
+        job = _Job(task_id)
+        worker.job = job
+        with self._lock:
+            self._by_task[task_id] = worker
+        try:
+            worker.send(('download', task_id, {
+                'url': url,
+                'quality': quality,
+                'format_type': format_type,
+                'downloads_dir': downloads_dir,
+                'add_resolution_to_filename': add_resolution_to_filename,
+                'original_format': original_format,
+            }, {
+                'throttle_avoidance': self.downloader.throttle_avoidance,
+                'throttle_floor_kb': self.downloader.throttle_floor_kb,
+                'parallel_streams': self.downloader.parallel_streams,
+                'write_buffer_kb': self.downloader.write_buffer_kb,
+            }))
+            while not job.done.wait(1.0):
+                cancel_at = job.cancel_at
+                if cancel_at is not None and time.monotonic() - cancel_at >= PROCESS_WORKER_CANCEL_GRACE_SECONDS:
+                    self._kill_worker(worker, job)
+                    break
+        except (OSError, ValueError) as e:
+            job.error = DownloadWorkerError(f"無法傳送任務給下載子行程: {e}")
+        finally:
+            with self._lock:
+                if self._by_task.get(task_id) is worker:
+                    del self._by_task[task_id]
+            worker.job = None
+            self._release(worker)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def cancel(self, task_id):
+        """轉送取消要求給執行該任務的子行程"""
+        with self._lock:
+            worker = self._by_task.get(task_id)
+        if worker is None:
+            return False
+        job = worker.job
+        if job is not None and job.task_id == task_id and job.cancel_at is None:
+            # 子行程卡住而讀不到取消訊息時，run() 在寬限時間後強制結束它
+            job.cancel_at = time.monotonic()
+        try:
+            worker.send(('cancel', task_id))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _kill_worker(self, worker, job):
+        """強制結束未回應取消的子行程；任務以錯誤結束，由 _on_worker_exit 補上新的子行程"""
+        download_console(
+            f"【任務{job.task_id}】下載子行程 {worker.index} 超過 {PROCESS_WORKER_CANCEL_GRACE_SECONDS} 秒未回應取消，強制結束",
+            level=LogLevel.WARNING,
+        )
+        worker.alive = False  # 不再放回閒置清單
+        try:
+            worker.process.terminate()
+            worker.process.join(2.0)
+            if worker.process.is_alive():
+                worker.process.kill()
+        except Exception as e:
+            download_console(f"結束下載子行程失敗: {e}", level=LogLevel.WARNING)
+        if not job.done.is_set():
+            job.error = DownloadWorkerError("下載子行程未回應取消，已強制結束")
+            job.done.set()
+
+    def _on_worker_exit(self, worker):
+        """子行程結束：讓進行中的任務失敗，並在非關閉期間補上新的子行程"""
+        try:
+            worker.process.join(1.0)
+        except Exception:
+            pass
+        exitcode = worker.process.exitcode
+        job = worker.job
+        if job is not None and not job.done.is_set():
+            job.error = DownloadWorkerError(f"下載子行程異常結束（exitcode={exitcode}）")
+            job.done.set()
+        with self._lock:
+            if worker in self._idle:
+                self._idle.remove(worker)
+            if self._stopping or worker.retiring:
+                return
+            if not worker.ready:
+                self._startup_failures += 1
+            if self._startup_failures >= _MAX_STARTUP_FAILURES:
+                # 子行程一啟動就結束（例如環境缺少模組）：停止自動重啟，避免不斷重開行程
+                download_console("下載子行程連續啟動失敗，停止自動重啟", level=LogLevel.ERROR)
+                return
+            self.restarts += 1
+            need = len(self._idle) < self.size
+        download_console(f"下載子行程 {worker.index} 已結束（exitcode={exitcode}），重新啟動", level=LogLevel.WARNING)
+        if need:
+            replacement = self._spawn()
+            if replacement is not None:
+                with self._lock:
+                    self._idle.append(replacement)
+
+    def _stop_worker(self, worker):
+        worker.retiring = True
+        try:
+            worker.send(('stop',))
+        except (OSError, ValueError):
+            pass
+
+    def stop(self):
+        """關閉所有子行程（執行中的下載隨之中止，.part 檔保留供下次續傳）"""
+        with self._lock:
+            self._stopping = True
+            workers = list(self._idle) + list(self._by_task.values())
+            self._idle = []
+        for worker in workers:
+            self._stop_worker(worker)
+            try:
+                worker.process.join(0.5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            except Exception:
+                pass
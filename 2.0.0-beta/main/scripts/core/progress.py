@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下載進度彙整模組
+
+yt-dlp 的進度回調非常頻繁，逐次送往前端會讓主線程塞滿 runJavaScript。
+此模組只保留每個任務最新的一筆狀態，由呼叫端以固定頻率（例如 10 Hz）
+整批送出；進度百分比單調不減，終止狀態（完成/錯誤）立即送出，
+之後短時間內該任務遲到的非終止更新一律丟棄（任務重新受理時以 reset 清除）。
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+
+# 終止狀態送出後保留終止標記的秒數：期間遲到的進度回調（例如下載執行緒的最後一筆）直接丟棄
+_TERMINAL_GRACE_SECONDS = 5.0
+
+
+class ProgressAggregator:
+    """下載進度彙整器
+
+    flush_callback(updates) 會收到一個串列，每筆為
+    [task_id, percent, status, message, file_path, format]，
+    與 window.updateDownloadProgress 的參數順序一致。
+    """
+
+    def __init__(self, flush_callback):
+        self.flush_callback = flush_callback
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # task_key -> 更新
+        self._last_percent = {}        # task_key -> 已送出的最高百分比
+        self._terminal = OrderedDict() # task_key -> 進入終止狀態的時間（monotonic）
+        self.updates_received = 0
+        self.updates_flushed = 0
+
+    def update(self, task_id, percent=None, status='下載中', message='', file_path='', fmt=''):
+        """記錄非終止狀態；percent=None 表示沿用目前進度（只更新狀態文字）"""
+        key = str(task_id)
+        with self._lock:
+            if key in self._terminal:
+                return
+            self.updates_received += 1
+            last = self._last_percent.get(key, 0.0)
+            percent = last if percent is None else max(last, float(percent))
+            self._last_percent[key] = percent
+            prev = self._pending.pop(key, None)
+            if prev is not None and not file_path:
+                file_path = prev[4]
+            self._pending[key] = [task_id, percent, status, message, file_path, fmt]
+
+    def finish(self, task_id, percent=100, status='已完成', message='', file_path='', fmt=''):
+        """終止狀態：丟棄尚未送出的更新並立即送出；percent=None 表示不更新進度條"""
+        key = str(task_id)
+        with self._lock:
+            self._terminal.pop(key, None)
+            self._terminal[key] = time.monotonic()
+            self._pending.pop(key, None)
+            # 終止狀態立即送出，不再需要保留進度
+            self._last_percent.pop(key, None)
+            if percent is None:
+                return
+        self._emit([[task_id, float(percent), status, message, file_path, fmt]])
+
+    def reset(self, task_id):
+        """任務重新開始（例如確認後重新下載同一任務），清除終止標記與進度"""
+        key = str(task_id)
+        with self._lock:
+            self._terminal.pop(key, None)
+            self._last_percent.pop(key, None)
+            self._pending.pop(key, None)
+
+    def flush(self):
+        """送出所有有變動的任務（由固定頻率的計時器呼叫）"""
+        with self._lock:
+            self._prune_terminal()
+            if not self._pending:
+                return
+            batch = list(self._pending.values())
+            self._pending.clear()
+        self._emit(batch)
+
+    def _prune_terminal(self):
+        """移除超過保留時間的終止標記（呼叫端須持有鎖）"""
+        cutoff = time.monotonic() - _TERMINAL_GRACE_SECONDS
+        while self._terminal:
+            key, finished_at = next(iter(self._terminal.items()))
+            if finished_at > cutoff:
+                break
+            self._terminal.popitem(last=False)
+
+    def _emit(self, batch):
+        try:
+            self.updates_flushed += len(batch)
+            self.flush_callback(batch)
+        except Exception as e:
+            download_console(f"送出下載進度失敗: {e}", level=LogLevel.WARNING)
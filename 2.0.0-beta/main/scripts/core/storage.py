@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下載儲存模組
+
+下載寫入磁碟的策略：
+  - 暫存目錄（STORAGE_TEMP_DIRNAME）建在目標目錄內，確認與目標目錄位於同一個磁碟區；
+    .part、合併/轉檔的中間檔都寫在這裡，完成後 yt-dlp 移到目標目錄只是 rename，不會整檔複製
+  - 寫入緩衝：下載器的小區塊寫入先累積到緩衝區（預設 STORAGE_WRITE_BUFFER_KB），
+    達到大小才寫入檔案，減少系統呼叫與檔案碎片
+  - 每個任務的寫入吞吐量：實際寫入的位元組、寫入期間的平均速度與寫入呼叫本身的速度
+  - 空間預留：依格式的 filesize/filesize_approx（或位元率 × 長度）估計任務佔用的空間，
+    排程器在開始下載前向 SpaceReservations 預留；放不下的任務等待其他任務結束釋放預留
+install() 包裝 yt-dlp FileDownloader.sanitize_open（HTTP/分片下載開啟 .part 檔的共同入口），
+由 Downloader 建立時呼叫；緩衝大小與計量器經由 ydl 參數 _write_buffer_size / _write_meter 傳入。
+
+預先配置（依已知檔案大小預留空間）沒有採用：yt-dlp 以 .part 檔的實際大小決定續傳位置，
+預先擴充 .part 會讓限速重試/停滯重試從錯誤的位置續傳。
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import functools
+import threading
+from collections import deque
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from scripts.utils.logger import download_console, LogLevel
+from scripts.core.format_preference import height_range
+from scripts.config.constants import STORAGE_TEMP_DIRNAME
+
+_WRITE_MODES = ('wb', 'ab')
+_TIMING_WINDOW = 500
+_MB = 1024 * 1024
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return round(values[k], 1)
+
+
+def temp_dir_for(target_dir):
+    """目標目錄對應的暫存目錄（與目標同一磁碟區）；無法建立或不在同一磁碟區時回傳 None"""
+    temp_dir = os.path.join(target_dir, STORAGE_TEMP_DIRNAME)
+    try:
+        os.makedirs(temp_dir, exist_ok=True)
+        if os.stat(temp_dir).st_dev != os.stat(target_dir).st_dev:
+            # 例如暫存目錄名稱被掛載成其他磁碟區：改為直接寫入目標目錄
+            download_console(f"暫存目錄與下載目錄不在同一磁碟區，改為直接寫入下載目錄: {temp_dir}", level=LogLevel.WARNING)
+            _stats.note_temp_dir(False)
+            return None
+    except OSError as e:
+        download_console(f"建立暫存目錄失敗，改為直接寫入下載目錄: {e}", level=LogLevel.WARNING)
+        _stats.note_temp_dir(False)
+        return None
+    _stats.note_temp_dir(True)
+    return temp_dir
+
+
+def cleanup_temp_dir(target_dir):
+    """暫存目錄已空時移除（其他任務仍在寫入時保留）"""
+    try:
+        os.rmdir(os.path.join(target_dir, STORAGE_TEMP_DIRNAME))
+    except OSError:
+        pass
+
+
+class WriteMeter:
+    """一個任務的寫入計量（合併格式的各串流可能同時寫入，共用同一個計量器）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.write_seconds = 0.0
+        self._first = None
+        self._last = None
+
+    def mark(self):
+        """下載器交來一個區塊（可能仍在緩衝區）：更新寫入期間"""
+        now = time.monotonic()
+        with self._lock:
+            if self._first is None:
+                self._first = now
+            self._last = now
+
+    def record(self, nbytes, seconds):
+        """實際寫入檔案 nbytes 位元組，寫入呼叫耗時 seconds 秒"""
+        with self._lock:
+            self._last = time.monotonic()
+            self.bytes += nbytes
+            self.write_seconds += seconds
+
+    def summary(self):
+        """{'bytes', 'seconds', 'mbps', 'write_mbps'}：寫入期間的平均速度與寫入呼叫本身的速度（MB/s）"""
+        with self._lock:
+            elapsed = (self._last - self._first) if self._first is not None else 0.0
+            return {
+                'bytes': self.bytes,
+                'seconds': round(elapsed, 2),
+                'mbps': round(self.bytes / _MB / elapsed, 2) if elapsed > 0 else 0.0,
+                'write_mbps': round(self.bytes / _MB / self.write_seconds, 1) if self.write_seconds > 0 else 0.0,
+            }
+
+
+class BufferedStream:
+    """累積小區塊寫入，達到緩衝大小才寫入底層檔案；其他操作轉給底層檔案"""
+
+    def __init__(self, stream, size, meter=None):
+        self._stream = stream
+        self._size = max(0, int(size or 0))
+        self._meter = meter
+        self._buffer = bytearray()
+
+    def _write_through(self, data):
+        started = time.perf_counter()
+        self._stream.write(data)
+        if self._meter is not None:
+            self._meter.record(len(data), time.perf_counter() - started)
+
+    def _drain(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._write_through(data)
+
+    def write(self, data):
+        if self._meter is not None:
+            self._meter.mark()
+        if len(self._buffer) + len(data) > self._size:
+            self._drain()
+            if len(data) >= self._size:
+                self._write_through(data)
+                return len(data)
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        self._drain()
+        return self._stream.flush()
+
+    def tell(self):
+        return self._stream.tell() + len(self._buffer)
+
+    def close(self, *args):
+        try:
+            self._drain()
+        finally:
+            self._stream.close(*args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class StorageStats:
+    """最近完成的任務寫入吞吐量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mbps = deque(maxlen=_TIMING_WINDOW)
+        self._tasks = 0
+        self._bytes = 0
+        self.temp_on_volume = 0
+        self.temp_fallback = 0
+
+    def record(self, task_id, meter):
+        """記錄一個任務的寫入吞吐量並輸出日誌；回傳 summary"""
+        summary = meter.summary()
+        if not summary['bytes']:
+            return summary
+        with self._lock:
+            self._tasks += 1
+            self._bytes += summary['bytes']
+            if summary['mbps']:
+                self._mbps.append(summary['mbps'])
+        download_console(
+            f"【任務{task_id}】寫入 {summary['bytes'] / _MB:.1f}MB，耗時 {summary['seconds']}s，"
+            f"平均 {summary['mbps']}MB/s（寫入呼叫 {summary['write_mbps']}MB/s）",
+            level=LogLevel.INFO,
+        )
+        return summary
+
+    def note_temp_dir(self, on_volume):
+        with self._lock:
+            if on_volume:
+                self.temp_on_volume += 1
+            else:
+                self.temp_fallback += 1
+
+    def snapshot(self):
+        with self._lock:
+            mbps = list(self._mbps)
+            return {
+                'tasks': self._tasks,
+                'bytes_written': self._bytes,
+                'write_mbps_p50': _percentile(mbps, 50),
+                'write_mbps_p10': _percentile(mbps, 10),
+                'temp_on_volume': self.temp_on_volume,
+                'temp_fallback': self.temp_fallback,
+            }
+
+
+_stats = StorageStats()
+
+
+def record_task(task_id, meter):
+    return _stats.record(task_id, meter)
+
+
+def stats():
+    return _stats.snapshot()
+
+
+# ---- 空間預留 ----
+
+def _format_bytes(fmt, duration):
+    """單一格式的預估大小：filesize / filesize_approx，都沒有時以位元率（kbps）× 長度估計"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return 0
+
+
+def estimate_task_bytes(info, quality, format_type, original_format=None):
+    """估計任務在下載與後處理期間佔用的磁碟空間（位元組）；無法估計時回傳 0。
+
+    info 可為完整的影片資訊（含 formats）或只有頂層欄位的快取資訊。取畫質範圍內最大的串流（寧可高估）；
+    合併/轉檔期間下載的串流與輸出檔同時存在，因此影片以串流大小的兩倍計算，音訊為來源加上輸出。
+    """
+    if not isinstance(info, dict):
+        return 0
+    duration = info.get('duration') or 0
+    match = re.search(r'(\d+)', str(quality or ''))
+    qnum = int(match.group(1)) if match else 0
+    formats = [f for f in info.get('formats') or [] if isinstance(f, dict) and (f.get('ext') or '').lower() != 'mhtml']
+    audio = max(
+        (_format_bytes(f, duration) for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')),
+        default=0,
+    )
+
+    if (format_type or '').strip() == "音訊":
+        output = int(qnum * 1000 / 8 * duration) if qnum and duration else 0
+        return (audio or _format_bytes(info, duration)) + output
+
+    min_height, max_height = height_range(qnum or 1080)
+    candidates = [
+        f for f in formats
+        if f.get('vcodec') not in (None, 'none') and f.get('height') and min_height <= f['height'] <= max_height
+    ]
+    if not candidates:
+        return _format_bytes(info, duration) * 2
+    video = max(candidates, key=lambda f: _format_bytes(f, duration))
+    streams = _format_bytes(video, duration)
+    if video.get('acodec') == 'none':
+        streams += audio
+    return streams * 2
+
+
+def _existing_dir(path):
+    """path 或其最近的既有上層目錄（下載目錄可能尚未建立）"""
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class SpaceReservations:
+    """各磁碟區的空間預留：可用空間扣除其他進行中任務的預留與保留空間後，放得下才可開始下載"""
+
+    def __init__(self, min_free_bytes=0):
+        self.min_free_bytes = max(0, int(min_free_bytes or 0))
+        self._lock = threading.Lock()
+        self._reserved = {}  # task_id -> (磁碟區, 位元組)
+        self._held = 0
+
+    def try_reserve(self, task_id, path, nbytes):
+        """為任務預留 nbytes（同一任務重複呼叫會取代原本的預留）；回傳 (是否成功, 可預留的位元組)"""
+        try:
+            target = _existing_dir(path)
+            device = os.stat(target).st_dev
+            free = shutil.disk_usage(target).free
+        except OSError as e:
+            # 無法取得磁碟資訊時不阻擋下載
+            download_console(f"【任務{task_id}】無法取得可用空間，略過空間檢查: {e}", level=LogLevel.WARNING)
+            return True, 0
+        with self._lock:
+            reserved = sum(b for t, (d, b) in self._reserved.items() if d == device and t != task_id)
+            available = free - reserved - self.min_free_bytes
+            if nbytes > available:
+                return False, max(0, available)
+            self._reserved[task_id] = (device, int(nbytes))
+            return True, available
+
+    def release(self, task_id):
+        """釋放任務的預留；回傳是否有預留"""
+        with self._lock:
+            return self._reserved.pop(task_id, None) is not None
+
+    def note_held(self):
+        with self._lock:
+            self._held += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'reserved_tasks': len(self._reserved),
+                'reserved_bytes': sum(b for _, b in self._reserved.values()),
+                'min_free_bytes': self.min_free_bytes,
+                'held': self._held,
+            }
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """把寫入緩衝與計量套用到 yt-dlp 的下載器（可重複呼叫）；回傳是否已套用"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return True
+        try:
+            from yt_dlp.downloader.common import FileDownloader
+            original_open = FileDownloader.sanitize_open
+        except Exception as e:
+            download_console(f"無法套用下載寫入緩衝: {e}", level=LogLevel.WARNING)
+            return False
+
+        @functools.wraps(original_open)
+        def buffered_open(fd, filename, open_mode):
+            stream, filename = original_open(fd, filename, open_mode)
+            if filename == '-' or open_mode not in _WRITE_MODES:
+                return stream, filename
+            size = fd.params.get('_write_buffer_size') or 0
+            meter = fd.params.get('_write_meter')
+            if size <= 0 and meter is None:
+                return stream, filename
+            return BufferedStream(stream, size, meter), filename
+
+        FileDownloader.sanitize_open = buffered_open
+        _installed = True
+        return True
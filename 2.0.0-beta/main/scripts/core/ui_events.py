@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+前端事件匯流排模組
+
+以 QWebChannel 公開的 QObject（名稱 'events'），用具型別的信號把後端事件
+（進度批次、影片資訊、畫質批次、提示訊息等）以 JSON 相容的資料送往前端，
+取代每則訊息都組 JavaScript 原始碼再交給 runJavaScript 編譯執行的做法。
+任何執行緒都可以呼叫 post()；實際發出信號一律在主線程進行。
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from PySide6.QtCore import QObject, Slot, Signal, QTimer, Qt
+from scripts.utils.logger import api_console, LogLevel
+from scripts.config.constants import UI_EVENT_BATCH_INTERVAL_MS, INFO_PAGE_SIZE, INFO_PAGE_INTERVAL_MS
+
+
+def to_json_compatible(obj):
+    """遞歸清理對象，確保可以 JSON 序列化（QWebChannel 會轉成 JSON 傳給前端）"""
+    if isinstance(obj, dict):
+        return {str(k): to_json_compatible(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_json_compatible(item) for item in obj]
+    if isinstance(obj, (str, int, float, bool, type(None))):
+        return obj
+    try:
+        return str(obj)
+    except Exception:
+        return None
+
+
+class _EventRelay(QObject):
+    """內部轉送器：把任意執行緒的事件排入主線程（不經 QWebChannel 公開）"""
+    posted = Signal(object)
+
+
+class UiEventBus(QObject):
+    """後端 → 前端的事件匯流排"""
+
+    # 下載進度批次：[[taskId, progress, status, message, filePath, format], ...]
+    progressBatch = Signal('QVariant')
+    # 影片/播放清單資訊與錯誤
+    infoReady = Signal('QVariant')
+    infoError = Signal(str)
+    # 播放清單分頁傳輸：先送標頭（transferId, header），再逐頁送條目（transferId, start, entries, isLast）
+    infoHeader = Signal(str, 'QVariant')
+    infoPage = Signal(str, int, 'QVariant', bool)
+    # 播放清單畫質批次：[{index, qualities}, ...]
+    qualitiesBatch = Signal('QVariant')
+    # 提示訊息：title, message
+    toast = Signal(str, str)
+    # 下載受理結果：taskId, status, detail
+    downloadAdmission = Signal(int, str, str)
+    # 非同步 API 請求結果：requestId, ok, payload
+    apiResponse = Signal(str, bool, 'QVariant')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._stats_lock = threading.Lock()
+        self._counts = {}
+        self._stats_since = time.time()
+        self._batches = {}  # 事件名稱 -> 待送出的項目
+        self._batch_scheduled = False
+        self._transfer_seq = 0
+        self._active_transfer = None
+        self._relay = _EventRelay(self)
+        self._relay.posted.connect(self._dispatch, Qt.QueuedConnection)
+
+    def post(self, name, *args):
+        """發出事件（任何執行緒皆可呼叫）"""
+        self._relay.posted.emit(('emit', name, args))
+
+    def append(self, name, item):
+        """把一個項目加入批次事件（例如 qualitiesBatch），主線程以固定頻率整批送出"""
+        self._relay.posted.emit(('append', name, item))
+
+    def send_info(self, info):
+        """送出影片資訊（任何執行緒皆可呼叫）：播放清單分頁傳送，單支影片一次送出"""
+        self._relay.posted.emit(('info', 'infoReady', info))
+
+    def _dispatch(self, message):
+        kind, name, payload = message
+        try:
+            if kind == 'info':
+                self._start_info_transfer(payload)
+                return
+            if kind == 'append':
+                self._batches.setdefault(name, []).append(payload)
+                if not self._batch_scheduled:
+                    self._batch_scheduled = True
+                    QTimer.singleShot(UI_EVENT_BATCH_INTERVAL_MS, self._flush_batches)
+                return
+            getattr(self, name).emit(*payload)
+            self._count(name)
+        except Exception as e:
+            api_console(f"發送前端事件 {name} 失敗: {e}", level=LogLevel.WARNING)
+
+    def _flush_batches(self):
+        self._batch_scheduled = False
+        batches, self._batches = self._batches, {}
+        for name, items in batches.items():
+            try:
+                getattr(self, name).emit(items)
+                self._count(name)
+            except Exception as e:
+                api_console(f"發送前端批次事件 {name} 失敗: {e}", level=LogLevel.WARNING)
+
+    def _start_info_transfer(self, info):
+        """播放清單：先送標頭與第一頁（前端可立即繪製），其餘分頁以計時器接續送出；
+        JSON 清理在每頁送出時才進行，不一次深拷貝整份資訊"""
+        if not isinstance(info, dict) or not info.get('is_playlist'):
+            self.infoReady.emit(to_json_compatible(info))
+            self._count('infoReady')
+            return
+        self._transfer_seq += 1
+        transfer_id = f"info-{self._transfer_seq}"
+        # 新的傳輸開始後，舊傳輸剩餘的分頁不再送出
+        self._active_transfer = transfer_id
+        entries = list(info.get('videos') or [])
+        header = to_json_compatible({k: v for k, v in info.items() if k != 'videos'})
+        header['entry_count'] = len(entries)
+        header['page_size'] = INFO_PAGE_SIZE
+        self.infoHeader.emit(transfer_id, header)
+        self._count('infoHeader')
+        self._send_info_page(transfer_id, entries, 0)
+
+    def _send_info_page(self, transfer_id, entries, start):
+        if transfer_id != self._active_transfer:
+            return
+        end = start + INFO_PAGE_SIZE
+        page = [to_json_compatible(entry) for entry in entries[start:end]]
+        is_last = end >= len(entries)
+        self.infoPage.emit(transfer_id, start, page, is_last)
+        self._count('infoPage')
+        if is_last:
+            self._active_transfer = None
+        else:
+            QTimer.singleShot(INFO_PAGE_INTERVAL_MS, lambda: self._send_info_page(transfer_id, entries, end))
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    @Slot(result='QVariant')
+    def get_stats(self):
+        """各事件的訊息數與每秒訊息率（自啟動或上次重設起）"""
+        with self._stats_lock:
+            elapsed = max(0.001, time.time() - self._stats_since)
+            return {
+                'elapsed_seconds': round(elapsed, 1),
+                'events': {
+                    name: {'count': count, 'per_second': round(count / elapsed, 2)}
+                    for name, count in self._counts.items()
+                },
+            }
+
+    @Slot()
+    def reset_stats(self):
+        with self._stats_lock:
+            self._counts = {}
+            self._stats_since = time.time()
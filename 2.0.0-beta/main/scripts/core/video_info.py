@@ -7,8 +7,11 @@
 import os
 import sys
 import math
+import time
 import hashlib
+import threading
 import urllib.request
+from collections import OrderedDict
 import yt_dlp
 
 # 添加父目錄到路徑，以便導入其他模組
@@ -20,6 +23,82 @@ if root_dir not in sys.path:
 
 from scripts.utils.logger import video_info_console, LogLevel
 from scripts.utils.file_utils import safe_path_join, resolve_relative_path, get_deno_path
+from scripts.config.constants import INFO_CACHE_MAX_ENTRIES, INFO_CACHE_TTL_SECONDS
+from scripts.core.format_preference import annotate_quality_costs
+
+# 影片資訊快取：url -> (時間戳, 精簡後的 info)
+_info_cache = OrderedDict()
+_info_cache_lock = threading.Lock()
+
+def remember_video_info(url, info_dict):
+    """快取精簡後的影片資訊（只保留頂層純量欄位與可用高度），供推算輸出檔名使用"""
+    if not url or not isinstance(info_dict, dict):
+        return
+    try:
+        trimmed = {k: v for k, v in info_dict.items() if isinstance(v, (str, int, float, bool))}
+        heights = sorted({f.get('height') for f in (info_dict.get('formats') or [])
+                          if isinstance(f, dict) and f.get('height') and f.get('vcodec') != 'none'})
+        if heights:
+            trimmed['_heights'] = heights
+        with _info_cache_lock:
+            _info_cache[url] = (time.time(), trimmed)
+            _info_cache.move_to_end(url)
+            while len(_info_cache) > INFO_CACHE_MAX_ENTRIES:
+                _info_cache.popitem(last=False)
+    except Exception as e:
+        video_info_console(f"快取影片資訊失敗: {e}")
+
+def get_cached_video_info(url):
+    """取得快取的影片資訊（副本），過期或不存在回傳 None"""
+    with _info_cache_lock:
+        item = _info_cache.get(url)
+        if not item:
+            return None
+        ts, info = item
+        if time.time() - ts > INFO_CACHE_TTL_SECONDS:
+            del _info_cache[url]
+            return None
+        _info_cache.move_to_end(url)
+        return dict(info)
+
+# 影片資訊解析服務（設定 useProcessExtraction 時由 Api 指定）；None 代表在本行程解析
+_extraction_service = None
+
+def set_extraction_service(service):
+    """指定解析服務（例如行程池 ExtractionService）；None 改回在本行程解析"""
+    global _extraction_service
+    _extraction_service = service
+
+def _extract_info(url, ydl_opts):
+    """執行 extract_info(download=False)：有解析服務時交給服務（回傳精簡後的 info）"""
+    service = _extraction_service
+    if service is not None:
+        return service.extract(url, ydl_opts)
+    return _extract_info_local(url, ydl_opts)
+
+def _extract_info_local(url, ydl_opts):
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+def _base_ydl_opts(root_dir, quiet=True):
+    """畫質/格式查詢共用的 yt-dlp 選項"""
+    ydl_opts = {
+        'quiet': quiet,
+        'no_warnings': quiet,
+        'simulate': True,
+        'extract_flat': False,
+    }
+    
+    # 設定 ffmpeg 路徑（如果存在）
+    ffmpeg_path = safe_path_join(root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
+    if os.path.exists(ffmpeg_path):
+        ydl_opts['ffmpeg_location'] = ffmpeg_path
+    
+    # 配置 Deno 作為外部 JavaScript 執行時（用於 YouTube 支援）
+    deno_path = get_deno_path(root_dir)
+    if deno_path:
+        ydl_opts['js_runtimes'] = {'deno': {'path': deno_path}}
+    return ydl_opts
 
 def extract_video_info(url, root_dir):
     """提取影片資訊"""
@@ -57,9 +136,9 @@ def extract_video_info(url, root_dir):
         video_info_console("yt-dlp 選項: quiet=True, no_warnings=True, simulate=True, extract_flat=False, ffmpeg_location=<ffmpeg.exe>")
         video_info_console("呼叫 yt-dlp.extract_info(download=False) 開始")
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
+        info_dict = _extract_info(url, ydl_opts)
         video_info_console("影片資訊取得完成", level=LogLevel.INFO)
+        remember_video_info(url, info_dict)
         
         # 詳細調試信息
         video_info_console(f"info_dict 類型: {type(info_dict)}")
@@ -185,6 +264,8 @@ def extract_video_info(url, root_dir):
         # 由高到低排序
         qualities.sort(key=lambda q: int(''.join(ch for ch in q['label'] if ch.isdigit()) or '0'), reverse=True)
         video_info_console(f"最終提取到 {len(qualities)} 個畫質選項: {[q['label'] for q in qualities]}")
+        # 依選到的串流編碼標示 mp4 的後處理成本（需要重新編碼的畫質顯示提示）
+        annotate_quality_costs(qualities, formats_for_quality, 'mp4')
         
         # 格式：與舊版一致，預設提供 mp4（影片）；若偵測到任何音訊流，額外提供 mp3（音訊）
         has_any_audio = any((f.get('acodec') and f.get('acodec') != 'none') for f in (info_dict.get('formats') or []))
@@ -432,6 +513,9 @@ def extract_playlist_info(url, root_dir):
             # 獲取上傳者資訊，優先使用影片的上傳者，否則使用播放清單的上傳者
             video_uploader = entry.get('uploader') or entry.get('channel') or playlist_uploader
             
+            # 扁平條目已有 id/title，足以推算輸出檔名
+            remember_video_info(video_url, entry)
+            
             videos.append({
                 'id': video_id,
                 'url': video_url,
@@ -475,28 +559,12 @@ def get_video_qualities_and_formats(url, root_dir):
     try:
         video_info_console(f"開始獲取畫質和格式: {url}")
         
-        # 設定 FFMPEG 路徑
-        ffmpeg_path = safe_path_join(root_dir, "lib", "ffmpeg-7.1.1-essentials_build", "ffmpeg-7.1.1-essentials_build", "bin", "ffmpeg.exe")
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'simulate': True,
-            'extract_flat': False,
-        }
+        ydl_opts = _base_ydl_opts(root_dir, quiet=True)
+        if 'js_runtimes' in ydl_opts:
+            video_info_console(f"已配置 Deno 路徑: {ydl_opts['js_runtimes']['deno']['path']}")
         
-        # 設定 ffmpeg 路徑（如果存在）
-        if os.path.exists(ffmpeg_path):
-            ydl_opts['ffmpeg_location'] = ffmpeg_path
-        
-        # 配置 Deno 作為外部 JavaScript 執行時（用於 YouTube 支援）
-        deno_path = get_deno_path(root_dir)
-        if deno_path:
-            ydl_opts['js_runtimes'] = {'deno': {'path': deno_path}}
-            video_info_console(f"已配置 Deno 路徑: {deno_path}")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
+        info_dict = _extract_info(url, ydl_opts)
+        remember_video_info(url, info_dict)
         
         # 提取畫質（邏輯與 extract_video_info 中一致；非常規畫質歸類成常見畫質）
         seen_heights = set()
@@ -531,6 +599,7 @@ def get_video_qualities_and_formats(url, root_dir):
                 qualities.append({'label': label, 'ratio': ''})
                 seen_heights.add(h)
         qualities.sort(key=lambda q: int(''.join(ch for ch in q['label'] if ch.isdigit()) or '0'), reverse=True)
+        annotate_quality_costs(qualities, info_dict.get('formats') or [], 'mp4')
         
         # 提取格式
         has_any_audio = any((f.get('acodec') and f.get('acodec') != 'none') for f in (info_dict.get('formats') or []))
@@ -22,7 +22,8 @@ from PySide6.QtWebChannel import QWebChannel
 from PySide6.QtCore import QUrl
 from PySide6.QtGui import QIcon
 from scripts.core.api import Api
-from scripts.config.constants import APP_NAME, WINDOW_WIDTH, WINDOW_HEIGHT
+from scripts.core import executors
+from scripts.config.constants import APP_NAME, WINDOW_WIDTH, WINDOW_HEIGHT, UI_STALL_WATCHDOG_ENABLED
 from scripts.utils.logger import main_window_console, LogLevel
 from scripts.utils.file_utils import safe_path_join, get_assets_path
 from scripts.ui.html_content import get_html_content
@@ -35,6 +36,7 @@ class MainWindow(QMainWindow):
         self.root_dir = root_dir
         self.api_instance = None
         self.tray_icon = None
+        self.stall_monitor = None
         self.init_ui()
     
     def init_ui(self):
@@ -77,6 +79,17 @@ class MainWindow(QMainWindow):
         self.api_instance.set_notification_handler(self._show_notification)
         self.web_channel = QWebChannel()
         self.web_channel.registerObject('api', self.api_instance)
+        # 後端 → 前端事件（影片資訊、進度批次等）以具型別信號傳遞
+        self.web_channel.registerObject('events', self.api_instance.events)
+        # 量測模式：監測主線程卡頓（統計以 'responsiveness' 名稱提供給前端/開發者工具查詢）
+        if UI_STALL_WATCHDOG_ENABLED:
+            try:
+                from scripts.ui.stall_monitor import UiStallMonitor
+                self.stall_monitor = UiStallMonitor(self)
+                self.web_channel.registerObject('responsiveness', self.stall_monitor)
+                self.stall_monitor.start()
+            except Exception as e:
+                main_window_console(f"啟動主線程卡頓監測失敗: {e}", level=LogLevel.WARNING)
         
         # 將 WebChannel 注入到 WebEngineView
         self.web_view.page().setWebChannel(self.web_channel)
@@ -84,10 +97,6 @@ class MainWindow(QMainWindow):
         # 載入 HTML 內容
         self.load_html_content()
         
-        # 連接信號
-        self.api_instance.infoReady.connect(self.on_info_ready)
-        self.api_instance.infoError.connect(self.on_info_error)
-        
         # 啟動背景版本檢查
         self.start_background_version_check()
     
@@ -244,107 +253,6 @@ class MainWindow(QMainWindow):
         except Exception as e:
             main_window_console(f"顯示桌面通知失敗: {e}", level=LogLevel.WARNING)
     
-    def on_info_ready(self, info):
-        """影片資訊準備就緒"""
-        try:
-            import json
-            import traceback
-            
-            main_window_console(f"on_info_ready 被調用，info 類型: {type(info)}")
-            
-            if not isinstance(info, dict):
-                main_window_console(f"info 不是字典類型: {type(info)}", level=LogLevel.ERROR)
-                return
-            
-            # 檢查是否為播放清單
-            is_playlist = info.get('is_playlist', False)
-            main_window_console(f"是否為播放清單: {is_playlist}")
-            
-            if is_playlist:
-                main_window_console(f"播放清單標題: {info.get('playlist_title', 'N/A')}")
-                main_window_console(f"播放清單影片數量: {info.get('video_count', 0)}")
-                videos = info.get('videos', [])
-                main_window_console(f"播放清單影片列表長度: {len(videos) if videos else 0}")
-            
-            # 清理不可序列化的數據
-            def clean_for_json(obj):
-                """遞歸清理對象，確保可以 JSON 序列化"""
-                if isinstance(obj, dict):
-                    return {k: clean_for_json(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [clean_for_json(item) for item in obj]
-                elif isinstance(obj, (str, int, float, bool, type(None))):
-                    return obj
-                else:
-                    # 嘗試轉換為字符串
-                    try:
-                        return str(obj)
-                    except:
-                        return None
-            
-            cleaned_info = clean_for_json(info)
-            main_window_console(f"數據清理完成")
-            
-            try:
-                safe_info = json.dumps(cleaned_info, ensure_ascii=False)
-                main_window_console(f"JSON 序列化成功，長度: {len(safe_info)}")
-            except Exception as json_err:
-                main_window_console(f"JSON 序列化失敗: {json_err}", level=LogLevel.ERROR)
-                main_window_console(f"JSON 序列化錯誤詳情:\n{traceback.format_exc()}")
-                return
-            
-            # 構建 JavaScript 代碼
-            js_code = f"""
-            (function(){{ 
-                console.log('[主視窗->前端] 準備調用 window.__onVideoInfo'); 
-                console.log('[主視窗->前端] window.__onVideoInfo 類型:', typeof window.__onVideoInfo);
-                if (window.__onVideoInfo && typeof window.__onVideoInfo === 'function'){{ 
-                    console.log('[主視窗->前端] window.__onVideoInfo 存在，開始調用'); 
-                    try {{
-                        window.__onVideoInfo({safe_info}); 
-                        console.log('[主視窗->前端] window.__onVideoInfo 調用完成'); 
-                    }} catch(e) {{
-                        console.error('[主視窗->前端] 調用 window.__onVideoInfo 時出錯:', e);
-                        console.error('[主視窗->前端] 錯誤堆疊:', e.stack);
-                    }}
-                }} else {{ 
-                    console.error('[主視窗->前端] window.__onVideoInfo 不存在或不是函數！'); 
-                    console.error('[主視窗->前端] window 對象:', Object.keys(window).filter(k => k.includes('VideoInfo')));
-                }} 
-            }})();
-            """
-            
-            main_window_console(f"準備執行 JavaScript，代碼長度: {len(js_code)}")
-            
-            # 使用 QTimer 確保在事件循環中執行
-            from PySide6.QtCore import QTimer
-            def execute_js():
-                try:
-                    self.web_view.page().runJavaScript(js_code)
-                    main_window_console(f"JavaScript 已執行")
-                except Exception as js_err:
-                    main_window_console(f"執行 JavaScript 失敗: {js_err}", level=LogLevel.ERROR)
-                    main_window_console(f"JavaScript 執行錯誤詳情:\n{traceback.format_exc()}")
-            
-            # 立即執行，但使用單次定時器確保在事件循環中
-            QTimer.singleShot(0, execute_js)
-            
-        except Exception as e:
-            main_window_console(f"發送影片資訊失敗: {e}", level=LogLevel.ERROR)
-            import traceback
-            main_window_console(f"錯誤詳情:\n{traceback.format_exc()}")
-    
-    def on_info_error(self, error_msg):
-        """影片資訊錯誤"""
-        try:
-            import json
-            safe_error = json.dumps(str(error_msg), ensure_ascii=False)
-            self.web_view.page().runJavaScript(
-                f"(function(){{ if (window.__onVideoInfoError){{ window.__onVideoInfoError({safe_error}); }} }})();"
-            )
-        except Exception as e:
-            main_window_console(f"發送錯誤資訊失敗: {e}", level=LogLevel.ERROR)
-    
     def start_background_version_check(self):
         """啟動背景版本檢查"""
         def check_version_in_background():
@@ -354,9 +262,10 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 main_window_console(f"背景版本檢查失敗: {e}", level=LogLevel.ERROR)
         
-        import threading
-        version_check_thread = threading.Thread(target=check_version_in_background, daemon=True)
-        version_check_thread.start()
+        try:
+            executors.submit('extraction', check_version_in_background)
+        except Exception as e:
+            main_window_console(f"啟動背景版本檢查失敗: {e}", level=LogLevel.WARNING)
     
     def closeEvent(self, event):
         """視窗關閉事件"""
@@ -364,6 +273,11 @@ class MainWindow(QMainWindow):
             main_window_console("主視窗即將關閉，正在清理資源...", level=LogLevel.INFO)
             if self.api_instance:
                 self.api_instance.close_settings()
+                self.api_instance.shutdown()
+            # 有序停止背景執行器：取消排隊中的工作，短暫等待執行中的工作
+            executors.shutdown_executors()
+            if self.stall_monitor:
+                self.stall_monitor.stop()
             event.accept()
         except Exception as e:
             main_window_console(f"關閉視窗時出錯: {e}", level=LogLevel.ERROR)
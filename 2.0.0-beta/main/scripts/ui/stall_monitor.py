@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主線程卡頓監測模組
+
+主線程上的心跳計時器每次觸發時，記錄「實際間隔 − 預期間隔」作為事件迴圈延遲；
+背景檢查執行緒發現心跳超過門檻沒有更新時，以 sys._current_frames 擷取主線程堆疊，
+推斷正在執行的 slot 並寫入日誌。延遲樣本整理成分桶統計與 p50/p90/p99，
+由 QWebChannel 公開的 get_stats() 提供回歸追蹤使用。
+"""
+
+import os
+import sys
+import time
+import threading
+import traceback
+from collections import deque
+
+# 添加父目錄到路徑，以便導入其他模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)  # main/scripts
+root_dir = os.path.dirname(parent_dir)  # main
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from PySide6.QtCore import QObject, Slot, QTimer, Qt
+from scripts.utils.logger import main_window_console, LogLevel
+from scripts.config.constants import UI_HEARTBEAT_INTERVAL_MS, UI_STALL_THRESHOLD_MS, UI_STALL_SAMPLE_WINDOW
+
+# 延遲分桶上限（毫秒），最後一桶收集超過最大值的樣本
+_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2000, 5000)
+_RECENT_STALLS = 50
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def _infer_slot(frame):
+    """由主線程堆疊推斷正在執行的 slot：最外層、屬於 QObject 方法的框架（事件迴圈直接呼叫的進入點）"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    for f in reversed(frames):
+        owner = f.f_locals.get('self')
+        if isinstance(owner, QObject) and not isinstance(owner, UiStallMonitor):
+            return f"{type(owner).__name__}.{f.f_code.co_name}"
+    if frames:
+        return frames[0].f_code.co_name
+    return None
+
+
+class UiStallMonitor(QObject):
+    """Qt 事件迴圈延遲監測器（需在主線程建立）"""
+
+    def __init__(self, parent=None, interval_ms=UI_HEARTBEAT_INTERVAL_MS, threshold_ms=UI_STALL_THRESHOLD_MS):
+        super().__init__(parent)
+        self.interval_ms = max(10, int(interval_ms))
+        self.threshold_ms = max(self.interval_ms, int(threshold_ms))
+        self._main_ident = threading.get_ident()
+        self._lock = threading.Lock()
+        self._last_beat = time.monotonic()
+        self._samples = deque(maxlen=UI_STALL_SAMPLE_WINDOW)
+        self._buckets = [0] * (len(_BUCKETS_MS) + 1)
+        self._max_lag_ms = 0.0
+        self._pending_stall = None  # 檢查執行緒已擷取、等待主線程恢復後補上時長的卡頓
+        self._stalls = deque(maxlen=_RECENT_STALLS)
+        self._stall_count = 0
+        self._by_slot = {}
+        self._since = time.time()
+        self._stop = threading.Event()
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setInterval(self.interval_ms)
+        self._timer.timeout.connect(self._beat)
+        self._thread = None
+
+    def start(self):
+        self._last_beat = time.monotonic()
+        self._timer.start()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._check_loop, name='ui-stall-monitor', daemon=True)
+            self._thread.start()
+        main_window_console(
+            f"主線程卡頓監測已啟動（心跳 {self.interval_ms} ms，門檻 {self.threshold_ms} ms）",
+            level=LogLevel.INFO,
+        )
+
+    def stop(self):
+        self._stop.set()
+        self._timer.stop()
+        stats = self.get_stats()
+        main_window_console(
+            f"主線程延遲統計: p50={stats['p50_ms']} ms, p99={stats['p99_ms']} ms, "
+            f"max={stats['max_ms']} ms, 卡頓 {stats['stall_count']} 次",
+            level=LogLevel.INFO,
+        )
+
+    # ---- 主線程：心跳 ----
+
+    def _beat(self):
+        now = time.monotonic()
+        prev = self._last_beat
+        lag_ms = max(0.0, (now - prev) * 1000.0 - self.interval_ms)
+        self._last_beat = now
+        with self._lock:
+            self._samples.append(lag_ms)
+            self._buckets[self._bucket_index(lag_ms)] += 1
+            self._max_lag_ms = max(self._max_lag_ms, lag_ms)
+            stall, self._pending_stall = self._pending_stall, None
+            if stall is not None:
+                # 檢查執行緒登記時主線程可能已恢復：卡頓結束於登記心跳之後的第一次心跳
+                beat = stall.pop('beat')
+                end = now if beat == prev else prev
+                stall['duration_ms'] = round((end - beat) * 1000.0, 1)
+                self._record_stall_locked(stall)
+        if stall is not None:
+            main_window_console(
+                f"主線程卡頓 {stall['duration_ms']} ms（slot: {stall['slot'] or '未知'}）",
+                level=LogLevel.WARNING,
+            )
+
+    @staticmethod
+    def _bucket_index(lag_ms):
+        for i, bound in enumerate(_BUCKETS_MS):
+            if lag_ms <= bound:
+                return i
+        return len(_BUCKETS_MS)
+
+    def _record_stall_locked(self, stall):
+        self._stall_count += 1
+        self._stalls.append(stall)
+        slot = stall['slot'] or '未知'
+        entry = self._by_slot.setdefault(slot, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['count'] += 1
+        entry['total_ms'] = round(entry['total_ms'] + stall['duration_ms'], 1)
+        entry['max_ms'] = max(entry['max_ms'], stall['duration_ms'])
+
+    # ---- 背景執行緒：偵測卡頓並擷取堆疊 ----
+
+    def _check_loop(self):
+        check_interval = max(0.01, self.threshold_ms / 2000.0)
+        reported_beat = None
+        while not self._stop.wait(check_interval):
+            last_beat = self._last_beat
+            blocked_ms = (time.monotonic() - last_beat) * 1000.0
+            # 每次卡頓只擷取一次（同一個心跳時間點）
+            if blocked_ms < self.threshold_ms or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+            try:
+                frame = sys._current_frames().get(self._main_ident)
+                slot = _infer_slot(frame)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            except Exception as e:
+                slot, stack = None, f"擷取堆疊失敗: {e}"
+            finally:
+                frame = None
+            with self._lock:
+                self._pending_stall = {
+                    'beat': last_beat,
+                    'at': time.strftime('%H:%M:%S'),
+                    'slot': slot,
+                    'duration_ms': None,
+                }
+            main_window_console(
+                f"主線程已卡住 {blocked_ms:.0f} ms（slot: {slot or '未知'}），主線程堆疊:\n{stack}",
+                level=LogLevel.WARNING,
+            )
+
+    # ---- 前端/除錯查詢 ----
+
+    @Slot(result='QVariant')
+    def get_stats(self):
+        """事件迴圈延遲的百分位數、分桶統計與最近的卡頓紀錄"""
+        with self._lock:
+            values = sorted(self._samples)
+            buckets = list(self._buckets)
+            stalls = [dict(s) for s in self._stalls]
+            by_slot = {k: dict(v) for k, v in self._by_slot.items()}
+            max_ms = self._max_lag_ms
+            stall_count = self._stall_count
+        labels = [f"<={b}ms" for b in _BUCKETS_MS] + [f">{_BUCKETS_MS[-1]}ms"]
+        return {
+            'elapsed_seconds': round(time.time() - self._since, 1),
+            'heartbeat_ms': self.interval_ms,
+            'threshold_ms': self.threshold_ms,
+            'samples': len(values),
+            'p50_ms': round(_percentile(values, 50), 1),
+            'p90_ms': round(_percentile(values, 90), 1),
+            'p99_ms': round(_percentile(values, 99), 1),
+            'max_ms': round(max_ms, 1),
+            'histogram': dict(zip(labels, buckets)),
+            'stall_count': stall_count,
+            'stalls_by_slot': by_slot,
+            'recent_stalls': stalls,
+        }
+
+    @Slot()
+    def reset_stats(self):
+        with self._lock:
+            self._samples.clear()
+            self._buckets = [0] * (len(_BUCKETS_MS) + 1)
+            self._max_lag_ms = 0.0
+            self._stalls.clear()
+            self._stall_count = 0
+            self._by_slot = {}
+            self._since = time.time()